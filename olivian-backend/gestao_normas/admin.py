@@ -1,5 +1,8 @@
 from django.contrib import admin
 from .models import Cliente, Norma, NormaCliente, PerfilUsuario, RevisaoSecundariaHistorico, Notificacao, Comentario
+from .comentarios import excluir_com_respostas
+from .notificacoes import enfileirar_revisao
+from .resumos import atualizar_resumos_clientes, atualizar_resumos_da_norma
 
 # 1. PRIMEIRO, defina o Inline para Comentarios
 class ComentarioInline(admin.TabularInline):
@@ -15,12 +18,39 @@ class NormaClienteAdmin(admin.ModelAdmin):
     search_fields = ('norma__norma', 'cliente__empresa')
     inlines = [ComentarioInline] # Agora o Python ja sabe o que e ComentarioInline
 
+    # Mantem o resumo de conformidade do cliente junto com a escrita (as
+    # exclusoes sao recalculadas pelo sinal de post_delete do vinculo)
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        atualizar_resumos_clientes([form.instance.cliente_id])
+
 # Outras classes Admin (a ordem delas nao importa)
 class NormaAdmin(admin.ModelAdmin):
     list_display = ('id', 'organizacao', 'norma', 'titulo', 'revisao_atual')
     list_filter = ('organizacao', 'idioma', 'formato')
     search_fields = ('organizacao', 'norma', 'titulo')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'revisao_atual' in form.changed_data:
+            enfileirar_revisao(obj)
+            atualizar_resumos_da_norma(obj)
+
+class ComentarioAdmin(admin.ModelAdmin):
+    list_display = ('id', 'norma_cliente', 'usuario', 'comentario_pai', 'data_criacao')
+
+    # Exclusao em massa remove as threads inteiras em um unico DELETE
+    # (o padrao do admin deixaria as respostas orfas, via SET_NULL)
+    def delete_queryset(self, request, queryset):
+        cliente_ids = set(queryset.values_list('norma_cliente__cliente_id', flat=True))
+        excluir_com_respostas(queryset.values_list('pk', flat=True))
+        atualizar_resumos_clientes(cliente_ids)
+
+    def delete_model(self, request, obj):
+        cliente_id = obj.norma_cliente.cliente_id
+        super().delete_model(request, obj)
+        atualizar_resumos_clientes([cliente_id])
+
 class ClienteAdmin(admin.ModelAdmin):
     list_display = ('id', 'empresa', 'dominio', 'data_registro')
     list_filter = ('cidade', 'estado')
@@ -34,4 +64,4 @@ admin.site.register(NormaCliente, NormaClienteAdmin) # Usa a classe personalizad
 admin.site.register(PerfilUsuario)
 admin.site.register(RevisaoSecundariaHistorico)
 admin.site.register(Notificacao)
-admin.site.register(Comentario)
\ No newline at end of file
+admin.site.register(Comentario, ComentarioAdmin)
\ No newline at end of file
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class GestaoNormasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gestao_normas'
+
+    def ready(self):
+        # Registra os receptores de invalidacao do cache
+        from . import signals  # noqa: F401
+        # Medicao de queries e serializacao por requisicao
+        from .instrumentacao import instalar
+        instalar()
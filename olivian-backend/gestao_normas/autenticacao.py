@@ -0,0 +1,277 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .models import CAMPOS_PERMISSAO, PerfilUsuario, UsuarioDoToken
+
+
+# Usuario, PerfilUsuario e Cliente em uma unica query: o ContextoCliente
+# (gestao_normas/contexto.py) reaproveita o perfil carregado aqui.
+RELACOES_DO_USUARIO = ('perfilusuario__cliente',)
+
+# Claims do perfil nos tokens (so para usuarios com PerfilUsuario)
+CLAIM_PERFIL = 'perfil_id'
+CLAIM_CLIENTE = 'cliente_id'
+CLAIM_PERMISSOES = 'permissoes'
+CLAIM_VERSAO = 'versao_permissoes'
+CLAIMS_DO_PERFIL = (CLAIM_PERFIL, CLAIM_CLIENTE, CLAIM_PERMISSOES, CLAIM_VERSAO, 'is_staff', 'is_superuser')
+
+
+def _cache_ativo():
+    # Guardar o contexto pela validade do token so e seguro com um cache
+    # compartilhado entre os processos: a invalidacao precisa chegar a todos
+    return getattr(settings, 'CONTEXTO_JWT_CACHE', False)
+
+
+def _cache():
+    return caches[getattr(settings, 'CONTEXTO_JWT_ALIAS_CACHE', 'default')]
+
+
+def _chave(usuario_id):
+    return f'contexto_jwt:{usuario_id}'
+
+
+def _chave_versao(usuario_id):
+    return f'versao_permissoes:{usuario_id}'
+
+
+def carregar_usuario(usuario_id, token):
+    """
+    Usuario com perfil e cliente ja carregados, ou None. Com
+    settings.CONTEXTO_JWT_CACHE, guarda o resultado ate o token expirar
+    (uma entrada por usuario, valida so para o jti que a gravou).
+    """
+    jti = token.get(api_settings.JTI_CLAIM)
+    usar_cache = _cache_ativo() and jti
+    if usar_cache:
+        guardado = _cache().get(_chave(usuario_id))
+        if guardado is not None and guardado[0] == jti:
+            return guardado[1]
+
+    modelo = get_user_model()
+    try:
+        usuario = modelo.objects.select_related(*RELACOES_DO_USUARIO).get(**{api_settings.USER_ID_FIELD: usuario_id})
+    except modelo.DoesNotExist:
+        return None
+
+    if usar_cache:
+        restante = int(token['exp'] - time.time())
+        if restante > 0:
+            _cache().set(_chave(usuario_id), (jti, usuario), restante)
+    return usuario
+
+
+def normalizar_email(email):
+    return email.strip().lower()
+
+
+def usuarios_por_email(email):
+    """
+    Usuarios com o e-mail, sem diferenciar maiusculas. O filtro repete a
+    expressao e a condicao do indice unico auth_user_email_lower (migration
+    0025): a busca nao percorre a tabela, qualquer que seja o numero de
+    usuarios.
+    """
+    return (
+        get_user_model().objects
+        .alias(email_normalizado=Lower('email'))
+        .filter(email_normalizado=normalizar_email(email))
+        .exclude(email='')
+    )
+
+
+def invalidar_contexto_usuarios(usuario_ids):
+    """Descarta o contexto guardado dos usuarios (depois do commit)."""
+    if not _cache_ativo():
+        return
+    # Pode receber um queryset: so e avaliado com o cache ligado
+    usuario_ids = list(usuario_ids)
+    if usuario_ids:
+        transaction.on_commit(lambda: _cache().delete_many([_chave(pk) for pk in usuario_ids]))
+
+
+# ---------------------------------------------------------------------------
+# Claims de perfil e versao das permissoes
+# ---------------------------------------------------------------------------
+
+def versao_permissoes(usuario_id):
+    """
+    Versao atual das permissoes do usuario (0 sem perfil), lida do cache. Em
+    cache local por processo, um token invalidado em outro processo ainda
+    vale por ate VERSAO_PERMISSOES_TTL segundos.
+    """
+    cache = _cache()
+    versao = cache.get(_chave_versao(usuario_id))
+    if versao is None:
+        versao = (
+            PerfilUsuario.objects.filter(usuario_id=usuario_id).values_list('versao_permissoes', flat=True).first()
+            or 0
+        )
+        cache.set(_chave_versao(usuario_id), versao, getattr(settings, 'VERSAO_PERMISSOES_TTL', 60))
+    return versao
+
+
+def descartar_versoes_permissoes(usuario_ids):
+    usuario_ids = list(usuario_ids)
+    if usuario_ids:
+        transaction.on_commit(lambda: _cache().delete_many([_chave_versao(pk) for pk in usuario_ids]))
+
+
+def incrementar_versao_permissoes(usuario_ids):
+    """
+    Invalida os tokens ja emitidos dos usuarios (uma UPDATE): o proximo
+    request com um deles recebe 401 e o usuario precisa de um token novo.
+    """
+    usuario_ids = list(usuario_ids)
+    if not usuario_ids:
+        return
+    PerfilUsuario.objects.filter(usuario_id__in=usuario_ids).update(versao_permissoes=F('versao_permissoes') + 1)
+    descartar_versoes_permissoes(usuario_ids)
+    invalidar_contexto_usuarios(usuario_ids)
+
+
+def adicionar_claims_do_perfil(token, usuario):
+    """Grava no token o cliente, as permissoes e a versao do perfil do usuario."""
+    perfil = getattr(usuario, 'perfilusuario', None)
+    if perfil is None:
+        for claim in CLAIMS_DO_PERFIL:
+            token.payload.pop(claim, None)
+        return token
+    token[CLAIM_PERFIL] = perfil.pk
+    token[CLAIM_CLIENTE] = perfil.cliente_id
+    token[CLAIM_PERMISSOES] = {campo: getattr(perfil, campo) for campo in CAMPOS_PERMISSAO}
+    token[CLAIM_VERSAO] = perfil.versao_permissoes
+    token['is_staff'] = usuario.is_staff
+    token['is_superuser'] = usuario.is_superuser
+    return token
+
+
+def _instancia_das_claims(modelo, valores):
+    # Instancia "carregada do banco" so com esses campos; os demais ficam adiados
+    campos = [campo.attname for campo in modelo._meta.concrete_fields if campo.attname in valores]
+    return modelo.from_db(DEFAULT_DB_ALIAS, campos, [valores[campo] for campo in campos])
+
+
+def usuario_das_claims(token):
+    """UsuarioDoToken com o PerfilUsuario ja ligado, montados sem consultar o banco."""
+    # O simplejwt grava o id como texto
+    usuario_id = UsuarioDoToken._meta.pk.to_python(token[api_settings.USER_ID_CLAIM])
+    usuario = _instancia_das_claims(UsuarioDoToken, {
+        'id': usuario_id,
+        'is_superuser': bool(token.get('is_superuser')),
+        'is_staff': bool(token.get('is_staff')),
+        'is_active': True,
+    })
+    permissoes = token[CLAIM_PERMISSOES]
+    perfil = _instancia_das_claims(PerfilUsuario, {
+        'id': token[CLAIM_PERFIL],
+        'usuario_id': usuario_id,
+        'cliente_id': token[CLAIM_CLIENTE],
+        'versao_permissoes': token[CLAIM_VERSAO],
+        **{campo: bool(permissoes.get(campo)) for campo in CAMPOS_PERMISSAO},
+    })
+    PerfilUsuario.usuario.field.set_cached_value(perfil, usuario)
+    UsuarioDoToken.perfilusuario.related.set_cached_value(usuario, perfil)
+    return usuario
+
+
+class RefreshTokenComPerfil(RefreshToken):
+    """RefreshToken (e o access derivado dele) com as claims do perfil."""
+
+    @classmethod
+    def for_user(cls, user):
+        return adicionar_claims_do_perfil(super().for_user(user), user)
+
+
+class TokenRefreshComPerfilSerializer(TokenRefreshSerializer):
+    """
+    Renovacao que le o perfil de novo: o access novo (e o refresh
+    rotacionado) sai com as permissoes e a versao atuais, e nao com as do
+    token antigo.
+    """
+    token_class = RefreshTokenComPerfil
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+
+        modelo = get_user_model()
+        filtro = {api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}
+        usuario = modelo.objects.select_related('perfilusuario').filter(**filtro).first()
+        if usuario is None or not api_settings.USER_AUTHENTICATION_RULE(usuario):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        adicionar_claims_do_perfil(refresh, usuario)
+
+        data = {'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                try:
+                    refresh.blacklist()
+                except AttributeError:
+                    # App de blacklist nao instalado
+                    pass
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
+        return data
+
+
+# ---------------------------------------------------------------------------
+# Autenticacao
+# ---------------------------------------------------------------------------
+
+class JWTAuthenticationComPerfil(JWTAuthentication):
+    """
+    JWTAuthentication que carrega o perfil e o cliente junto com o usuario,
+    para que as views e serializers nao busquem o PerfilUsuario de novo.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            usuario_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        usuario = carregar_usuario(usuario_id, validated_token)
+        if usuario is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not usuario.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(usuario.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return usuario
+
+
+class JWTAuthenticationSemEstado(JWTAuthenticationComPerfil):
+    """
+    Tokens com as claims do perfil: usuario e perfil montados das claims, sem
+    query (a versao das permissoes vem do cache). Tokens sem essas claims
+    (emitidos antes delas, ou de usuarios sem perfil) seguem pelo banco.
+    """
+
+    def get_user(self, validated_token):
+        if CLAIM_PERFIL not in validated_token:
+            return super().get_user(validated_token)
+        usuario_id = UsuarioDoToken._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        if validated_token.get(CLAIM_VERSAO) != versao_permissoes(usuario_id):
+            raise AuthenticationFailed(
+                'As permissoes do usuario mudaram. Faca login novamente.', code='token_desatualizado',
+            )
+        return usuario_das_claims(validated_token)
@@ -0,0 +1,44 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast, Greatest
+
+from .models import Norma, codigo_normalizado
+
+
+def buscar_normas(termo, cliente=None):
+    """
+    Busca no catalogo de normas por texto (organizacao, codigo, titulo e
+    observacoes, em portugues e ingles) e por semelhanca do codigo.
+
+    - A busca textual usa o vetor gerado Norma.busca_vetor (indice GIN).
+    - A busca aproximada compara o codigo normalizado ("GMW 3059" -> "GMW3059")
+      com o operador de trigramas % (indice GIN gin_trgm_ops).
+
+    O resultado vem anotado com 'relevancia', o maior entre o rank textual e a
+    similaridade do codigo. Com 'cliente', restringe as normas desse cliente.
+    """
+    consulta = (
+        SearchQuery(termo, config='portuguese', search_type='websearch')
+        | SearchQuery(termo, config='english', search_type='websearch')
+    )
+    codigo = termo.replace(' ', '').upper()
+
+    normas = Norma.objects.all()
+    if cliente is not None:
+        normas = normas.filter(normacliente__cliente=cliente)
+
+    return (
+        normas.annotate(codigo_busca=codigo_normalizado(F('norma')))
+        .filter(Q(busca_vetor=consulta) | Q(codigo_busca__trigram_similar=codigo))
+        .annotate(
+            # Cast para double precision: ts_rank e similarity devolvem real, e o
+            # valor precisa sobreviver exato ao cursor da paginacao.
+            relevancia=Cast(
+                Greatest(
+                    SearchRank(F('busca_vetor'), consulta),
+                    TrigramSimilarity('codigo_busca', codigo),
+                ),
+                FloatField(),
+            )
+        )
+    )
@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .models import Norma, NormaCliente
+from .versoes import versao_do_cliente
+
+
+# Alias em settings.CACHES. O backend e plugavel: LocMemCache (LRU em memoria
+# por processo, com expiracao) por padrao, ou RedisCache compartilhado.
+ALIAS_CACHE = 'normas'
+
+# Com LocMemCache cada processo tem o seu cache e a invalidacao so alcanca o
+# processo que fez a escrita: as normas expiram em poucos segundos, e nao no
+# TIMEOUT do alias, para que os demais workers vejam a mudanca logo.
+TIMEOUT_LOCAL = 30
+
+# Campos guardados por norma, na ordem do modelo (exigida por Norma.from_db).
+# O vetor de busca fica de fora: so e usado em queries.
+CAMPOS_NORMA = tuple(campo.attname for campo in Norma._meta.concrete_fields if campo.attname != 'busca_vetor')
+
+_CHAVE_VERSAO = 'catalogo:versao'
+
+
+class MetricasCache:
+    """Acertos e falhas por tipo de registro, contados no processo atual."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._acertos = Counter()
+        self._falhas = Counter()
+
+    def registrar(self, tipo, acertos=0, falhas=0):
+        with self._lock:
+            self._acertos[tipo] += acertos
+            self._falhas[tipo] += falhas
+
+    def resumo(self):
+        with self._lock:
+            tipos = sorted(set(self._acertos) | set(self._falhas))
+            resumo = {}
+            for tipo in tipos:
+                acertos, falhas = self._acertos[tipo], self._falhas[tipo]
+                total = acertos + falhas
+                resumo[tipo] = {
+                    'acertos': acertos,
+                    'falhas': falhas,
+                    'taxa_acerto': round(acertos / total, 4) if total else None,
+                }
+            return resumo
+
+    def zerar(self):
+        with self._lock:
+            self._acertos.clear()
+            self._falhas.clear()
+
+
+metricas = MetricasCache()
+
+
+def _cache():
+    return caches[ALIAS_CACHE]
+
+
+def versao_catalogo():
+    # Faz parte de todas as chaves: incrementa-la invalida o cache inteiro.
+    # Comeca pelo relogio, e nao em 1, para que uma versao descartada pelo
+    # LRU nao volte a valer para registros antigos ainda no cache.
+    return _cache().get_or_set(_CHAVE_VERSAO, time.time_ns, timeout=None)
+
+
+def _chave_norma(versao, norma_id, versao_norma):
+    return f'norma:{versao}:{norma_id}:{versao_norma}'
+
+
+def _chave_versao_norma(norma_id):
+    return f'norma:{norma_id}:versao'
+
+
+def _incrementar(cache, chave):
+    try:
+        cache.incr(chave)
+    except ValueError:
+        # Versao ainda nao existe (ou foi descartada): comeca uma nova
+        cache.set(chave, time.time_ns(), timeout=None)
+
+
+def _versoes_das_normas(cache, norma_ids):
+    """
+    {norma_id: versao}. Cada norma tem a sua versao no cache, incrementada a
+    cada escrita; as ausentes comecam pelo relogio, como a do catalogo.
+    """
+    chaves = {_chave_versao_norma(norma_id): norma_id for norma_id in norma_ids}
+    versoes = {chaves[chave]: versao for chave, versao in cache.get_many(chaves).items()}
+    novas = {chave: time.time_ns() for chave, norma_id in chaves.items() if norma_id not in versoes}
+    if novas:
+        cache.set_many(novas, timeout=None)
+        versoes.update({chaves[chave]: versao for chave, versao in novas.items()})
+    return versoes
+
+
+def _chave_cliente(cliente_id, versao):
+    return f'cliente:{cliente_id}:{versao}:revisoes'
+
+
+def _timeout_normas(cache):
+    if isinstance(cache, LocMemCache):
+        return min(TIMEOUT_LOCAL, cache.default_timeout or TIMEOUT_LOCAL)
+    return cache.default_timeout
+
+
+def obter_normas(norma_ids):
+    """
+    {id: Norma} com os campos de CAMPOS_NORMA, lidos do cache. So as normas
+    ausentes no cache sao buscadas no banco (uma query) e gravadas nele.
+
+    As versoes das normas sao lidas antes do banco: se uma escrita invalidar a
+    norma entre a leitura e a gravacao, a linha antiga vai para uma chave que
+    ninguem mais consulta.
+    """
+    norma_ids = set(norma_ids)
+    if not norma_ids:
+        return {}
+    cache = _cache()
+    versao = versao_catalogo()
+    versoes = _versoes_das_normas(cache, norma_ids)
+    chaves = {_chave_norma(versao, norma_id, versoes[norma_id]): norma_id for norma_id in norma_ids}
+    encontrados = cache.get_many(chaves)
+    valores = {chaves[chave]: valor for chave, valor in encontrados.items()}
+
+    faltando = norma_ids - valores.keys()
+    metricas.registrar('normas', acertos=len(valores), falhas=len(faltando))
+    if faltando:
+        novos = {linha[0]: linha for linha in Norma.objects.filter(pk__in=faltando).values_list(*CAMPOS_NORMA)}
+        cache.set_many(
+            {_chave_norma(versao, norma_id, versoes[norma_id]): linha for norma_id, linha in novos.items()},
+            timeout=_timeout_normas(cache),
+        )
+        valores.update(novos)
+
+    return {norma_id: Norma.from_db('default', CAMPOS_NORMA, linha) for norma_id, linha in valores.items()}
+
+
+def obter_norma(norma_id):
+    """Norma do cache (ou do banco); levanta Norma.DoesNotExist como o ORM."""
+    try:
+        norma_id = int(norma_id)
+    except (TypeError, ValueError):
+        raise Norma.DoesNotExist
+    norma = obter_normas([norma_id]).get(norma_id)
+    if norma is None:
+        raise Norma.DoesNotExist(f'Norma {norma_id} nao encontrada.')
+    return norma
+
+
+def revisoes_do_cliente(cliente_id, versao=None):
+    """
+    {norma_id: data_revisao_cliente} de todas as normas vinculadas ao cliente:
+    o conjunto de normas do cliente, com a revisao que ele possui.
+
+    A chave leva a versao dos dados do cliente (VersaoCliente, no banco), que
+    toda escrita nos vinculos incrementa: o mapa antigo deixa de valer em todos
+    os processos, mesmo com um cache por processo.
+    """
+    if versao is None:
+        versao = versao_do_cliente(cliente_id).versao
+    cache = _cache()
+    chave = _chave_cliente(cliente_id, versao)
+    revisoes = cache.get(chave)
+    if revisoes is not None:
+        metricas.registrar('clientes', acertos=1)
+        return revisoes
+    metricas.registrar('clientes', falhas=1)
+    revisoes = dict(NormaCliente.objects.filter(cliente_id=cliente_id).values_list('norma_id', 'data_revisao_cliente'))
+    cache.set(chave, revisoes)
+    return revisoes
+
+
+def _apos_commit(funcao):
+    # Invalida so depois do commit: antes disso outra requisicao poderia
+    # repopular o cache com os dados antigos
+    transaction.on_commit(funcao)
+
+
+def invalidar_normas(norma_ids):
+    # Incrementa a versao de cada norma em vez de apagar a entrada: uma
+    # requisicao que leu o banco antes do commit grava na versao anterior
+    def incrementar():
+        cache = _cache()
+        for norma_id in norma_ids:
+            _incrementar(cache, _chave_versao_norma(norma_id))
+
+    norma_ids = list(norma_ids)
+    if norma_ids:
+        _apos_commit(incrementar)
+
+
+def invalidar_catalogo():
+    """Invalida todas as normas de uma vez (escritas em massa)."""
+    _apos_commit(lambda: _incrementar(_cache(), _CHAVE_VERSAO))
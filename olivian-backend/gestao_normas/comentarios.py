@@ -0,0 +1,114 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Left
+
+from .models import DIGITOS_CAMINHO, SEPARADOR_CAMINHO, Comentario
+from .versoes import incrementar_versoes_dos_vinculos
+
+
+# Niveis de respostas serializados abaixo de cada comentario raiz
+PROFUNDIDADE_MAXIMA = 10
+
+
+def subarvore(comentario, incluir_raiz=True):
+    """Comentario e todas as suas respostas, na ordem da thread (uma faixa do indice)."""
+    filtro = Q(caminho__startswith=f'{comentario.caminho}{SEPARADOR_CAMINHO}')
+    if incluir_raiz:
+        filtro |= Q(pk=comentario.pk)
+    return Comentario.objects.filter(filtro, norma_cliente_id=comentario.norma_cliente_id).order_by('caminho')
+
+
+def carregar_respostas(norma_cliente_id, raizes=None, profundidade_maxima=None):
+    """
+    Respostas da thread de um NormaCliente, lidas em uma unica query pelo
+    caminho materializado e agrupadas pelo id do comentario pai. Com
+    'raizes', so as subarvores desses comentarios; com 'profundidade_maxima',
+    so ate esse nivel.
+    """
+    consulta = Comentario.objects.filter(norma_cliente_id=norma_cliente_id, profundidade__gt=0)
+    if raizes is not None:
+        filtro = Q()
+        for raiz in raizes:
+            filtro |= Q(caminho__startswith=f'{raiz.caminho}{SEPARADOR_CAMINHO}')
+        if not filtro:
+            return {}
+        consulta = consulta.filter(filtro)
+    if profundidade_maxima is not None:
+        consulta = consulta.filter(profundidade__lte=profundidade_maxima)
+
+    respostas = defaultdict(list)
+    for comentario in consulta.select_related('usuario').order_by('caminho'):
+        respostas[comentario.comentario_pai_id].append(comentario)
+    return respostas
+
+
+def contar_respostas_por_raiz(norma_cliente_id):
+    """{id do comentario raiz: total de respostas na thread}, em uma query."""
+    contagens = (
+        Comentario.objects.filter(norma_cliente_id=norma_cliente_id, profundidade__gt=0)
+        .annotate(raiz=Left('caminho', DIGITOS_CAMINHO))
+        .order_by()
+        .values('raiz')
+        .annotate(total=Count('pk'))
+        .values_list('raiz', 'total')
+    )
+    return {int(raiz): total for raiz, total in contagens}
+
+
+def reconstruir_caminhos():
+    """
+    Recalcula caminho e profundidade de todos os comentarios a partir de
+    comentario_pai (um UPDATE com CTE recursiva). Retorna as linhas alteradas.
+    """
+    tabela = connection.ops.quote_name(Comentario._meta.db_table)
+    sql = f"""
+        WITH RECURSIVE arvore(id, caminho, profundidade) AS (
+            SELECT id, lpad(id::text, %s, '0'), 0
+            FROM {tabela} WHERE comentario_pai_id IS NULL
+            UNION ALL
+            SELECT filho.id, arvore.caminho || %s || lpad(filho.id::text, %s, '0'), arvore.profundidade + 1
+            FROM {tabela} filho JOIN arvore ON filho.comentario_pai_id = arvore.id
+        )
+        UPDATE {tabela} SET caminho = arvore.caminho, profundidade = arvore.profundidade
+        FROM arvore
+        WHERE {tabela}.id = arvore.id
+          AND ({tabela}.caminho, {tabela}.profundidade) IS DISTINCT FROM (arvore.caminho, arvore.profundidade)
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [DIGITOS_CAMINHO, SEPARADOR_CAMINHO, DIGITOS_CAMINHO])
+        return cursor.rowcount
+
+
+def excluir_com_respostas(comentario_ids):
+    """
+    Remove os comentarios informados e todas as respostas abaixo deles em um
+    unico DELETE: os descendentes sao coletados por uma CTE recursiva no
+    proprio banco, sem recursao em Python nem uma query por comentario.
+    Retorna o numero de comentarios removidos.
+    """
+    comentario_ids = [int(pk) for pk in comentario_ids]
+    if not comentario_ids:
+        return 0
+    tabela = connection.ops.quote_name(Comentario._meta.db_table)
+    # UNION (e nao UNION ALL) tambem protege contra ciclos em dados corrompidos
+    sql = f"""
+        WITH RECURSIVE subarvore(id) AS (
+            SELECT id FROM {tabela} WHERE id = ANY(%s)
+            UNION
+            SELECT filho.id FROM {tabela} filho
+            JOIN subarvore ON filho.comentario_pai_id = subarvore.id
+        ), removidos AS (
+            DELETE FROM {tabela} WHERE id IN (SELECT id FROM subarvore)
+            RETURNING norma_cliente_id
+        )
+        SELECT norma_cliente_id, COUNT(*) FROM removidos GROUP BY norma_cliente_id
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [comentario_ids])
+            removidos = dict(cursor.fetchall())
+        # Sem sinais de post_delete: avisa os clientes afetados aqui
+        incrementar_versoes_dos_vinculos(removidos)
+    return sum(removidos.values())
@@ -0,0 +1,70 @@
+import hashlib
+
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .contexto import get_contexto_cliente
+from .notificacoes import inicio_do_dia
+
+
+class _NaoModificado(Exception):
+    # Interrompe a view logo apos autenticacao/permissoes com a resposta 304
+    def __init__(self, resposta):
+        self.resposta = resposta
+
+
+class RespostaCondicionalMixin:
+    """
+    GET condicional para views de leitura do cliente: ETag forte e
+    Last-Modified derivados da versao dos dados do cliente (VersaoCliente),
+    da do perfil (VersaoPerfil), do usuario e da URL completa. Se o navegador ja tem a versao atual
+    (If-None-Match / If-Modified-Since), a view responde 304 sem montar o
+    queryset nem serializar.
+    """
+    # True quando a resposta muda com a data (ex.: dias para a renovacao)
+    depende_do_dia = False
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.marca_de_versao = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+        perfil = get_contexto_cliente(request).perfil
+        if perfil is None:
+            return
+        self.marca_de_versao = self.get_marca_de_versao(request, perfil)
+        etag, ultima_modificacao = self.marca_de_versao
+        resposta = get_conditional_response(request, etag=etag, last_modified=ultima_modificacao)
+        if resposta is not None:
+            raise _NaoModificado(resposta)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, _NaoModificado):
+            return exc.resposta
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        marca = getattr(self, 'marca_de_versao', None)
+        if marca is not None and response.status_code in (200, 304):
+            etag, ultima_modificacao = marca
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(ultima_modificacao)
+            # Sempre revalidar; o cache e so do navegador do usuario
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_marca_de_versao(self, request, perfil):
+        contexto = get_contexto_cliente(request)
+        versao, versao_perfil = contexto.versao, contexto.versao_perfil
+        partes = [
+            self.__class__.__name__, request.user.pk, perfil.cliente_id, versao.versao, versao_perfil.versao,
+            request.get_full_path(),
+        ]
+        ultima_modificacao = max(versao.data_atualizacao, versao_perfil.data_atualizacao)
+        if self.depende_do_dia:
+            partes.append(timezone.localdate().isoformat())
+            ultima_modificacao = max(ultima_modificacao, inicio_do_dia())
+        resumo = hashlib.sha256('|'.join(map(str, partes)).encode()).hexdigest()[:32]
+        return f'"{resumo}"', int(ultima_modificacao.timestamp())
@@ -0,0 +1,169 @@
+from functools import cached_property
+
+from django.db.models import (
+    Case, CharField, Count, Exists, F, FilteredRelation, OuterRef, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce
+
+from .cache import revisoes_do_cliente
+from .models import Comentario, Norma, PerfilUsuario
+from .versoes import versoes_do_perfil
+
+
+# Acima deste numero de normas, carrega o acervo inteiro do cliente em vez de
+# montar um "IN (...)" gigante com os IDs pedidos.
+LIMITE_FILTRO_POR_ID = 1000
+
+
+class ContextoCliente:
+    """
+    Dados do cliente do usuario logado, carregados uma unica vez por requisicao.
+
+    O NormaSerializer consulta este objeto em vez de buscar PerfilUsuario e
+    NormaCliente a cada linha. As revisoes do cliente vem do cache do catalogo
+    e a contagem de comentarios e carregada em lote (uma query) para todas as
+    normas de uma pagina.
+    """
+
+    def __init__(self, usuario):
+        self.usuario = usuario
+        self._comentarios = {}
+        self._normas_carregadas = set()
+        self._acervo_completo = False
+
+    @cached_property
+    def perfil(self):
+        if self.usuario is None or not self.usuario.is_authenticated:
+            return None
+        # Carregado junto com o usuario pela autenticacao (autenticacao.py)
+        if type(self.usuario).perfilusuario.is_cached(self.usuario):
+            return getattr(self.usuario, 'perfilusuario', None)
+        try:
+            return PerfilUsuario.objects.select_related('cliente').get(usuario=self.usuario)
+        except PerfilUsuario.DoesNotExist:
+            return None
+
+    @property
+    def cliente(self):
+        return self.perfil.cliente if self.perfil else None
+
+    @property
+    def cliente_id(self):
+        return self.perfil.cliente_id if self.perfil else None
+
+    @cached_property
+    def _versoes(self):
+        if self.perfil is None:
+            return None, None
+        return versoes_do_perfil(self.perfil)
+
+    @property
+    def versao(self):
+        # VersaoCliente: base dos ETags e da chave das revisoes no cache
+        return self._versoes[0]
+
+    @property
+    def versao_perfil(self):
+        # VersaoPerfil: favoritas e notificacoes do proprio usuario
+        return self._versoes[1]
+
+    @cached_property
+    def revisoes(self):
+        # {norma_id: data_revisao_cliente} das normas vinculadas ao cliente
+        if self.perfil is None:
+            return {}
+        return revisoes_do_cliente(self.perfil.cliente_id, self.versao.versao)
+
+    @cached_property
+    def favoritas(self):
+        if self.perfil is None:
+            return frozenset()
+        return frozenset(self.perfil.normas_favoritas.values_list('pk', flat=True))
+
+    def preparar(self, norma_ids):
+        """Carrega a contagem de comentarios das normas ainda nao vistas."""
+        if self._acervo_completo:
+            return
+        pendentes = set(norma_ids) - self._normas_carregadas
+        if not pendentes:
+            return
+        self._normas_carregadas.update(pendentes)
+        # Comentarios so existem nas normas vinculadas ao cliente
+        pendentes &= self.revisoes.keys()
+        if not pendentes:
+            return
+
+        comentarios = Comentario.objects.filter(norma_cliente__cliente_id=self.perfil.cliente_id)
+        if len(pendentes) > LIMITE_FILTRO_POR_ID:
+            self._acervo_completo = True
+        else:
+            comentarios = comentarios.filter(norma_cliente__norma_id__in=pendentes)
+
+        self._comentarios.update(
+            comentarios.values('norma_cliente__norma_id')
+            .annotate(total=Count('id'))
+            .values_list('norma_cliente__norma_id', 'total')
+        )
+
+    def sua_revisao(self, norma):
+        return self.revisoes.get(norma.pk)
+
+    def status_atualizado(self, norma):
+        sua_revisao = self.sua_revisao(norma)
+        if sua_revisao is None:
+            return "Indefinido"
+        if norma.revisao_atual > sua_revisao:
+            return "DESATUALIZADO"
+        return "ATUALIZADO"
+
+    def is_favorita(self, norma):
+        return norma.pk in self.favoritas
+
+    def comentarios_count(self, norma):
+        self.preparar([norma.pk])
+        return self._comentarios.get(norma.pk, 0)
+
+
+def get_contexto_cliente(request):
+    """Retorna o ContextoCliente da requisicao, criando-o na primeira chamada."""
+    if request is None:
+        return ContextoCliente(None)
+    contexto = getattr(request, '_contexto_cliente', None)
+    if contexto is None:
+        contexto = ContextoCliente(getattr(request, 'user', None))
+        request._contexto_cliente = contexto
+    return contexto
+
+
+def anotar_normas_do_cliente(perfil):
+    """
+    Normas do cliente do perfil, com os campos calculados do NormaSerializer
+    (sua_revisao, status_atualizado, is_favorita, comentarios_count) resolvidos
+    pelo banco em uma unica query, prontos para filtro e ordenacao.
+    """
+    favorita = PerfilUsuario.normas_favoritas.through.objects.filter(
+        perfilusuario_id=perfil.pk, norma_id=OuterRef('pk')
+    )
+    comentarios = (
+        Comentario.objects.filter(norma_cliente=OuterRef('vinculo'))
+        .order_by()
+        .values('norma_cliente')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return (
+        Norma.objects.annotate(
+            vinculo=FilteredRelation('normacliente', condition=Q(normacliente__cliente_id=perfil.cliente_id)),
+        )
+        .filter(vinculo__isnull=False)
+        .annotate(
+            sua_revisao=F('vinculo__data_revisao_cliente'),
+            status_atualizado=Case(
+                When(revisao_atual__gt=F('vinculo__data_revisao_cliente'), then=Value('DESATUALIZADO')),
+                default=Value('ATUALIZADO'),
+                output_field=CharField(),
+            ),
+            is_favorita=Exists(favorita),
+            comentarios_count=Coalesce(Subquery(comentarios), 0),
+        )
+    )
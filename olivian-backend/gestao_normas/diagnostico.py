@@ -0,0 +1,137 @@
+# Diagnostico de queries por requisicao (desenvolvimento/homologacao): sobre
+# a medicao da instrumentacao, guarda cada query da requisicao com o ponto do
+# codigo do projeto que a disparou e, ao final, relata
+# - N+1: o mesmo SQL (parametros a parte) executado LIMITE_REPETICOES vezes
+#   ou mais, tipico de SerializerMethodField que consulta o banco por item;
+# - duplicadas: o mesmo SQL com os mesmos parametros mais de uma vez;
+# - lentas: queries acima de LIMITE_LENTA_MS.
+# Os relatorios vao para o logger gestao_normas.diagnostico (arquivo rotativo
+# em settings.LOGGING).
+import logging
+import os
+import sys
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PADRAO = {
+    # None: segue settings.DEBUG (desligado nos testes e em producao)
+    'ATIVO': None,
+    'LIMITE_LENTA_MS': 100,
+    'LIMITE_REPETICOES': 5,
+}
+
+# SQL mostrado no relatorio
+TAMANHO_MAXIMO_SQL = 500
+# Pontos de chamada listados por N+1
+MAXIMO_LOCAIS = 3
+
+_ARQUIVOS_IGNORADOS = {
+    os.path.join(os.path.dirname(__file__), 'instrumentacao.py'),
+    __file__,
+}
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'DIAGNOSTICO_CONSULTAS', {})}
+
+
+def ativo():
+    valor = configuracao()['ATIVO']
+    return settings.DEBUG if valor is None else valor
+
+
+class ConsultaRegistrada(NamedTuple):
+    sql: str
+    params: object
+    duracao: float  # segundos
+    local: str
+
+
+def local_da_chamada():
+    """Primeiro frame do codigo do projeto na pilha ('arquivo.py:linha funcao()')."""
+    raiz = str(settings.BASE_DIR) + os.sep
+    frame = sys._getframe(1)
+    while frame is not None:
+        arquivo = frame.f_code.co_filename
+        if (arquivo.startswith(raiz) and arquivo not in _ARQUIVOS_IGNORADOS
+                and 'site-packages' not in arquivo and 'dist-packages' not in arquivo):
+            return f'{os.path.relpath(arquivo, raiz)}:{frame.f_lineno} {frame.f_code.co_name}()'
+        frame = frame.f_back
+    return 'desconhecido'
+
+
+def _resumir_sql(sql):
+    sql = ' '.join(sql.split())
+    if len(sql) > TAMANHO_MAXIMO_SQL:
+        return sql[:TAMANHO_MAXIMO_SQL] + '...'
+    return sql
+
+
+def analisar(consultas, limite_lenta_ms=None, limite_repeticoes=None):
+    """
+    Problemas encontrados nas queries de uma requisicao, cada lista ordenada
+    pelo tempo total: {'n_mais_1': [...], 'duplicadas': [...], 'lentas': [...]}.
+    """
+    config = configuracao()
+    if limite_lenta_ms is None:
+        limite_lenta_ms = config['LIMITE_LENTA_MS']
+    if limite_repeticoes is None:
+        limite_repeticoes = config['LIMITE_REPETICOES']
+
+    por_sql = defaultdict(list)
+    por_sql_e_params = defaultdict(list)
+    for consulta in consultas:
+        por_sql[consulta.sql].append(consulta)
+        por_sql_e_params[(consulta.sql, repr(consulta.params))].append(consulta)
+
+    def agrupar(sql, grupo):
+        locais = Counter(consulta.local for consulta in grupo)
+        return {
+            'sql': _resumir_sql(sql),
+            'vezes': len(grupo),
+            'total_ms': round(sum(consulta.duracao for consulta in grupo) * 1000, 2),
+            'locais': [f'{local} ({vezes}x)' for local, vezes in locais.most_common(MAXIMO_LOCAIS)],
+        }
+
+    n_mais_1 = [agrupar(sql, grupo) for sql, grupo in por_sql.items() if len(grupo) >= limite_repeticoes]
+    duplicadas = [agrupar(sql, grupo) for (sql, _), grupo in por_sql_e_params.items() if len(grupo) > 1]
+    lentas = [
+        {'sql': _resumir_sql(consulta.sql), 'total_ms': round(consulta.duracao * 1000, 2), 'locais': [consulta.local]}
+        for consulta in consultas
+        if consulta.duracao * 1000 >= limite_lenta_ms
+    ]
+    return {
+        nome: sorted(itens, key=lambda item: item['total_ms'], reverse=True)
+        for nome, itens in (('n_mais_1', n_mais_1), ('duplicadas', duplicadas), ('lentas', lentas))
+    }
+
+
+def formatar(cabecalho, problemas):
+    titulos = {'n_mais_1': 'N+1', 'duplicadas': 'duplicada', 'lentas': 'lenta'}
+    linhas = [cabecalho]
+    for nome, itens in problemas.items():
+        for item in itens:
+            vezes = f' {item["vezes"]}x' if 'vezes' in item else ''
+            linhas.append(f'  {titulos[nome]}:{vezes} {item["total_ms"]} ms')
+            linhas.extend(f'    em {local}' for local in item['locais'])
+            linhas.append(f'    {item["sql"]}')
+    return '\n'.join(linhas)
+
+
+def relatar(request, rota, status, total, consultas):
+    """Grava o relatorio da requisicao se houver algum problema."""
+    problemas = analisar(consultas)
+    if not any(problemas.values()):
+        return None
+    # Sem a query string: as rotas de eventos recebem o JWT em ?token=
+    cabecalho = (
+        f'{request.method} {request.path} ({rota}) {status}: '
+        f'{len(consultas)} queries, {sum(c.duracao for c in consultas) * 1000:.1f} ms no banco, '
+        f'{total * 1000:.1f} ms no total'
+    )
+    logger.warning(formatar(cabecalho, problemas), extra={'problemas': problemas})
+    return problemas
@@ -0,0 +1,141 @@
+# Pub/sub de "ha notificacoes novas para o usuario X", usado pelo stream (SSE)
+# e pelo long-poll de notificacoes. A mensagem carrega so o id do usuario:
+# quem esta ouvindo busca as notificacoes novas com uma query indexada, entao
+# varias notificacoes criadas de uma vez geram um unico despertar por conexao.
+#
+# Backends (settings.NOTIFICACOES_PUBSUB):
+# - 'local': entrega apenas aos ouvintes do proprio processo (desenvolvimento
+#   ou um unico processo ASGI);
+# - 'postgres': NOTIFY no banco, entregue no commit a todos os processos; cada
+#   processo mantem uma unica conexao em LISTEN que repassa ao canal local.
+import asyncio
+import logging
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CANAL_POSTGRES = 'notificacoes_novas'
+
+
+class CanalLocal:
+    """Assinantes do processo atual: uma asyncio.Queue por conexao aberta."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinantes = {}
+
+    def assinar(self, usuario_id):
+        fila = asyncio.Queue(maxsize=1)
+        laco = asyncio.get_running_loop()
+        with self._lock:
+            self._assinantes.setdefault(usuario_id, set()).add((laco, fila))
+        return fila
+
+    def cancelar(self, usuario_id, fila):
+        with self._lock:
+            assinantes = self._assinantes.get(usuario_id, set())
+            assinantes = {item for item in assinantes if item[1] is not fila}
+            if assinantes:
+                self._assinantes[usuario_id] = assinantes
+            else:
+                self._assinantes.pop(usuario_id, None)
+
+    def publicar(self, usuario_ids):
+        # Pode ser chamado de qualquer thread (views sincronas, ouvinte do Postgres)
+        with self._lock:
+            destinos = [item for usuario_id in usuario_ids for item in self._assinantes.get(usuario_id, ())]
+        for laco, fila in destinos:
+            laco.call_soon_threadsafe(_acordar, fila)
+
+    def total_assinantes(self):
+        with self._lock:
+            return sum(len(assinantes) for assinantes in self._assinantes.values())
+
+
+def _acordar(fila):
+    # Fila de tamanho 1: avisos acumulados viram um unico despertar
+    if fila.empty():
+        fila.put_nowait(True)
+
+
+canal = CanalLocal()
+
+
+class OuvintePostgres(threading.Thread):
+    """Thread com uma conexao dedicada em LISTEN, repassando ao canal local."""
+
+    daemon = True
+    intervalo_reconexao = 5
+
+    def __init__(self):
+        super().__init__(name='ouvinte-notificacoes')
+
+    def run(self):
+        while True:
+            try:
+                self._escutar()
+            except Exception:
+                logger.exception('Ouvinte de notificacoes perdeu a conexao; reconectando.')
+                time.sleep(self.intervalo_reconexao)
+
+    def _escutar(self):
+        banco = connections['default']
+        conexao = banco.Database.connect(**banco.get_connection_params())
+        try:
+            conexao.autocommit = True
+            with conexao.cursor() as cursor:
+                cursor.execute(f'LISTEN {CANAL_POSTGRES}')
+            while True:
+                if select.select([conexao], [], [], 30) == ([], [], []):
+                    continue
+                conexao.poll()
+                usuario_ids = set()
+                while conexao.notifies:
+                    usuario_ids.add(int(conexao.notifies.pop(0).payload))
+                if usuario_ids:
+                    canal.publicar(usuario_ids)
+        finally:
+            conexao.close()
+
+
+_ouvinte = None
+_ouvinte_lock = threading.Lock()
+
+
+def _backend():
+    return getattr(settings, 'NOTIFICACOES_PUBSUB', 'postgres')
+
+
+def iniciar_ouvinte():
+    """Sobe o ouvinte do Postgres na primeira assinatura do processo."""
+    global _ouvinte
+    if _backend() != 'postgres':
+        return
+    with _ouvinte_lock:
+        if _ouvinte is None or not _ouvinte.is_alive():
+            _ouvinte = OuvintePostgres()
+            _ouvinte.start()
+
+
+def publicar_notificacoes_novas(usuario_ids):
+    """
+    Avisa os ouvintes de que os usuarios tem notificacoes novas. Deve ser
+    chamado na mesma transacao que cria as notificacoes: o aviso so sai no
+    commit (NOTIFY e transacional; no backend local, via on_commit).
+    """
+    usuario_ids = sorted(set(usuario_ids))
+    if not usuario_ids:
+        return
+    if _backend() == 'postgres':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_notify(%s, usuario_id::text) FROM unnest(%s::bigint[]) AS usuario_id',
+                [CANAL_POSTGRES, usuario_ids],
+            )
+    else:
+        transaction.on_commit(lambda: canal.publicar(usuario_ids))
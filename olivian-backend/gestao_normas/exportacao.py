@@ -0,0 +1,195 @@
+import csv
+import zipfile
+from datetime import date
+from xml.sax.saxutils import escape
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import OuterRef, Subquery
+
+from .contexto import anotar_normas_do_cliente
+from .models import Auditoria, CentroDeCusto, Certificacao
+
+
+# Linhas buscadas por vez do cursor no servidor (iterator(chunk_size=...))
+TAMANHO_LOTE = 2000
+
+COLUNAS = [
+    ('organizacao', 'Organizacao'),
+    ('norma', 'Norma'),
+    ('titulo', 'Titulo'),
+    ('idioma', 'Idioma'),
+    ('formato', 'Formato'),
+    ('revisao_atual', 'Revisao atual'),
+    ('sua_revisao', 'Sua revisao'),
+    ('status_atualizado', 'Status'),
+    ('is_favorita', 'Favorita'),
+    ('comentarios_count', 'Comentarios'),
+    ('auditorias', 'Auditorias'),
+    ('certificacoes', 'Certificacoes'),
+    ('centros_de_custo', 'Centros de custo'),
+    ('observacoes', 'Observacoes'),
+]
+
+
+def _nomes_vinculados(modelo, cliente_id):
+    # "Auditoria A; Auditoria B" dos itens do cliente vinculados a norma da linha
+    campo = modelo._meta.model_name
+    return Subquery(
+        modelo.normas.through.objects.filter(
+            norma_id=OuterRef('pk'), **{f'{campo}__cliente_id': cliente_id}
+        )
+        .order_by()
+        .values('norma_id')
+        .annotate(nomes=StringAgg(f'{campo}__nome', delimiter='; ', order_by=f'{campo}__nome'))
+        .values('nomes')
+    )
+
+
+def linhas_do_acervo(perfil, chunk_size=TAMANHO_LOTE):
+    """
+    Gera as linhas do acervo do cliente (na ordem de COLUNAS) a partir de uma
+    unica query, lida do cursor no servidor em blocos de chunk_size.
+    """
+    normas = (
+        anotar_normas_do_cliente(perfil)
+        .annotate(
+            auditorias=_nomes_vinculados(Auditoria, perfil.cliente_id),
+            certificacoes=_nomes_vinculados(Certificacao, perfil.cliente_id),
+            centros_de_custo=_nomes_vinculados(CentroDeCusto, perfil.cliente_id),
+        )
+        .order_by('organizacao', 'norma')
+        .values_list(*(campo for campo, _ in COLUNAS))
+    )
+    for linha in normas.iterator(chunk_size=chunk_size):
+        yield ['Sim' if valor is True else 'Nao' if valor is False else valor for valor in linha]
+
+
+class _Eco:
+    """Pseudo-arquivo: write() devolve o que recebe (padrao de CSV em streaming do Django)."""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(linhas):
+    """CSV separado por ';' com BOM, como o Excel em portugues espera."""
+    escritor = csv.writer(_Eco(), delimiter=';')
+    yield '\ufeff' + escritor.writerow([titulo for _, titulo in COLUNAS])
+    for linha in linhas:
+        yield escritor.writerow(['' if valor is None else valor for valor in linha])
+
+
+class _BufferDeSaida:
+    """
+    Destino do zipfile sem seek(): o ZipFile passa a gravar em modo streaming
+    (data descriptors) e os bytes acumulados sao entregues a cada lote.
+    """
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+
+_XLSX_ESTATICOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Acervo" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Estilo 1 = data no formato curto do Excel (numFmtId 14)
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+_EPOCA_EXCEL = date(1899, 12, 30)
+
+
+def _celula_xlsx(valor):
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, bool):
+        valor = 'Sim' if valor else 'Nao'
+    if isinstance(valor, date):
+        return f'<c s="1"><v>{(valor - _EPOCA_EXCEL).days}</v></c>'
+    if isinstance(valor, (int, float)):
+        return f'<c><v>{valor}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(valor))}</t></is></c>'
+
+
+def gerar_xlsx(linhas, linhas_por_bloco=TAMANHO_LOTE):
+    """
+    Planilha XLSX gerada em streaming: a aba e escrita linha a linha dentro de
+    um zip sem seek, e os bytes prontos sao entregues a cada bloco de linhas.
+    Nao depende do openpyxl e a memoria fica limitada a um bloco.
+    """
+    saida = _BufferDeSaida()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for nome, conteudo in _XLSX_ESTATICOS.items():
+            arquivo_zip.writestr(nome, conteudo)
+        with arquivo_zip.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as aba:
+            aba.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            aba.write(('<row>' + ''.join(_celula_xlsx(titulo) for _, titulo in COLUNAS) + '</row>').encode())
+            for numero, linha in enumerate(linhas, start=1):
+                aba.write(('<row>' + ''.join(_celula_xlsx(valor) for valor in linha) + '</row>').encode())
+                # O compressor pode reter os bytes; so entrega o que ja saiu dele
+                if numero % linhas_por_bloco == 0:
+                    dados = saida.esvaziar()
+                    if dados:
+                        yield dados
+            aba.write(b'</sheetData></worksheet>')
+    yield saida.esvaziar()
@@ -0,0 +1,397 @@
+import codecs
+import csv
+import io
+import unicodedata
+from datetime import date, datetime
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .cache import invalidar_catalogo
+from .models import FORMATO_CHOICES, IDIOMA_CHOICES, Cliente, Norma, NormaCliente
+from .notificacoes import enfileirar_revisoes
+from .resumos import atualizar_resumos_clientes, atualizar_resumos_das_normas
+from .versoes import incrementar_todas_as_versoes
+
+
+# Linhas validadas e gravadas por vez; a memoria fica limitada a um lote.
+TAMANHO_LOTE = 2000
+
+# Erros guardados no relatorio (o total continua sendo contado).
+MAXIMO_ERROS_RELATORIO = 1000
+
+# A partir de quantas linhas gravadas as estatisticas do planejador sao
+# atualizadas (ANALYZE) antes da recontagem dos resumos: o autovacuum so faz
+# isso depois, e sem elas o plano sobre as tabelas recem-carregadas e ruim.
+LIMITE_ANALYZE = 10000
+
+# Cabecalhos aceitos, ja normalizados (minusculo, sem acento, espaco -> _).
+# Inclui os nomes da planilha modelo "Modelo de Banco de Dados de Normas e Clientes".
+ALIASES_COLUNAS = {
+    'norma': 'norma',
+    'codigo': 'norma',
+    'organizacao': 'organizacao',
+    'sdo': 'organizacao',
+    'titulo': 'titulo',
+    'idioma': 'idioma',
+    'formato': 'formato',
+    'observacoes': 'observacoes',
+    'obs': 'observacoes',
+    'revisao_atual': 'revisao_atual',
+    'cnpj': 'cnpj',
+    'empresa': 'empresa',
+    'cliente': 'empresa',
+    'data_revisao_cliente': 'data_revisao_cliente',
+    'revisao_cliente': 'data_revisao_cliente',
+}
+
+# Campos de Norma gravados no upsert quando a coluna existe no arquivo
+CAMPOS_NORMA = ['organizacao', 'titulo', 'idioma', 'formato', 'observacoes']
+
+# AAAA-MM-DD e tentado antes (date.fromisoformat, bem mais rapido que strptime)
+FORMATOS_DATA = ('%d/%m/%Y', '%d/%m/%y')
+
+
+class ErroImportacao(Exception):
+    """Arquivo que nao pode ser lido (formato, cabecalho ou dependencia ausente)."""
+
+
+def _normalizar_cabecalho(nome):
+    nome = unicodedata.normalize('NFKD', str(nome or '')).encode('ascii', 'ignore').decode()
+    return '_'.join(nome.strip().lower().split())
+
+
+def _texto(valor):
+    if valor is None:
+        return ''
+    return str(valor).strip()
+
+
+def _data(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    texto = _texto(valor)
+    if not texto:
+        return None
+    try:
+        return date.fromisoformat(texto)
+    except ValueError:
+        pass
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato).date()
+        except ValueError:
+            continue
+    raise ValueError(f"data invalida '{texto}' (use AAAA-MM-DD ou DD/MM/AAAA)")
+
+
+def _codificacao(arquivo):
+    """
+    utf-8-sig se o arquivo inteiro for UTF-8 valido; senao cp1252, a
+    codificacao do CSV exportado pelo Excel em portugues. Le o arquivo em
+    blocos, sem carrega-lo na memoria.
+    """
+    decodificador = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for bloco in iter(lambda: arquivo.read(64 * 1024), b''):
+            decodificador.decode(bloco)
+        decodificador.decode(b'', final=True)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1252'
+    finally:
+        arquivo.seek(0)
+
+
+def _linhas_csv(arquivo):
+    texto = io.TextIOWrapper(arquivo, encoding=_codificacao(arquivo), newline='')
+    try:
+        amostra = texto.read(4096)
+        texto.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=',;\t')
+        except csv.Error:
+            dialeto = csv.excel
+        yield from csv.reader(texto, dialeto)
+    except UnicodeDecodeError:
+        # Nem UTF-8 nem cp1252 (bytes que o cp1252 nao define)
+        raise ErroImportacao("Nao foi possivel ler o CSV: salve o arquivo em UTF-8.")
+    texto.detach()
+
+
+def _linhas_xlsx(arquivo):
+    try:
+        import openpyxl
+    except ImportError:
+        raise ErroImportacao("A leitura de XLSX requer o pacote 'openpyxl'.")
+    # read_only: as linhas sao lidas do arquivo sob demanda, sem carregar a planilha
+    planilha = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        yield from planilha.worksheets[0].iter_rows(values_only=True)
+    finally:
+        planilha.close()
+
+
+def ler_linhas(arquivo, formato):
+    """
+    Gera (numero_da_linha, dict) para cada linha de dados do arquivo CSV/XLSX,
+    com as colunas ja mapeadas para os nomes de ALIASES_COLUNAS.
+    Colunas desconhecidas sao ignoradas.
+    """
+    if formato == 'csv':
+        linhas = _linhas_csv(arquivo)
+    elif formato == 'xlsx':
+        linhas = _linhas_xlsx(arquivo)
+    else:
+        raise ErroImportacao(f"Formato '{formato}' nao suportado. Use csv ou xlsx.")
+
+    cabecalho = next(linhas, None)
+    if cabecalho is None:
+        raise ErroImportacao("Arquivo vazio.")
+
+    # Em cabecalhos repetidos (a planilha modelo tem dois 'id'), vale o primeiro
+    colunas = {}
+    for indice, nome in enumerate(cabecalho):
+        campo = ALIASES_COLUNAS.get(_normalizar_cabecalho(nome))
+        if campo and campo not in colunas:
+            colunas[campo] = indice
+    if 'norma' not in colunas:
+        raise ErroImportacao("O arquivo precisa de uma coluna 'norma' com o codigo da norma.")
+
+    for numero, linha in enumerate(linhas, start=2):
+        if not any(_texto(valor) for valor in linha):
+            continue
+        yield numero, {
+            campo: (linha[indice] if indice < len(linha) else None)
+            for campo, indice in colunas.items()
+        }
+
+
+def atualizar_estatisticas(*modelos):
+    with connection.cursor() as cursor:
+        for modelo in modelos:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(modelo._meta.db_table)}')
+
+
+class ImportadorCatalogo:
+    """
+    Importa normas e vinculos norma-cliente em lotes de tamanho fixo.
+
+    Cada lote e validado, depois grava:
+    - Norma por upsert no codigo unico ('norma'), atualizando apenas as colunas
+      presentes no arquivo;
+    - NormaCliente por upsert em (cliente, norma), quando a linha informa o
+      cliente (cnpj ou empresa) e a data_revisao_cliente.
+
+    Normas cuja revisao_atual mudou entram na fila de notificacoes a cada lote;
+    os resumos de conformidade dos clientes afetados sao recalculados uma vez,
+    ao final da importacao.
+    """
+
+    def __init__(self, batch_size=TAMANHO_LOTE, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.linhas = 0
+        self.normas_gravadas = 0
+        self.vinculos_gravados = 0
+        self.total_erros = 0
+        self.erros = []
+        self._clientes_por_cnpj = None
+        self._clientes_por_empresa = None
+        self._clientes_afetados = set()
+        self._normas_revisadas = set()
+
+    def importar(self, arquivo, formato):
+        linhas = ler_linhas(arquivo, formato)
+        while True:
+            lote = list(islice(linhas, self.batch_size))
+            if not lote:
+                break
+            self.linhas += len(lote)
+            self._processar_lote(lote)
+
+        if not self.dry_run and self.normas_gravadas + self.vinculos_gravados >= LIMITE_ANALYZE:
+            atualizar_estatisticas(Norma, NormaCliente)
+        # Uma unica recontagem no fim, em vez de uma por lote
+        atualizar_resumos_das_normas(self._normas_revisadas)
+        atualizar_resumos_clientes(self._clientes_afetados)
+        # bulk_create nao dispara sinais: invalida o cache do catalogo inteiro
+        # e as versoes (ETags) de todos os clientes
+        if not self.dry_run and (self.normas_gravadas or self.vinculos_gravados):
+            invalidar_catalogo()
+            incrementar_todas_as_versoes()
+        return self.relatorio()
+
+    def relatorio(self):
+        return {
+            'linhas': self.linhas,
+            'normas_gravadas': self.normas_gravadas,
+            'vinculos_gravados': self.vinculos_gravados,
+            'total_erros': self.total_erros,
+            'erros': self.erros,
+            'dry_run': self.dry_run,
+        }
+
+    def _registrar_erro(self, numero, mensagens):
+        self.total_erros += 1
+        if len(self.erros) < MAXIMO_ERROS_RELATORIO:
+            self.erros.append({'linha': numero, 'erros': mensagens})
+
+    def _carregar_clientes(self):
+        # Clientes sao poucos: um unico SELECT para o arquivo inteiro
+        if self._clientes_por_cnpj is None:
+            self._clientes_por_cnpj = {}
+            empresas = {}
+            for pk, cnpj, empresa in Cliente.objects.values_list('pk', 'cnpj', 'empresa'):
+                self._clientes_por_cnpj[cnpj] = pk
+                empresas.setdefault(empresa.strip().lower(), []).append(pk)
+            self._clientes_por_empresa = empresas
+
+    def _resolver_cliente(self, dados):
+        self._carregar_clientes()
+        cnpj = ''.join(c for c in _texto(dados.get('cnpj')) if c.isdigit())
+        if cnpj:
+            if cnpj not in self._clientes_por_cnpj:
+                raise ValueError(f"cliente com CNPJ '{cnpj}' nao encontrado")
+            return self._clientes_por_cnpj[cnpj]
+        empresa = _texto(dados.get('empresa')).lower()
+        if empresa:
+            encontrados = self._clientes_por_empresa.get(empresa, [])
+            if len(encontrados) != 1:
+                raise ValueError(f"empresa '{dados['empresa']}' nao encontrada ou ambigua; informe o CNPJ")
+            return encontrados[0]
+        return None
+
+    def _validar(self, numero, dados, existentes):
+        erros = []
+        codigo = _texto(dados.get('norma'))
+        limite = Norma._meta.get_field('norma').max_length
+        if not codigo:
+            erros.append("norma: codigo obrigatorio")
+        elif len(codigo) > limite:
+            erros.append(f"norma: codigo com mais de {limite} caracteres")
+
+        valores = {}
+        for campo in CAMPOS_NORMA:
+            if campo in dados:
+                valores[campo] = _texto(dados[campo])
+        for campo, escolhas in (('idioma', IDIOMA_CHOICES), ('formato', FORMATO_CHOICES)):
+            if campo in valores:
+                valor = valores[campo].lower() or Norma._meta.get_field(campo).default
+                if valor not in dict(escolhas):
+                    erros.append(f"{campo}: valor '{valores[campo]}' invalido")
+                valores[campo] = valor
+        # Um valor longo demais faria o bulk_create falhar e abortar o lote inteiro
+        for campo, valor in valores.items():
+            limite = Norma._meta.get_field(campo).max_length
+            if limite and len(valor) > limite:
+                erros.append(f"{campo}: mais de {limite} caracteres")
+        if 'organizacao' in valores and not valores['organizacao']:
+            valores['organizacao'] = 'N/A'
+        for campo in ('titulo', 'observacoes'):
+            if campo in valores:
+                valores[campo] = valores[campo] or None
+
+        revisao_atual = revisao_cliente = cliente_id = None
+        revisao_invalida = False
+        try:
+            revisao_atual = _data(dados.get('revisao_atual'))
+        except ValueError as e:
+            erros.append(f"revisao_atual: {e}")
+            revisao_invalida = True
+        try:
+            revisao_cliente = _data(dados.get('data_revisao_cliente'))
+        except ValueError as e:
+            erros.append(f"data_revisao_cliente: {e}")
+        try:
+            cliente_id = self._resolver_cliente(dados)
+        except ValueError as e:
+            erros.append(f"cliente: {e}")
+
+        if codigo and revisao_atual is None and not revisao_invalida and codigo not in existentes:
+            erros.append("revisao_atual: obrigatoria para normas novas")
+        if (cliente_id is None) != (revisao_cliente is None) and not erros:
+            erros.append("vinculo: informe o cliente e a data_revisao_cliente juntos")
+
+        if erros:
+            self._registrar_erro(numero, erros)
+            return None
+        return codigo, valores, revisao_atual, cliente_id, revisao_cliente
+
+    def _processar_lote(self, lote):
+        codigos = {_texto(dados.get('norma')) for _, dados in lote}
+        existentes = {
+            codigo: (pk, revisao)
+            for codigo, pk, revisao in Norma.objects.filter(norma__in=codigos)
+            .values_list('norma', 'pk', 'revisao_atual')
+        }
+
+        normas = {}
+        vinculos = {}
+        colunas = set()
+        for numero, dados in lote:
+            validado = self._validar(numero, dados, existentes)
+            if validado is None:
+                continue
+            codigo, valores, revisao_atual, cliente_id, revisao_cliente = validado
+            # Codigos repetidos no mesmo lote: vale a ultima linha
+            if valores or revisao_atual is not None:
+                anterior = normas.get(codigo, {})
+                normas[codigo] = {**anterior, **valores}
+                if revisao_atual is not None:
+                    normas[codigo]['revisao_atual'] = revisao_atual
+                colunas.update(normas[codigo])
+            if cliente_id is not None:
+                vinculos[(cliente_id, codigo)] = revisao_cliente
+
+        if self.dry_run:
+            self.normas_gravadas += len(normas)
+            self.vinculos_gravados += len(vinculos)
+            return
+
+        with transaction.atomic():
+            self._gravar(normas, vinculos, colunas, existentes)
+
+    def _gravar(self, normas, vinculos, colunas, existentes):
+        # Normas existentes sem revisao_atual no arquivo mantem a revisao atual
+        instancias = []
+        for codigo, valores in normas.items():
+            if 'revisao_atual' not in valores:
+                valores['revisao_atual'] = existentes[codigo][1]
+            instancias.append(Norma(norma=codigo, **valores))
+        if instancias:
+            Norma.objects.bulk_create(
+                instancias,
+                update_conflicts=True,
+                unique_fields=['norma'],
+                update_fields=sorted(colunas | {'revisao_atual'}),
+            )
+        ids_por_codigo = {norma.norma: norma.pk for norma in instancias}
+        ids_por_codigo.update({
+            codigo: pk for codigo, (pk, _) in existentes.items() if codigo not in ids_por_codigo
+        })
+
+        if vinculos:
+            NormaCliente.objects.bulk_create(
+                [
+                    NormaCliente(cliente_id=cliente_id, norma_id=ids_por_codigo[codigo], data_revisao_cliente=revisao)
+                    for (cliente_id, codigo), revisao in vinculos.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['cliente', 'norma'],
+                update_fields=['data_revisao_cliente'],
+            )
+
+        revisadas = [
+            existentes[norma.norma][0] for norma in instancias
+            if norma.norma in existentes and norma.revisao_atual != existentes[norma.norma][1]
+        ]
+        if revisadas:
+            enfileirar_revisoes(revisadas)
+        self._normas_revisadas.update(revisadas)
+        self._clientes_afetados.update(cliente_id for cliente_id, _ in vinculos)
+
+        self.normas_gravadas += len(instancias)
+        self.vinculos_gravados += len(vinculos)
@@ -0,0 +1,343 @@
+# Instrumentacao por requisicao: rota, numero de queries, tempo de banco,
+# tempo de serializacao, tempo total e tamanho da resposta. Cada requisicao
+# amostrada gera um cabecalho Server-Timing, uma linha de log em JSON e entra
+# nos histogramas por rota deste processo, expostos em formato Prometheus.
+#
+# A medicao da requisicao vive em uma ContextVar, entao tambem acompanha as
+# views assincronas e o ORM chamado via sync_to_async. Fora de uma requisicao
+# amostrada, os ganchos no banco e nos serializers custam uma leitura da
+# ContextVar; com settings.INSTRUMENTACAO['ATIVA'] = False nada e instalado.
+# Com settings.DIAGNOSTICO_CONSULTAS['ATIVO'], cada query tambem e guardada
+# com o ponto de chamada para o relatorio de N+1/lentas (diagnostico.py).
+import functools
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import diagnostico
+
+logger = logging.getLogger(__name__)
+
+PADRAO = {
+    'ATIVA': True,
+    # Fracao das requisicoes medidas (0 a 1)
+    'AMOSTRAGEM': 1.0,
+    'SERVER_TIMING': True,
+    'LOG': True,
+    # Token aceito em 'Authorization: Metricas <token>' no endpoint de metricas
+    'TOKEN_METRICAS': '',
+}
+
+PREFIXO = 'olivian_http'
+
+# Limites (le) dos histogramas
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_CONSULTAS = (1, 2, 3, 5, 10, 20, 50, 100)
+LIMITES_BYTES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+# nome: (limites, descricao)
+HISTOGRAMAS = {
+    'duracao_segundos': (LIMITES_SEGUNDOS, 'Tempo total da requisicao'),
+    'banco_segundos': (LIMITES_SEGUNDOS, 'Tempo gasto em queries'),
+    'serializacao_segundos': (LIMITES_SEGUNDOS, 'Tempo gasto em serializer.data'),
+    'consultas': (LIMITES_CONSULTAS, 'Queries por requisicao'),
+    'resposta_bytes': (LIMITES_BYTES, 'Tamanho do corpo da resposta (sem streaming)'),
+}
+
+ROTA_DESCONHECIDA = 'desconhecida'
+
+_medicao_atual = ContextVar('medicao_da_requisicao', default=None)
+
+
+def configuracao():
+    return {**PADRAO, **getattr(settings, 'INSTRUMENTACAO', {})}
+
+
+class Medicao:
+    __slots__ = ('inicio', 'consultas', 'tempo_banco', 'tempo_serializacao', 'serializando', 'registradas')
+
+    def __init__(self, registrar_consultas=False):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.tempo_banco = 0.0
+        self.tempo_serializacao = 0.0
+        self.serializando = False
+        # Lista de diagnostico.ConsultaRegistrada, so no modo de diagnostico
+        self.registradas = [] if registrar_consultas else None
+
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        # Uma posicao por limite e uma para o +Inf; acumuladas so na exportacao
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+
+
+class MetricasRequisicoes:
+    """Histogramas por (rota, metodo) e total por status, no processo atual."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas = {}
+        self._requisicoes = Counter()
+
+    def registrar(self, rota, metodo, status, valores):
+        with self._lock:
+            self._requisicoes[(rota, metodo, status)] += 1
+            histogramas = self._histogramas.get((rota, metodo))
+            if histogramas is None:
+                histogramas = self._histogramas[(rota, metodo)] = {
+                    nome: Histograma(limites) for nome, (limites, _) in HISTOGRAMAS.items()
+                }
+            for nome, valor in valores.items():
+                if valor is not None:
+                    histogramas[nome].observar(valor)
+
+    def exportar(self):
+        """Texto no formato de exposicao do Prometheus (0.0.4)."""
+        with self._lock:
+            requisicoes = sorted(self._requisicoes.items())
+            series = sorted(
+                (chave, {nome: (list(h.contagens), h.soma) for nome, h in histogramas.items()})
+                for chave, histogramas in self._histogramas.items()
+            )
+
+        linhas = [
+            f'# HELP {PREFIXO}_amostragem Fracao das requisicoes medidas',
+            f'# TYPE {PREFIXO}_amostragem gauge',
+            f'{PREFIXO}_amostragem {_numero(configuracao()["AMOSTRAGEM"])}',
+            f'# HELP {PREFIXO}_requisicoes_total Requisicoes medidas',
+            f'# TYPE {PREFIXO}_requisicoes_total counter',
+        ]
+        for (rota, metodo, status), total in requisicoes:
+            linhas.append(f'{PREFIXO}_requisicoes_total{_rotulos(rota=rota, metodo=metodo, status=status)} {total}')
+
+        for nome, (limites, descricao) in HISTOGRAMAS.items():
+            metrica = f'{PREFIXO}_{nome}'
+            linhas.append(f'# HELP {metrica} {descricao}')
+            linhas.append(f'# TYPE {metrica} histogram')
+            for (rota, metodo), valores in series:
+                contagens, soma = valores[nome]
+                acumulado = 0
+                for limite, contagem in zip(limites + ('+Inf',), contagens):
+                    acumulado += contagem
+                    rotulos = _rotulos(rota=rota, metodo=metodo, le=_numero(limite))
+                    linhas.append(f'{metrica}_bucket{rotulos} {acumulado}')
+                rotulos = _rotulos(rota=rota, metodo=metodo)
+                linhas.append(f'{metrica}_sum{rotulos} {_numero(soma)}')
+                linhas.append(f'{metrica}_count{rotulos} {acumulado}')
+        return '\n'.join(linhas) + '\n'
+
+    def zerar(self):
+        with self._lock:
+            self._histogramas.clear()
+            self._requisicoes.clear()
+
+
+metricas = MetricasRequisicoes()
+
+
+def _numero(valor):
+    if isinstance(valor, float):
+        return repr(round(valor, 6))
+    return str(valor)
+
+
+def _rotulos(**rotulos):
+    def escapar(valor):
+        return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{nome}="{escapar(valor)}"' for nome, valor in rotulos.items()) + '}'
+
+
+# ---------------------------------------------------------------------------
+# Ganchos no banco e nos serializers
+# ---------------------------------------------------------------------------
+
+def _cronometrar_consulta(execute, sql, params, many, context):
+    medicao = _medicao_atual.get()
+    if medicao is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracao = time.perf_counter() - inicio
+        medicao.consultas += 1
+        medicao.tempo_banco += duracao
+        if medicao.registradas is not None:
+            medicao.registradas.append(
+                diagnostico.ConsultaRegistrada(sql, params, duracao, diagnostico.local_da_chamada())
+            )
+
+
+def _instalar_na_conexao(connection, **kwargs):
+    # No inicio da lista: connection.execute_wrapper() desempilha do fim, e a
+    # conexao pode ser aberta dentro de um desses blocos
+    if _cronometrar_consulta not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _cronometrar_consulta)
+
+
+def _cronometrar_serializacao(data):
+    @functools.wraps(data)
+    def cronometrado(serializer):
+        medicao = _medicao_atual.get()
+        # Serializers aninhados (ou .data chamado de dentro de outro) contam uma vez
+        if medicao is None or medicao.serializando:
+            return data(serializer)
+        medicao.serializando = True
+        inicio = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            medicao.serializando = False
+            medicao.tempo_serializacao += time.perf_counter() - inicio
+
+    cronometrado.instrumentado = True
+    return cronometrado
+
+
+_instalado = False
+_instalacao_lock = threading.Lock()
+
+
+def instalar():
+    """
+    Instala os ganchos de medicao (chamado no ready() do app): um execute
+    wrapper em cada conexao com o banco e um cronometro em
+    BaseSerializer.data, por onde passam Serializer.data e ListSerializer.data.
+    """
+    global _instalado
+    if not configuracao()['ATIVA']:
+        return
+    from rest_framework.serializers import BaseSerializer
+
+    with _instalacao_lock:
+        if _instalado:
+            return
+        connection_created.connect(_instalar_na_conexao, dispatch_uid='instrumentacao_consultas')
+        for conexao in connections.all(initialized_only=True):
+            _instalar_na_conexao(conexao)
+        if not getattr(BaseSerializer.data.fget, 'instrumentado', False):
+            BaseSerializer.data = property(_cronometrar_serializacao(BaseSerializer.data.fget))
+        _instalado = True
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+def nome_da_rota(request):
+    correspondencia = getattr(request, 'resolver_match', None)
+    if correspondencia is None:
+        return ROTA_DESCONHECIDA
+    return correspondencia.view_name or correspondencia.route or ROTA_DESCONHECIDA
+
+
+def tamanho_da_resposta(response):
+    if response.streaming:
+        return None
+    return len(response.content)
+
+
+class InstrumentacaoMiddleware:
+    """
+    Mede as requisicoes amostradas (settings.INSTRUMENTACAO['AMOSTRAGEM']).
+    Desativada, o Django descarta o middleware na carga (MiddlewareNotUsed).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = configuracao()
+        if not config['ATIVA'] or config['AMOSTRAGEM'] <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.amostragem = config['AMOSTRAGEM']
+        self.server_timing = config['SERVER_TIMING']
+        self.log = config['LOG']
+        self.diagnostico = diagnostico.ativo()
+        self.assincrono = iscoroutinefunction(get_response)
+        if self.assincrono:
+            markcoroutinefunction(self)
+
+    def _amostrar(self):
+        return self.amostragem >= 1 or random.random() < self.amostragem
+
+    def __call__(self, request):
+        if self.assincrono:
+            return self._chamar_assincrono(request)
+        if not self._amostrar():
+            return self.get_response(request)
+        medicao = Medicao(registrar_consultas=self.diagnostico)
+        token = _medicao_atual.set(medicao)
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicao_atual.reset(token)
+        self._finalizar(request, response, medicao)
+        return response
+
+    async def _chamar_assincrono(self, request):
+        if not self._amostrar():
+            return await self.get_response(request)
+        medicao = Medicao(registrar_consultas=self.diagnostico)
+        token = _medicao_atual.set(medicao)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicao_atual.reset(token)
+        self._finalizar(request, response, medicao)
+        return response
+
+    def _finalizar(self, request, response, medicao):
+        # Em respostas com streaming o total vai ate o inicio do envio
+        total = time.perf_counter() - medicao.inicio
+        rota = nome_da_rota(request)
+        tamanho = tamanho_da_resposta(response)
+        metricas.registrar(rota, request.method, response.status_code, {
+            'duracao_segundos': total,
+            'banco_segundos': medicao.tempo_banco,
+            'serializacao_segundos': medicao.tempo_serializacao,
+            'consultas': medicao.consultas,
+            'resposta_bytes': tamanho,
+        })
+
+        if self.server_timing:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={medicao.tempo_banco * 1000:.1f};desc="{medicao.consultas} queries"',
+                f'ser;dur={medicao.tempo_serializacao * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ])
+
+        if self.log and logger.isEnabledFor(logging.INFO):
+            registro = {
+                'rota': rota,
+                'metodo': request.method,
+                'caminho': request.path,
+                'status': response.status_code,
+                'consultas': medicao.consultas,
+                'banco_ms': round(medicao.tempo_banco * 1000, 2),
+                'serializacao_ms': round(medicao.tempo_serializacao * 1000, 2),
+                'total_ms': round(total * 1000, 2),
+                'bytes': tamanho,
+            }
+            logger.info(json.dumps(registro, ensure_ascii=False), extra={'requisicao': registro})
+
+        if medicao.registradas:
+            diagnostico.relatar(request, rota, response.status_code, total, medicao.registradas)
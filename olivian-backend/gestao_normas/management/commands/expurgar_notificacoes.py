@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestao_normas.notificacoes import DIAS_RETENCAO, TAMANHO_LOTE_EXPURGO, expurgar_notificacoes
+
+class Command(BaseCommand):
+    help = 'Remove (ou arquiva) as notificações lidas mais antigas que o período de retenção, em lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=DIAS_RETENCAO,
+            help=f'Idade mínima, em dias, das notificações lidas expurgadas (padrão: {DIAS_RETENCAO}).',
+        )
+        parser.add_argument(
+            '--arquivar',
+            action='store_true',
+            help='Arquiva as notificações em vez de removê-las.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=TAMANHO_LOTE_EXPURGO,
+            help=f'Notificações por transação (padrão: {TAMANHO_LOTE_EXPURGO}).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas conta as notificações que seriam afetadas.',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size deve ser maior que zero.')
+        if options['dias'] < 0:
+            # Um corte no futuro expurgaria todas as notificacoes lidas
+            raise CommandError('--dias nao pode ser negativo.')
+        inicio = time.monotonic()
+        total = expurgar_notificacoes(
+            dias=options['dias'],
+            arquivar=options['arquivar'],
+            lote=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        duracao = time.monotonic() - inicio
+        acao = 'arquivadas' if options['arquivar'] else 'removidas'
+        if options['dry_run']:
+            self.stdout.write(f'{total} notificações seriam {acao}.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{total} notificações {acao} em {duracao:.2f}s.'))
@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestao_normas.importacao import TAMANHO_LOTE, ErroImportacao, ImportadorCatalogo
+
+class Command(BaseCommand):
+    help = 'Importa normas e vínculos norma-cliente de um arquivo CSV ou XLSX, em lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do arquivo .csv ou .xlsx.')
+        parser.add_argument(
+            '--formato',
+            choices=['csv', 'xlsx'],
+            help='Formato do arquivo (padrão: deduzido pela extensão).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=TAMANHO_LOTE,
+            help=f'Linhas validadas e gravadas por lote (padrão: {TAMANHO_LOTE}).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Apenas valida o arquivo, sem gravar nada.',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size deve ser maior que zero.')
+        caminho = options['arquivo']
+        formato = options['formato'] or os.path.splitext(caminho)[1].lstrip('.').lower()
+        importador = ImportadorCatalogo(batch_size=options['batch_size'], dry_run=options['dry_run'])
+
+        self.stdout.write(f"Importando {caminho}...")
+        inicio = time.monotonic()
+        try:
+            with open(caminho, 'rb') as arquivo:
+                relatorio = importador.importar(arquivo, formato)
+        except (OSError, ErroImportacao) as e:
+            raise CommandError(str(e))
+        duracao = time.monotonic() - inicio
+
+        for erro in relatorio['erros']:
+            self.stderr.write(f"Linha {erro['linha']}: {'; '.join(erro['erros'])}")
+        if relatorio['total_erros'] > len(relatorio['erros']):
+            self.stderr.write(f"... e mais {relatorio['total_erros'] - len(relatorio['erros'])} linhas com erro.")
+
+        linhas_por_segundo = relatorio['linhas'] / duracao if duracao else relatorio['linhas']
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Dry-run concluído' if relatorio['dry_run'] else 'Importação concluída'} em {duracao:.2f}s "
+            f"({linhas_por_segundo:.0f} linhas/s): {relatorio['linhas']} linhas, "
+            f"{relatorio['normas_gravadas']} normas, {relatorio['vinculos_gravados']} vínculos, "
+            f"{relatorio['total_erros']} linhas com erro."
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from gestao_normas.notificacoes import processar_fila_revisoes
+
+class Command(BaseCommand):
+    help = 'Drena a fila de revisões de normas e cria notificações apenas para os pares afetados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Quantidade de pares (norma, cliente) processados por lote (padrão: 1000).',
+        )
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Continua rodando e verifica a fila a cada --intervalo segundos.',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=2.0,
+            help='Segundos de espera entre verificações quando a fila está vazia (padrão: 2).',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size deve ser maior que zero.')
+        while True:
+            inicio = time.monotonic()
+            pares = notificacoes = 0
+            while True:
+                processados, criadas = processar_fila_revisoes(batch_size=options['batch_size'])
+                if not processados:
+                    break
+                pares += processados
+                notificacoes += criadas
+
+            if pares:
+                duracao = time.monotonic() - inicio
+                self.stdout.write(self.style.SUCCESS(
+                    f'{pares} pares processados em {duracao:.2f}s. {notificacoes} novas notificações criadas.'
+                ))
+            elif not options['continuo']:
+                self.stdout.write('Fila de revisões vazia.')
+
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
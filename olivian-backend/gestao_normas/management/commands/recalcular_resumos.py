@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gestao_normas.resumos import recalcular_todos_os_resumos
+
+class Command(BaseCommand):
+    help = 'Reconstrói os resumos de conformidade por cliente, de favoritas e de notificações não lidas por usuário.'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Recalculando os resumos do dashboard...")
+        inicio = time.monotonic()
+        clientes, perfis, usuarios = recalcular_todos_os_resumos()
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'Resumos recalculados em {duracao:.2f}s: {clientes} clientes, {perfis} perfis e {usuarios} usuários.'
+        ))
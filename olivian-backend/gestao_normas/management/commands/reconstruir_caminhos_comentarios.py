@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gestao_normas.comentarios import reconstruir_caminhos
+
+class Command(BaseCommand):
+    help = 'Recalcula o caminho materializado (caminho/profundidade) de todos os comentários a partir de comentario_pai.'
+
+    def handle(self, *args, **options):
+        self.stdout.write("Reconstruindo os caminhos dos comentários...")
+        inicio = time.monotonic()
+        alterados = reconstruir_caminhos()
+        duracao = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'Caminhos reconstruídos em {duracao:.2f}s: {alterados} comentários atualizados.'
+        ))
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0015_comentario_comentario_pai'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilaRevisaoNorma',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_criacao', models.DateTimeField(auto_now_add=True)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fila_revisoes', to='gestao_normas.cliente')),
+                ('norma', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fila_revisoes', to='gestao_normas.norma')),
+            ],
+            options={
+                'unique_together': {('norma', 'cliente')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0016_filarevisaonorma'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoConformidadeCliente',
+            fields=[
+                ('cliente', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumo_conformidade', serialize=False, to='gestao_normas.cliente')),
+                ('total_normas', models.PositiveIntegerField(default=0)),
+                ('normas_desatualizadas', models.PositiveIntegerField(default=0)),
+                ('normas_comentadas', models.PositiveIntegerField(default=0)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ResumoFavoritosUsuario',
+            fields=[
+                ('perfil', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumo_favoritos', serialize=False, to='gestao_normas.perfilusuario')),
+                ('normas_favoritas', models.PositiveIntegerField(default=0)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+import django.contrib.postgres.search
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0017_resumos'),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.TrigramExtension(),
+        migrations.AddField(
+            model_name='norma',
+            name='busca_vetor',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('norma', 'organizacao', config='portuguese', weight='A'), '||', django.contrib.postgres.search.SearchVector('titulo', config='portuguese', weight='B'), django.contrib.postgres.search.SearchConfig('portuguese')), '||', django.contrib.postgres.search.SearchVector('observacoes', config='portuguese', weight='C'), django.contrib.postgres.search.SearchConfig('portuguese')), '||', django.contrib.postgres.search.SearchVector('norma', 'organizacao', config='english', weight='A'), django.contrib.postgres.search.SearchConfig('portuguese')), '||', django.contrib.postgres.search.SearchVector('titulo', config='english', weight='B'), django.contrib.postgres.search.SearchConfig('portuguese')), '||', django.contrib.postgres.search.SearchVector('observacoes', config='english', weight='C'), django.contrib.postgres.search.SearchConfig('portuguese')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='norma',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busca_vetor'], name='norma_busca_vetor_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='norma',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Replace(django.db.models.functions.text.Upper(models.F('norma')), models.Value(' '), models.Value('')), name='gin_trgm_ops'), name='norma_codigo_trgm_gin'),
+        ),
+    ]
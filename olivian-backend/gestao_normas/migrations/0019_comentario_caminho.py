@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Preenche caminho/profundidade dos comentarios existentes a partir de
+# comentario_pai (mesma logica de comentarios.reconstruir_caminhos)
+PREENCHER_CAMINHOS = """
+    WITH RECURSIVE arvore(id, caminho, profundidade) AS (
+        SELECT id, lpad(id::text, 10, '0'), 0
+        FROM gestao_normas_comentario WHERE comentario_pai_id IS NULL
+        UNION ALL
+        SELECT filho.id, arvore.caminho || '.' || lpad(filho.id::text, 10, '0'), arvore.profundidade + 1
+        FROM gestao_normas_comentario filho JOIN arvore ON filho.comentario_pai_id = arvore.id
+    )
+    UPDATE gestao_normas_comentario SET caminho = arvore.caminho, profundidade = arvore.profundidade
+    FROM arvore WHERE gestao_normas_comentario.id = arvore.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0018_norma_busca'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comentario',
+            name='caminho',
+            field=models.TextField(db_collation='C', default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='comentario',
+            name='profundidade',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(PREENCHER_CAMINHOS, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='comentario',
+            index=models.Index(fields=['norma_cliente', 'caminho'], name='comentario_thread_caminho'),
+        ),
+    ]
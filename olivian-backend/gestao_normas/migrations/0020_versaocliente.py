@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0019_comentario_caminho'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoCliente',
+            fields=[
+                ('cliente', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='versao_dados', serialize=False, to='gestao_normas.cliente')),
+                ('versao', models.PositiveBigIntegerField(default=1)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
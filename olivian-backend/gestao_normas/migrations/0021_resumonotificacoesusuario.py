@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('gestao_normas', '0020_versaocliente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoNotificacoesUsuario',
+            fields=[
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='resumo_notificacoes', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('nao_lidas', models.PositiveIntegerField(default=0)),
+                ('ultima_notificacao_id', models.BigIntegerField(blank=True, null=True)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
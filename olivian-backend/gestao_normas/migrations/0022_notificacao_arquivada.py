@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0021_resumonotificacoesusuario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificacao',
+            name='arquivada',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0022_notificacao_arquivada'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='normacliente',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='comentario',
+            name='norma_cliente',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='comentarios', to='gestao_normas.normacliente'),
+        ),
+        migrations.AlterField(
+            model_name='normacliente',
+            name='cliente',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='gestao_normas.cliente'),
+        ),
+        migrations.AlterField(
+            model_name='notificacao',
+            name='usuario',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='notificacoes', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='comentario',
+            index=models.Index(condition=models.Q(('comentario_pai__isnull', True)), fields=['norma_cliente', 'data_criacao', 'id'], name='comentario_raizes'),
+        ),
+        migrations.AddIndex(
+            model_name='norma',
+            index=models.Index(fields=['revisao_atual', 'id'], name='norma_revisao_atual'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacao',
+            index=models.Index(fields=['usuario', 'id'], name='notificacao_usuario_id'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacao',
+            index=models.Index(condition=models.Q(('arquivada', False)), fields=['usuario', '-data_criacao', '-id'], name='notificacao_caixa_entrada'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacao',
+            index=models.Index(condition=models.Q(('visualizada', False)), fields=['usuario', 'norma', 'data_criacao'], name='notificacao_nao_lidas'),
+        ),
+        migrations.AddConstraint(
+            model_name='normacliente',
+            constraint=models.UniqueConstraint(fields=('cliente', 'norma'), include=('data_revisao_cliente',), name='normacliente_cliente_norma'),
+        ),
+    ]
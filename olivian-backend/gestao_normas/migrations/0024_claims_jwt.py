@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:28
+
+import django.contrib.auth.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('gestao_normas', '0023_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsuarioDoToken',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('auth.user',),
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='versao_permissoes',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
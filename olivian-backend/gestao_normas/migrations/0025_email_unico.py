@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+# O indice unico falharia com contas repetidas; a mensagem lista quais unificar
+VERIFICAR_DUPLICADOS = """
+    DO $$
+    DECLARE
+        repetidos text;
+    BEGIN
+        SELECT string_agg(email_normalizado, ', ') INTO repetidos FROM (
+            SELECT lower(email) AS email_normalizado FROM auth_user WHERE email <> ''
+            GROUP BY 1 HAVING count(*) > 1 ORDER BY 1 LIMIT 20
+        ) AS duplicados;
+        IF repetidos IS NOT NULL THEN
+            RAISE EXCEPTION 'Contas com o mesmo e-mail (sem diferenciar maiusculas): %. Unifique-as antes de migrar.',
+                repetidos;
+        END IF;
+    END
+    $$
+"""
+
+# Login e redefinicao de senha buscam por lower(email) (autenticacao.usuarios_por_email).
+# Usuarios sem e-mail (createsuperuser permite) ficam fora do indice.
+CRIAR_INDICE = "CREATE UNIQUE INDEX auth_user_email_lower ON auth_user (lower(email)) WHERE email <> ''"
+REMOVER_INDICE = "DROP INDEX IF EXISTS auth_user_email_lower"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('gestao_normas', '0024_claims_jwt'),
+    ]
+
+    operations = [
+        migrations.RunSQL(VERIFICAR_DUPLICADOS, migrations.RunSQL.noop),
+        migrations.RunSQL(CRIAR_INDICE, REMOVER_INDICE),
+    ]
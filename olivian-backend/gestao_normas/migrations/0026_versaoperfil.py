@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestao_normas', '0025_email_unico'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoPerfil',
+            fields=[
+                ('perfil', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='versao_dados', serialize=False, to='gestao_normas.perfilusuario')),
+                ('versao', models.PositiveBigIntegerField(default=1)),
+                ('data_atualizacao', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
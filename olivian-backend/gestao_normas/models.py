@@ -1,5 +1,15 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Replace, Substr, Upper
+
+
+def codigo_normalizado(expressao):
+    """Codigo de norma em maiusculas e sem espacos: 'gmw 3059' -> 'GMW3059'."""
+    return Replace(Upper(expressao), Value(' '), Value(''))
 
 # MODELO 1: O CLIENTE (A EMPRESA)
 class Cliente(models.Model):
@@ -41,18 +51,53 @@ class Norma(models.Model):
     observacoes = models.TextField(max_length=200, blank=True, null=True, help_text="Observacoes internas sobre a norma.")
     
     clientes = models.ManyToManyField('Cliente', through='NormaCliente')
+
+    # Vetor de busca textual (portugues + ingles), calculado pelo proprio Postgres
+    # a cada escrita. Pesos: codigo/organizacao (A), titulo (B), observacoes (C).
+    busca_vetor = models.GeneratedField(
+        expression=(
+            SearchVector('norma', 'organizacao', config='portuguese', weight='A')
+            + SearchVector('titulo', config='portuguese', weight='B')
+            + SearchVector('observacoes', config='portuguese', weight='C')
+            + SearchVector('norma', 'organizacao', config='english', weight='A')
+            + SearchVector('titulo', config='english', weight='B')
+            + SearchVector('observacoes', config='english', weight='C')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['busca_vetor'], name='norma_busca_vetor_gin'),
+            # Trigramas sobre o codigo normalizado (sem espacos, maiusculo), para
+            # que "GMW 3059" encontre "GMW3059" na busca aproximada.
+            GinIndex(
+                OpClass(codigo_normalizado(models.F('norma')), name='gin_trgm_ops'),
+                name='norma_codigo_trgm_gin',
+            ),
+            # Ordem padrao do catalogo paginado (NormaPagination)
+            models.Index(fields=['revisao_atual', 'id'], name='norma_revisao_atual'),
+        ]
     
     def __str__(self):
         return f"{self.organizacao} - {self.norma}"
 
 # MODELO 3: O RELACIONAMENTO ENTRE NORMA E CLIENTE
 class NormaCliente(models.Model):
-    cliente = models.ForeignKey('Cliente', on_delete=models.CASCADE)
+    # Sem indice proprio: o indice unico (cliente, norma) ja atende as buscas por cliente
+    cliente = models.ForeignKey('Cliente', on_delete=models.CASCADE, db_index=False)
     norma = models.ForeignKey('Norma', on_delete=models.CASCADE)
     data_revisao_cliente = models.DateField(help_text="Data da ultima revisao desta norma no cliente.")
 
     class Meta:
-        unique_together = ('cliente', 'norma')
+        constraints = [
+            # A revisao do cliente vai junto no indice: o conjunto de normas do
+            # cliente e o join com Norma sao lidos so do indice (index-only scan)
+            models.UniqueConstraint(
+                fields=['cliente', 'norma'], include=['data_revisao_cliente'], name='normacliente_cliente_norma',
+            ),
+        ]
 
     def __str__(self):
         return f"Revisao da Norma '{self.norma.norma}' para o Cliente '{self.cliente.empresa}'"
@@ -77,8 +122,40 @@ class PerfilUsuario(models.Model):
     # Campo para normas favoritas, mantido como estava
     normas_favoritas = models.ManyToManyField(Norma, blank=True, related_name='favoritado_por')
 
+    # Vai nas claims do JWT; incrementada quando permissoes, cliente ou o
+    # proprio usuario mudam, o que invalida os tokens ja emitidos
+    versao_permissoes = models.PositiveIntegerField(default=1)
+
     def __str__(self):
         return self.usuario.username
+
+
+CAMPOS_PERMISSAO = (
+    'pode_gerenciar_auditorias',
+    'pode_gerenciar_certificacoes',
+    'pode_gerenciar_centros_de_custo',
+    'pode_gerenciar_comentarios',
+    'pode_gerenciar_precos',
+    'pode_gerenciar_favoritos',
+)
+
+
+class UsuarioDoToken(User):
+    """
+    Usuario montado a partir das claims do JWT (gestao_normas/autenticacao.py),
+    sem consultar o banco: so id e flags vem preenchidos. O primeiro acesso a
+    qualquer outro campo carrega todos os que faltam em uma unica query.
+    """
+
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        adiados = self.get_deferred_fields()
+        if fields is not None and adiados and set(fields) <= adiados:
+            fields = adiados
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
     
 # MODELO 5: HISToRICO DE REVISaO SECUNDARIA
 REVISAO_SECUNDARIA_CHOICES = [
@@ -96,8 +173,8 @@ class RevisaoSecundariaHistorico(models.Model):
         return f"Revisao SecundAria: {self.tipo_revisao} em {self.data} para {self.norma.norma}"
     
 class Notificacao(models.Model):
-    # O usuArio que receberA a notificacao
-    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notificacoes')
+    # O usuArio que receberA a notificacao (indexado pelos indices compostos abaixo)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notificacoes', db_index=False)
     
     # O objeto ao qual a notificacao se refere (neste caso, uma Norma)
     norma = models.ForeignKey(Norma, on_delete=models.CASCADE, related_name='notificacoes')
@@ -107,18 +184,47 @@ class Notificacao(models.Model):
     
     # Se a notificacao jA foi visualizada
     visualizada = models.BooleanField(default=False)
+
+    # Arquivada pelo usuario: sai da lista e do contador de nao lidas
+    arquivada = models.BooleanField(default=False)
     
     # A data e hora da criacao da notificacao
     data_criacao = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Notificacoes novas desde um id (stream/long-poll) e demais buscas por usuario
+            models.Index(fields=['usuario', 'id'], name='notificacao_usuario_id'),
+            # Lista do usuario na ordem da NotificacaoPagination, so a caixa de entrada
+            models.Index(
+                fields=['usuario', '-data_criacao', '-id'],
+                condition=models.Q(arquivada=False),
+                name='notificacao_caixa_entrada',
+            ),
+            # Nao lidas: contador, marcar-lidas e a checagem de notificacao
+            # repetida na geracao diaria (usuario, norma, criada hoje)
+            models.Index(
+                fields=['usuario', 'norma', 'data_criacao'],
+                condition=models.Q(visualizada=False),
+                name='notificacao_nao_lidas',
+            ),
+        ]
     
     def __str__(self):
         return f"Notificacao para {self.usuario.username} sobre {self.norma.norma}"
     
     # Em gestao_normas/models.py
 
+SEPARADOR_CAMINHO = '.'
+DIGITOS_CAMINHO = 10
+# Limite de niveis de resposta: mantem o caminho abaixo do tamanho maximo
+# de uma entrada de indice btree (~2700 bytes)
+PROFUNDIDADE_LIMITE = 200
+
 class Comentario(models.Model):
     # ALTERADO: Agora o comentArio pertence a uma relacao Norma-Cliente
-    norma_cliente = models.ForeignKey('NormaCliente', on_delete=models.CASCADE, related_name='comentarios')
+    # (sem indice proprio: e o prefixo dos indices da thread abaixo)
+    norma_cliente = models.ForeignKey('NormaCliente', on_delete=models.CASCADE, related_name='comentarios', db_index=False)
     usuario = models.ForeignKey('auth.User', on_delete=models.CASCADE)
     descricao = models.CharField(max_length=100, blank=True)
     comentario = models.TextField()
@@ -134,19 +240,70 @@ class Comentario(models.Model):
     
     data_criacao = models.DateTimeField(auto_now_add=True)
 
+    # Caminho materializado: ids dos ancestrais e do proprio comentario, com
+    # DIGITOS_CAMINHO digitos cada, separados por SEPARADOR_CAMINHO
+    # ("0000000012.0000000034"). Em collation "C" a ordem por caminho e a
+    # ordem da thread, e a subarvore de um comentario e um intervalo do indice.
+    caminho = models.TextField(default='', editable=False, db_collation='C')
+    profundidade = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['norma_cliente', 'caminho'], name='comentario_thread_caminho'),
+            # Comentarios raiz da thread na ordem da ComentarioPagination
+            models.Index(
+                fields=['norma_cliente', 'data_criacao', 'id'],
+                condition=models.Q(comentario_pai__isnull=True),
+                name='comentario_raizes',
+            ),
+        ]
+
+    def calcular_caminho(self):
+        pai = self.comentario_pai
+        segmento = f'{self.pk:0{DIGITOS_CAMINHO}d}'
+        if pai is None:
+            return segmento
+        if pai.pk == self.pk or pai.caminho.startswith(f'{self.caminho}{SEPARADOR_CAMINHO}'):
+            raise ValidationError('Um comentario nao pode responder a si mesmo nem a uma de suas respostas.')
+        if pai.profundidade >= PROFUNDIDADE_LIMITE:
+            raise ValidationError(f'Limite de {PROFUNDIDADE_LIMITE} niveis de resposta atingido.')
+        return f'{pai.caminho}{SEPARADOR_CAMINHO}{segmento}'
+
+    def save(self, *args, **kwargs):
+        """
+        Grava o comentario e mantem o caminho materializado: na criacao o
+        caminho e definido apos o INSERT (depende do id) e, se o comentario
+        mudou de pai, a subarvore inteira e movida com um unico UPDATE.
+        """
+        caminho_antigo = self.caminho
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            caminho = self.calcular_caminho()
+            if caminho == caminho_antigo:
+                return
+            profundidade = caminho.count(SEPARADOR_CAMINHO)
+            if caminho_antigo:
+                Comentario.objects.filter(
+                    norma_cliente_id=self.norma_cliente_id,
+                    caminho__startswith=f'{caminho_antigo}{SEPARADOR_CAMINHO}',
+                ).update(
+                    caminho=Concat(Value(caminho), Substr('caminho', len(caminho_antigo) + 1)),
+                    profundidade=F('profundidade') + (profundidade - self.profundidade),
+                )
+            Comentario.objects.filter(pk=self.pk).update(caminho=caminho, profundidade=profundidade)
+            self.caminho, self.profundidade = caminho, profundidade
+
     # 🚀 LÓGICA DE EXCLUSÃO RECURSIVA (CASCADE NO DELETE)
     def delete(self, *args, **kwargs):
         """
-        Sobrescreve o método delete para remover recursivamente 
-        todas as respostas antes de remover o comentário pai.
+        Sobrescreve o metodo delete para remover o comentario junto com todas
+        as respostas (a subarvore inteira) em um unico DELETE.
         """
-        # 1. Itera sobre todas as respostas (filhos) usando o related_name 'respostas'
-        for resposta in self.respostas.all():
-            # Chama o delete para cada resposta, garantindo a recursão
-            resposta.delete() 
-        
-        # 2. Executa a exclusão padrão do objeto pai
-        super().delete(*args, **kwargs)
+        from .comentarios import excluir_com_respostas
+
+        total = excluir_com_respostas([self.pk])
+        self.pk = None
+        return total, {self._meta.label: total}
 
     def __str__(self):
         return f'ComentArio de {self.usuario.username} em {self.norma_cliente.norma.norma}'
@@ -181,4 +338,75 @@ class CentroDeCusto(models.Model):
     normas = models.ManyToManyField(Norma, blank=True)
 
     def __str__(self):
-        return f"Centro de Custo '{self.nome}' do cliente {self.cliente.empresa}"
\ No newline at end of file
+        return f"Centro de Custo '{self.nome}' do cliente {self.cliente.empresa}"
+
+
+# Fila de pares (norma, cliente) afetados por uma nova revisao_atual.
+# Alimentada quando a revisao de uma norma muda e drenada pelo comando
+# processar_fila_revisoes, que notifica apenas esses pares.
+class FilaRevisaoNorma(models.Model):
+    norma = models.ForeignKey(Norma, on_delete=models.CASCADE, related_name='fila_revisoes')
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='fila_revisoes')
+    data_criacao = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('norma', 'cliente')
+
+    def __str__(self):
+        return f"Revisao pendente da norma {self.norma_id} para o cliente {self.cliente_id}"
+
+# Resumo de conformidade por cliente, mantido nas escritas relevantes
+# (gestao_normas/resumos.py) para o dashboard ler tudo em uma unica query.
+class ResumoConformidadeCliente(models.Model):
+    cliente = models.OneToOneField(Cliente, on_delete=models.CASCADE, primary_key=True, related_name='resumo_conformidade')
+    total_normas = models.PositiveIntegerField(default=0)
+    normas_desatualizadas = models.PositiveIntegerField(default=0)
+    normas_comentadas = models.PositiveIntegerField(default=0)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Resumo de conformidade do cliente {self.cliente_id}"
+
+# Contagem de favoritas por usuario, mantida junto com o resumo do cliente.
+class ResumoFavoritosUsuario(models.Model):
+    perfil = models.OneToOneField(PerfilUsuario, on_delete=models.CASCADE, primary_key=True, related_name='resumo_favoritos')
+    normas_favoritas = models.PositiveIntegerField(default=0)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Resumo de favoritas do perfil {self.perfil_id}"
+
+# Notificacoes nao lidas por usuario, mantidas a cada escrita em Notificacao
+# (gestao_normas/resumos.py), para o contador do sino nao varrer a tabela.
+class ResumoNotificacoesUsuario(models.Model):
+    usuario = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='resumo_notificacoes')
+    nao_lidas = models.PositiveIntegerField(default=0)
+    # Maior id de notificacao do usuario: "ha algo novo desde X?" sem query
+    ultima_notificacao_id = models.BigIntegerField(null=True, blank=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Resumo de notificacoes do usuario {self.usuario_id}"
+
+# Versao dos dados de cada cliente: incrementada a cada escrita que muda o que
+# o cliente ve (gestao_normas/versoes.py) e usada nos ETags das leituras.
+class VersaoCliente(models.Model):
+    cliente = models.OneToOneField(Cliente, on_delete=models.CASCADE, primary_key=True, related_name='versao_dados')
+    versao = models.PositiveBigIntegerField(default=1)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Versao {self.versao} dos dados do cliente {self.cliente_id}"
+
+
+# Versao dos dados de cada perfil: favoritas e notificacoes so mudam o que o
+# proprio usuario ve. Vai no ETag junto com a do cliente, sem invalidar as
+# leituras dos demais usuarios do cliente.
+class VersaoPerfil(models.Model):
+    perfil = models.OneToOneField(PerfilUsuario, on_delete=models.CASCADE, primary_key=True,
+                                  related_name='versao_dados')
+    versao = models.PositiveBigIntegerField(default=1)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Versao {self.versao} dos dados do perfil {self.perfil_id}"
@@ -0,0 +1,208 @@
+from datetime import datetime, time, timedelta
+
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import FilaRevisaoNorma, NormaCliente, Notificacao, PerfilUsuario
+from .eventos import publicar_notificacoes_novas
+from .resumos import atualizar_resumos_notificacoes
+from .versoes import incrementar_versoes_dos_usuarios
+
+
+# Notificacoes lidas mais antigas que isso sao removidas pelo expurgo
+DIAS_RETENCAO = 180
+# Linhas removidas/arquivadas por transacao no expurgo
+TAMANHO_LOTE_EXPURGO = 5000
+
+
+def inicio_do_dia():
+    return timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+
+
+def relacoes_desatualizadas(relacoes=None):
+    """
+    NormaCliente cuja norma tem revisao_atual mais nova que a revisao do cliente
+    e que ainda nao tem notificacao nao lida criada hoje para o usuario do cliente.
+
+    Tudo e resolvido em uma unica query: a comparacao de datas e um filtro, o
+    usuario notificado (o primeiro perfil do cliente) e uma subquery e a
+    notificacao ja existente e um NOT EXISTS (anti-join no Postgres).
+    """
+    if relacoes is None:
+        relacoes = NormaCliente.objects.all()
+
+    usuario_do_cliente = (
+        PerfilUsuario.objects.filter(cliente=OuterRef('cliente'))
+        .order_by('pk')
+        .values('usuario_id')[:1]
+    )
+    ja_notificada = Notificacao.objects.filter(
+        usuario_id=OuterRef('usuario_notificado'),
+        norma_id=OuterRef('norma_id'),
+        visualizada=False,
+        data_criacao__gte=inicio_do_dia(),
+    )
+    return (
+        relacoes.filter(norma__revisao_atual__gt=F('data_revisao_cliente'))
+        .annotate(usuario_notificado=Subquery(usuario_do_cliente))
+        .filter(usuario_notificado__isnull=False)
+        .filter(~Exists(ja_notificada))
+        .order_by()
+        .values_list(
+            'norma_id', 'usuario_notificado',
+            'norma__organizacao', 'norma__norma', 'norma__revisao_atual',
+            'data_revisao_cliente',
+        )
+    )
+
+
+def gerar_notificacoes(relacoes=None, batch_size=1000, dry_run=False):
+    """
+    Cria as notificacoes de normas desatualizadas em lotes de bulk_create.
+    Retorna o numero de notificacoes criadas (ou que seriam criadas no dry_run).
+    """
+    pendentes = relacoes_desatualizadas(relacoes)
+    if dry_run:
+        return pendentes.count()
+
+    criadas = 0
+    lote = []
+    usuarios = set()
+    for norma_id, usuario_id, organizacao, codigo, revisao_atual, revisao_cliente in pendentes.iterator(chunk_size=batch_size):
+        usuarios.add(usuario_id)
+        lote.append(Notificacao(
+            usuario_id=usuario_id,
+            norma_id=norma_id,
+            mensagem=(f"A norma {organizacao} - {codigo} "
+                      f"foi atualizada em {revisao_atual}. "
+                      f"A sua versão é de {revisao_cliente}."),
+        ))
+        if len(lote) >= batch_size:
+            Notificacao.objects.bulk_create(lote)
+            criadas += len(lote)
+            lote = []
+    if lote:
+        Notificacao.objects.bulk_create(lote)
+        criadas += len(lote)
+    # bulk_create nao dispara sinais: atualiza versoes e contadores e avisa
+    # os usuarios conectados ao stream
+    incrementar_versoes_dos_usuarios(usuarios)
+    atualizar_resumos_notificacoes(usuarios)
+    publicar_notificacoes_novas(usuarios)
+    return criadas
+
+
+def _notificacoes_alteradas(usuario_ids):
+    # update()/DELETE em lote nao disparam sinais: atualiza contadores e ETags
+    incrementar_versoes_dos_usuarios(usuario_ids)
+    atualizar_resumos_notificacoes(usuario_ids)
+
+
+def marcar_como_lidas(usuario, ids=None, ate_id=None, norma_id=None):
+    """
+    Marca como lidas, em um unico UPDATE, as notificacoes nao lidas do usuario
+    (todas, ou so as de 'ids', ate o id 'ate_id' e/ou da norma 'norma_id').
+    Retorna quantas foram alteradas.
+    """
+    notificacoes = Notificacao.objects.filter(usuario=usuario, visualizada=False)
+    if ids is not None:
+        notificacoes = notificacoes.filter(pk__in=ids)
+    if ate_id is not None:
+        notificacoes = notificacoes.filter(pk__lte=ate_id)
+    if norma_id is not None:
+        notificacoes = notificacoes.filter(norma_id=norma_id)
+    with transaction.atomic():
+        alteradas = notificacoes.update(visualizada=True)
+        if alteradas:
+            _notificacoes_alteradas([usuario.pk])
+    return alteradas
+
+
+def arquivar_notificacoes(usuario, ids):
+    """Arquiva as notificacoes do usuario com os ids informados (um UPDATE)."""
+    with transaction.atomic():
+        alteradas = Notificacao.objects.filter(usuario=usuario, pk__in=ids, arquivada=False).update(arquivada=True)
+        if alteradas:
+            _notificacoes_alteradas([usuario.pk])
+    return alteradas
+
+
+def expurgar_notificacoes(dias=DIAS_RETENCAO, arquivar=False, lote=TAMANHO_LOTE_EXPURGO, dry_run=False):
+    """
+    Remove (ou, com 'arquivar', arquiva) as notificacoes lidas criadas ha mais
+    de 'dias' dias. Cada lote e uma transacao curta; os lotes avancam pela
+    chave primaria, entao a tabela e percorrida uma unica vez. Retorna o
+    numero de notificacoes afetadas (ou que seriam, no dry_run).
+    """
+    antigas = Notificacao.objects.filter(visualizada=True, data_criacao__lt=timezone.now() - timedelta(days=dias))
+    if arquivar:
+        antigas = antigas.filter(arquivada=False)
+    if dry_run:
+        return antigas.count()
+
+    tabela = connection.ops.quote_name(Notificacao._meta.db_table)
+    total = 0
+    ultimo_id = 0
+    while True:
+        with transaction.atomic():
+            linhas = list(antigas.filter(pk__gt=ultimo_id).order_by('pk').values_list('pk', 'usuario_id')[:lote])
+            if not linhas:
+                break
+            ids = [pk for pk, _ in linhas]
+            if arquivar:
+                Notificacao.objects.filter(pk__in=ids).update(arquivada=True)
+            else:
+                # DELETE direto: o delete() do ORM carregaria cada linha para
+                # disparar os sinais de post_delete
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DELETE FROM {tabela} WHERE id = ANY(%s)', [ids])
+            _notificacoes_alteradas({usuario_id for _, usuario_id in linhas})
+        total += len(ids)
+        ultimo_id = ids[-1]
+    return total
+
+
+def enfileirar_revisao(norma):
+    """
+    Coloca na fila de revisoes os pares (norma, cliente) que ficaram
+    desatualizados com a revisao_atual da norma. Pares ja enfileirados
+    sao ignorados pela restricao unica da fila.
+    """
+    enfileirar_revisoes([norma.pk])
+
+
+def enfileirar_revisoes(norma_ids):
+    """Versao em lote de enfileirar_revisao, usada pela importacao de catalogos."""
+    pares = NormaCliente.objects.filter(
+        norma_id__in=norma_ids, data_revisao_cliente__lt=F('norma__revisao_atual')
+    ).values_list('norma_id', 'cliente_id')
+    FilaRevisaoNorma.objects.bulk_create(
+        [FilaRevisaoNorma(norma_id=norma_id, cliente_id=cliente_id) for norma_id, cliente_id in pares],
+        ignore_conflicts=True,
+    )
+
+
+def processar_fila_revisoes(batch_size=1000):
+    """
+    Drena um lote da fila de revisoes e cria as notificacoes apenas para esses
+    pares. As linhas sao travadas com SKIP LOCKED, entao varios workers podem
+    rodar ao mesmo tempo. Retorna (pares processados, notificacoes criadas).
+    """
+    with transaction.atomic():
+        ids = list(
+            FilaRevisaoNorma.objects.select_for_update(skip_locked=True)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0, 0
+
+        na_fila = FilaRevisaoNorma.objects.filter(
+            pk__in=ids, norma_id=OuterRef('norma_id'), cliente_id=OuterRef('cliente_id')
+        )
+        criadas = gerar_notificacoes(
+            NormaCliente.objects.filter(Exists(na_fila)), batch_size=batch_size
+        )
+        FilaRevisaoNorma.objects.filter(pk__in=ids).delete()
+    return len(ids), criadas
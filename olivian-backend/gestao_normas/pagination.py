@@ -0,0 +1,196 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginacao por cursor (keyset) sobre uma ordenacao estavel.
+
+    Em vez de OFFSET, cada pagina filtra "depois da ultima linha vista" pela
+    tupla de ordenacao, entao o custo de uma pagina nao cresce com o tamanho
+    do acervo. O ultimo campo da ordenacao deve ser unico (o 'id' e acrescentado
+    automaticamente). Campos do modelo com null=True podem ser ordenados: NULL
+    fica depois de tudo na ordem crescente e antes na decrescente (o padrao do
+    Postgres). Anotacoes sao tratadas como nao nulas.
+
+    A paginacao e opcional: sem ?page_size nem ?cursor a view devolve a lista
+    completa, como antes, para nao quebrar o frontend atual (exceto nas
+    subclasses com paginacao_opcional = False). Com ?com_total=true
+    a resposta inclui 'count' (um COUNT(*) extra).
+    """
+    ordering = ('id',)
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    total_query_param = 'com_total'
+    invalid_cursor_message = 'Cursor invalido.'
+    # False nos endpoints sem clientes legados: pagina sempre
+    paginacao_opcional = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        paginacao_pedida = self.page_size_query_param in params or self.cursor_query_param in params
+        if self.paginacao_opcional and not paginacao_pedida:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.campos = self.get_ordering(request, queryset, view)
+        self.anulaveis = {campo.lstrip('-') for campo in self.campos if self._anulavel(queryset, campo.lstrip('-'))}
+        self.count = queryset.count() if self.deve_incluir_total(request) else None
+
+        queryset = queryset.order_by(*self._ordenacao())
+        posicao = self.decode_cursor(request)
+        if posicao is not None:
+            queryset = queryset.filter(self.filtro_apos(posicao))
+
+        linhas = list(queryset[:self.page_size + 1])
+        self.tem_proxima = len(linhas) > self.page_size
+        self.pagina = linhas[:self.page_size]
+        return self.pagina
+
+    def get_paginated_response(self, data):
+        resposta = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            resposta = {'count': self.count, **resposta}
+        return Response(resposta)
+
+    def get_page_size(self, request):
+        try:
+            tamanho = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if tamanho <= 0:
+            return self.page_size
+        return min(tamanho, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        # Respeita o ?ordering= do OrderingFilter quando a view o utiliza
+        campos = None
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                campos = backend().get_ordering(request, queryset, view)
+                break
+        campos = list(campos or self.ordering)
+        if not any(campo.lstrip('-') in ('id', 'pk') for campo in campos):
+            campos.append('-id' if campos[0].startswith('-') else 'id')
+        return tuple(campos)
+
+    def deve_incluir_total(self, request):
+        return request.query_params.get(self.total_query_param, '').lower() in ('1', 'true', 'sim')
+
+    def _anulavel(self, queryset, nome):
+        try:
+            return queryset.model._meta.get_field(nome).null
+        except FieldDoesNotExist:
+            return False
+
+    def _ordenacao(self):
+        # NULLS LAST/FIRST explicitos nos campos anulaveis: filtro_apos depende deles
+        ordenacao = []
+        for campo in self.campos:
+            nome = campo.lstrip('-')
+            if nome not in self.anulaveis:
+                ordenacao.append(campo)
+            elif campo.startswith('-'):
+                ordenacao.append(F(nome).desc(nulls_first=True))
+            else:
+                ordenacao.append(F(nome).asc(nulls_last=True))
+        return ordenacao
+
+    def filtro_apos(self, posicao):
+        # (a, b, id) > (va, vb, vid) respeitando a direcao de cada campo:
+        # a > va OU (a = va E b > vb) OU (a = va E b = vb E id > vid).
+        # Com NULL: na ordem crescente vem depois de qualquer valor; na
+        # decrescente, antes.
+        filtro = Q()
+        anteriores = Q()
+        for campo, valor in zip(self.campos, posicao):
+            nome = campo.lstrip('-')
+            decrescente = campo.startswith('-')
+            if valor is None:
+                depois = Q(**{f'{nome}__isnull': False}) if decrescente else None
+                igual = Q(**{f'{nome}__isnull': True})
+            else:
+                depois = Q(**{f'{nome}__{"lt" if decrescente else "gt"}': valor})
+                if nome in self.anulaveis and not decrescente:
+                    depois |= Q(**{f'{nome}__isnull': True})
+                igual = Q(**{nome: valor})
+            if depois is not None:
+                filtro |= anteriores & depois
+            anteriores &= igual
+        return filtro
+
+    def get_next_link(self):
+        if not self.tem_proxima:
+            return None
+        ultima = self.pagina[-1]
+        posicao = [self._valor_do_campo(ultima, campo.lstrip('-')) for campo in self.campos]
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.total_query_param)
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(posicao))
+
+    def _valor_do_campo(self, instancia, campo):
+        if campo == 'pk':
+            return instancia.pk
+        return getattr(instancia, campo)
+
+    def encode_cursor(self, posicao):
+        valores = [self._serializar_valor(valor) for valor in posicao]
+        return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            posicao = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(posicao, list) or len(posicao) != len(self.campos):
+            raise NotFound(self.invalid_cursor_message)
+        return posicao
+
+    def _serializar_valor(self, valor):
+        # isoformat() completo: o DjangoJSONEncoder trunca microssegundos, o que
+        # faria o cursor pular ou repetir linhas com data_criacao proximas.
+        if isinstance(valor, (date, datetime)):
+            return valor.isoformat()
+        if isinstance(valor, Decimal):
+            return str(valor)
+        return valor
+
+
+class NormaPagination(KeysetPagination):
+    ordering = ('revisao_atual', 'id')
+
+
+class BuscaPagination(KeysetPagination):
+    ordering = ('-relevancia', 'id')
+    page_size = 20
+    paginacao_opcional = False
+
+
+class NotificacaoPagination(KeysetPagination):
+    ordering = ('-data_criacao', '-id')
+
+
+class ComentarioPagination(KeysetPagination):
+    ordering = ('data_criacao', 'id')
+
+
+class VinculoPagination(KeysetPagination):
+    # Auditorias, Certificacoes e Centros de Custo
+    ordering = ('nome', 'id')
@@ -1,8 +1,23 @@
 # Em gestao_normas/permissions.py
+import hmac
+
 from rest_framework import permissions
 
+from .instrumentacao import configuracao as configuracao_instrumentacao
+
 class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.usuario == request.user
\ No newline at end of file
+        return obj.usuario == request.user
+
+
+class PodeLerMetricas(permissions.BasePermission):
+    """Staff, ou o coletor (Prometheus) com 'Authorization: Metricas <token>'."""
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_staff:
+            return True
+        token = configuracao_instrumentacao()['TOKEN_METRICAS']
+        tipo, _, credencial = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        return bool(token) and tipo == 'Metricas' and hmac.compare_digest(credencial.encode(), token.encode())
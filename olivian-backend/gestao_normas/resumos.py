@@ -0,0 +1,162 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.contrib.auth.models import User
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import (
+    Cliente,
+    Comentario,
+    NormaCliente,
+    Notificacao,
+    PerfilUsuario,
+    ResumoConformidadeCliente,
+    ResumoFavoritosUsuario,
+    ResumoNotificacoesUsuario,
+)
+
+
+# Clientes/perfis recalculados por UPDATE no rebuild completo
+TAMANHO_LOTE = 500
+
+
+def _contagem(queryset, campo):
+    # Subquery correlacionada "SELECT COUNT(*) ... WHERE campo = <linha externa>"
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{campo: OuterRef('pk')})
+            .order_by()
+            .values(campo)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def _travar(modelo, ids):
+    """
+    Trava as linhas de resumo (em ordem de pk, sem deadlock entre recontagens)
+    antes do UPDATE. Em READ COMMITTED, um UPDATE que espera o lock de outra
+    transacao reavalia a linha, mas as subqueries do SET continuam com o
+    snapshot antigo e gravariam contagens sem as escritas da outra. Aqui a
+    espera acontece neste SELECT, e o UPDATE seguinte ja tem um snapshot novo.
+    """
+    list(modelo.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', flat=True))
+
+
+def atualizar_resumos_clientes(cliente_ids):
+    """
+    Recalcula os resumos de conformidade dos clientes informados com um unico
+    UPDATE (contagens por subquery), criando as linhas que ainda nao existem.
+    Recontagens concorrentes do mesmo cliente sao serializadas por _travar.
+    """
+    cliente_ids = set(cliente_ids)
+    if not cliente_ids:
+        return
+    with transaction.atomic():
+        ResumoConformidadeCliente.objects.bulk_create(
+            [ResumoConformidadeCliente(cliente_id=cliente_id) for cliente_id in cliente_ids],
+            ignore_conflicts=True,
+        )
+        _travar(ResumoConformidadeCliente, cliente_ids)
+        ResumoConformidadeCliente.objects.filter(pk__in=cliente_ids).update(
+            total_normas=_contagem(NormaCliente.objects.all(), 'cliente'),
+            normas_desatualizadas=_contagem(
+                NormaCliente.objects.filter(norma__revisao_atual__gt=F('data_revisao_cliente')),
+                'cliente',
+            ),
+            normas_comentadas=_contagem(Comentario.objects.all(), 'norma_cliente__cliente'),
+        )
+
+
+def atualizar_resumos_da_norma(norma):
+    """Recalcula os resumos de todos os clientes que possuem a norma."""
+    atualizar_resumos_das_normas([norma.pk])
+
+
+def atualizar_resumos_das_normas(norma_ids):
+    atualizar_resumos_clientes(
+        NormaCliente.objects.filter(norma_id__in=norma_ids).values_list('cliente_id', flat=True)
+    )
+
+
+def atualizar_resumos_favoritos(perfil_ids):
+    """Recalcula a contagem de normas favoritas dos perfis informados."""
+    perfil_ids = set(perfil_ids)
+    if not perfil_ids:
+        return
+    with transaction.atomic():
+        ResumoFavoritosUsuario.objects.bulk_create(
+            [ResumoFavoritosUsuario(perfil_id=perfil_id) for perfil_id in perfil_ids],
+            ignore_conflicts=True,
+        )
+        _travar(ResumoFavoritosUsuario, perfil_ids)
+        ResumoFavoritosUsuario.objects.filter(pk__in=perfil_ids).update(
+            normas_favoritas=_contagem(PerfilUsuario.normas_favoritas.through.objects.all(), 'perfilusuario'),
+        )
+
+
+def atualizar_resumos_notificacoes(usuario_ids):
+    """Recalcula nao lidas e a ultima notificacao dos usuarios informados."""
+    usuario_ids = set(usuario_ids)
+    if not usuario_ids:
+        return
+    ultima = (
+        Notificacao.objects.filter(usuario=OuterRef('pk'))
+        .order_by()
+        .values('usuario')
+        .annotate(ultima=Max('pk'))
+        .values('ultima')
+    )
+    with transaction.atomic():
+        ResumoNotificacoesUsuario.objects.bulk_create(
+            [ResumoNotificacoesUsuario(usuario_id=usuario_id) for usuario_id in usuario_ids],
+            ignore_conflicts=True,
+        )
+        _travar(ResumoNotificacoesUsuario, usuario_ids)
+        ResumoNotificacoesUsuario.objects.filter(pk__in=usuario_ids).update(
+            nao_lidas=_contagem(Notificacao.objects.filter(visualizada=False, arquivada=False), 'usuario'),
+            ultima_notificacao_id=Subquery(ultima),
+        )
+
+
+def obter_resumo_cliente(cliente):
+    """Resumo do cliente; se ainda nao existir (antes do rebuild), e criado na hora."""
+    try:
+        return cliente.resumo_conformidade
+    except ObjectDoesNotExist:
+        atualizar_resumos_clientes([cliente.pk])
+        return ResumoConformidadeCliente.objects.get(pk=cliente.pk)
+
+
+def obter_resumo_favoritos(perfil):
+    try:
+        return perfil.resumo_favoritos
+    except ObjectDoesNotExist:
+        atualizar_resumos_favoritos([perfil.pk])
+        return ResumoFavoritosUsuario.objects.get(pk=perfil.pk)
+
+
+def obter_resumo_notificacoes(usuario):
+    try:
+        return usuario.resumo_notificacoes
+    except ObjectDoesNotExist:
+        atualizar_resumos_notificacoes([usuario.pk])
+        return ResumoNotificacoesUsuario.objects.get(pk=usuario.pk)
+
+
+def recalcular_todos_os_resumos():
+    """Reconstroi todos os resumos, em lotes. Retorna (clientes, perfis, usuarios)."""
+    cliente_ids = list(Cliente.objects.values_list('pk', flat=True))
+    for inicio in range(0, len(cliente_ids), TAMANHO_LOTE):
+        atualizar_resumos_clientes(cliente_ids[inicio:inicio + TAMANHO_LOTE])
+
+    perfil_ids = list(PerfilUsuario.objects.values_list('pk', flat=True))
+    for inicio in range(0, len(perfil_ids), TAMANHO_LOTE):
+        atualizar_resumos_favoritos(perfil_ids[inicio:inicio + TAMANHO_LOTE])
+
+    usuario_ids = list(User.objects.values_list('pk', flat=True))
+    for inicio in range(0, len(usuario_ids), TAMANHO_LOTE):
+        atualizar_resumos_notificacoes(usuario_ids[inicio:inicio + TAMANHO_LOTE])
+    return len(cliente_ids), len(perfil_ids), len(usuario_ids)
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class PBKDF2Configuravel(PBKDF2PasswordHasher):
+    """
+    PBKDF2 do Django com as iteracoes em settings.SENHA_ITERACOES_PBKDF2 (None:
+    o padrao do Django). Mesmo algoritmo: os hashes existentes continuam
+    validos e sao refeitos no login seguinte quando o numero muda.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'SENHA_ITERACOES_PBKDF2', None) or PBKDF2PasswordHasher.iterations
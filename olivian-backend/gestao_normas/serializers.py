@@ -1,12 +1,18 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from .models import (Cliente, Norma, NormaCliente, PerfilUsuario, RevisaoSecundariaHistorico, Notificacao, Comentario, Auditoria, Certificacao, CentroDeCusto)
 from datetime import date, datetime
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import password_validation
 from django.utils.translation import gettext_lazy as _
 from rest_framework import serializers
 from .models import Comentario # Assumindo que Comentario está importado
+from .comentarios import PROFUNDIDADE_MAXIMA, carregar_respostas
+from .models import SEPARADOR_CAMINHO
+from .autenticacao import RefreshTokenComPerfil, normalizar_email, usuarios_por_email
+from .contexto import get_contexto_cliente
+from .notificacoes import enfileirar_revisao
+from .resumos import atualizar_resumos_da_norma
 
 
 User = get_user_model()
@@ -73,6 +79,17 @@ class PerfilUsuarioSerializer(serializers.ModelSerializer):
 # --- FIM DOS SERIALIZADORES DE PERFIL DE USUÁRIO ---
 
 
+# Serializador de lista para Norma: pre-carrega o contexto do cliente para
+# todas as normas da pagina antes de serializar linha a linha.
+class NormaListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        normas = list(data.all() if hasattr(data, 'all') else data)
+        contexto = get_contexto_cliente(self.context.get('request'))
+        # Normas vindas de anotar_normas_do_cliente ja trazem os campos do banco
+        contexto.preparar(norma.pk for norma in normas if not hasattr(norma, 'status_atualizado'))
+        return super().to_representation(normas)
+
+
 # Serializador para o modelo Norma
 class NormaSerializer(serializers.ModelSerializer):
     sua_revisao = serializers.SerializerMethodField()
@@ -82,6 +99,7 @@ class NormaSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Norma
+        list_serializer_class = NormaListSerializer
         # A API de detalhes usara apenas esses campos.
         fields = [
             'id', 'organizacao', 'norma', 'titulo', 'revisao_atual',
@@ -89,55 +107,31 @@ class NormaSerializer(serializers.ModelSerializer):
             'sua_revisao', 'status_atualizado', 'is_favorita', 'observacoes', 'comentarios_count'
         ]
 
+    def _contexto(self):
+        # O mesmo ContextoCliente e reaproveitado por todas as linhas da requisicao
+        return get_contexto_cliente(self.context.get('request'))
+
+    # Cada campo usa a anotacao do queryset quando existir (MinhasNormasListAPIView)
+    # e cai para o ContextoCliente nas demais views.
     def get_comentarios_count(self, obj):
-        # obj aqui e uma instancia de Norma
-        request = self.context.get('request')
-        if request and hasattr(request, "user") and request.user.is_authenticated:
-            try:
-                # Encontra a relacao NormaCliente para a norma atual e o usuario logado
-                norma_cliente = NormaCliente.objects.get(norma=obj, cliente=request.user.perfilusuario.cliente)
-                # Conta os comentarios dessa relacao especifica
-                return norma_cliente.comentarios.count()
-            except (NormaCliente.DoesNotExist, PerfilUsuario.DoesNotExist, AttributeError):
-                return 0
-        return 0
+        if hasattr(obj, 'comentarios_count'):
+            return obj.comentarios_count
+        return self._contexto().comentarios_count(obj)
         
     def get_sua_revisao(self, obj):
-        request = self.context.get('request')
-        if request and hasattr(request, "user") and request.user.is_authenticated:
-            try:
-                perfil_usuario = PerfilUsuario.objects.get(usuario=request.user)
-                cliente = perfil_usuario.cliente
-                norma_cliente = NormaCliente.objects.get(norma=obj, cliente=cliente)
-                return norma_cliente.data_revisao_cliente
-            except (PerfilUsuario.DoesNotExist, NormaCliente.DoesNotExist, AttributeError):
-                return None
-        return None
+        if hasattr(obj, 'sua_revisao'):
+            return obj.sua_revisao
+        return self._contexto().sua_revisao(obj)
 
     def get_status_atualizado(self, obj):
-        try:
-            user = self.context['request'].user
-            perfil_usuario = PerfilUsuario.objects.get(usuario=user)
-            cliente = perfil_usuario.cliente
-            norma_cliente = NormaCliente.objects.get(norma=obj, cliente=cliente)
-            
-            if obj.revisao_atual > norma_cliente.data_revisao_cliente:
-                return "DESATUALIZADO"
-            else:
-                return "ATUALIZADO"
-        except (PerfilUsuario.DoesNotExist, NormaCliente.DoesNotExist, AttributeError):
-            return "Indefinido"
+        if hasattr(obj, 'status_atualizado'):
+            return obj.status_atualizado
+        return self._contexto().status_atualizado(obj)
         
     def get_is_favorita(self, obj):
-        user = self.context.get('request').user
-        if user and user.is_authenticated:
-            try:
-                perfil = PerfilUsuario.objects.get(usuario=user)
-                # Verifica se a norma (obj) existe na lista de favoritos do perfil
-                return perfil.normas_favoritas.filter(pk=obj.pk).exists()
-            except PerfilUsuario.DoesNotExist:
-                return False
-        return False
+        if hasattr(obj, 'is_favorita'):
+            return obj.is_favorita
+        return self._contexto().is_favorita(obj)
 
 
 # Serializador para o modelo Cliente
@@ -153,6 +147,13 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['email', 'password']
+
+    def validate_email(self, value):
+        # Guardado em minusculas; o indice unico de lower(email) barra repetidos
+        email = normalizar_email(value)
+        if usuarios_por_email(email).exists():
+            raise serializers.ValidationError("Ja existe uma conta com este e-mail.")
+        return email
     
     def create(self, validated_data):
         email = validated_data['email']
@@ -178,11 +179,14 @@ class RevisaoSecundariaHistoricoSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def create(self, validated_data):
-        historico = super().create(validated_data)
-        if historico.tipo_revisao == 'ammendment':
-            norma = historico.norma
-            norma.revisao_atual = historico.data
-            norma.save()
+        with transaction.atomic():
+            historico = super().create(validated_data)
+            if historico.tipo_revisao == 'ammendment':
+                norma = historico.norma
+                norma.revisao_atual = historico.data
+                norma.save()
+                enfileirar_revisao(norma)
+                atualizar_resumos_da_norma(norma)
         return historico
 
 # Serializador para o modelo Notificacao
@@ -191,6 +195,19 @@ class NotificacaoSerializer(serializers.ModelSerializer):
         model = Notificacao
         fields = '__all__'
 
+# Ids aceitos por requisicao nas operacoes em lote de notificacoes
+LIMITE_IDS_NOTIFICACOES = 1000
+
+
+# Entrada de marcar-lidas/arquivar: ids explicitos e/ou filtros
+class NotificacoesEmLoteSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, max_length=LIMITE_IDS_NOTIFICACOES
+    )
+    # Ate a notificacao mais recente que o usuario viu: as que chegarem depois continuam nao lidas
+    ate_id = serializers.IntegerField(min_value=1, required=False)
+    norma = serializers.IntegerField(min_value=1, required=False)
+
 # Serializador personalizado para login com e-mail
 class CustomEmailLoginSerializer(serializers.Serializer):
     email = serializers.CharField(required=True)
@@ -203,15 +220,21 @@ class CustomEmailLoginSerializer(serializers.Serializer):
         
         if email and password:
             try:
-                user = User.objects.get(email__iexact=email)
-                if not user.check_password(password):
-                    raise serializers.ValidationError("Nao ha conta ativa com as credenciais fornecidas.")
+                user = usuarios_por_email(email).select_related('perfilusuario').get()
             except User.DoesNotExist:
                 raise serializers.ValidationError("Nao ha conta ativa com as credenciais fornecidas.")
+            hash_anterior = user.password
+            if not user.check_password(password):
+                raise serializers.ValidationError("Nao ha conta ativa com as credenciais fornecidas.")
+            if user.password != hash_anterior and hasattr(user, 'perfilusuario'):
+                # check_password refez o hash (custo do hasher mudou) e o save
+                # incrementou a versao das permissoes: o token sai com a nova
+                user.perfilusuario.refresh_from_db(fields=['versao_permissoes'])
         else:
             raise serializers.ValidationError("E-mail e senha sao campos obrigatorios.")
         
-        refresh = RefreshToken.for_user(user)
+        # Cliente e permissoes vao nas claims (gestao_normas/autenticacao.py)
+        refresh = RefreshTokenComPerfil.for_user(user)
         return {
             'email': user.email,
             'access': str(refresh.access_token),
@@ -245,6 +268,9 @@ class ComentarioSerializer(serializers.ModelSerializer):
 
     # 🚀 CAMPO RECURSIVO: Este campo aparecerá na API e conterá a lista de respostas.
     respostas = serializers.SerializerMethodField()
+
+    # Total de respostas da thread (so nos comentarios raiz da listagem)
+    total_respostas = serializers.SerializerMethodField()
     
     class Meta:
         model = Comentario
@@ -252,25 +278,48 @@ class ComentarioSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'norma_cliente', 'usuario', 'usuario_nome',
             'comentario_pai', 'descricao', 'comentario',
-            'data_criacao', 'respostas'
+            'data_criacao', 'profundidade', 'respostas', 'total_respostas'
         ]
 
         # 'usuario' e 'norma_cliente' são definidos pela View
-        read_only_fields = ['usuario', 'norma_cliente']
+        read_only_fields = ['usuario', 'norma_cliente', 'profundidade']
         
     def get_usuario_nome(self, obj):
         # Garante que o nome completo seja retornado
         return obj.usuario.get_full_name()
     
-    # 🎯 NOVO MÉTODO CRÍTICO: Define o conteúdo do campo 'respostas'
+    # Define o conteudo do campo 'respostas' a partir da arvore da thread,
+    # carregada uma unica vez (context['arvore_respostas'], pai_id -> filhos).
+    # Abaixo de context['profundidade_maxima'] niveis as respostas sao omitidas.
     def get_respostas(self, obj):
-        # O obj.respostas.all() usa o related_name que definimos no model para buscar os filhos.
-        # Recursivamente, serializa esses filhos usando a mesma classe ComentarioSerializer.
-        
-        # 💡 CRÍTICO: Usamos 'obj.respostas.all()' que busca os filhos DESTE objeto.
-        # Passamos a lista de filhos para o Serializer, garantindo que o neto seja incluído no payload.
-        serializer = ComentarioSerializer(obj.respostas.all(), many=True)
-        return serializer.data
+        profundidade = self.context.get('profundidade', 0) + 1
+        if profundidade > self.context.get('profundidade_maxima', PROFUNDIDADE_MAXIMA):
+            return []
+        arvore = self.context.get('arvore_respostas')
+        if arvore is None:
+            # Fora da listagem (detalhe, criacao): carrega a subarvore do comentario
+            arvore = carregar_respostas(obj.norma_cliente_id, raizes=[obj])
+            self.context['arvore_respostas'] = arvore
+        filhos = arvore.get(obj.pk, [])
+        if not filhos:
+            return []
+        contexto = {**self.context, 'profundidade': profundidade}
+        return ComentarioSerializer(filhos, many=True, context=contexto).data
+
+    def get_total_respostas(self, obj):
+        contagens = self.context.get('respostas_por_raiz')
+        if contagens is None or obj.profundidade > 0:
+            return None
+        return contagens.get(obj.pk, 0)
+
+    def validate_comentario_pai(self, pai):
+        # Mudanca de pai na edicao: nao pode formar ciclo na thread
+        if pai is not None and self.instance is not None:
+            if pai.pk == self.instance.pk or pai.caminho.startswith(f'{self.instance.caminho}{SEPARADOR_CAMINHO}'):
+                raise serializers.ValidationError('Um comentário não pode responder a si mesmo nem a uma de suas respostas.')
+            if pai.norma_cliente_id != self.instance.norma_cliente_id:
+                raise serializers.ValidationError('O comentário pai pertence a outra norma.')
+        return pai
 
 
 # No final de gestao_normas/serializers.py
@@ -289,19 +338,3 @@ class CentroDeCustoSerializer(serializers.ModelSerializer):
     class Meta:
         model = CentroDeCusto
         fields = ['id', 'nome', 'descricao', 'normas']
-
-# Adicionado para a tela de Acervo Técnico (Vínculos)
-class AuditoriaVinculadaSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Auditoria
-        fields = ['nome', 'data_auditoria']
-
-class CertificacaoVinculadaSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Certificacao
-        fields = ['nome', 'data_termino']
-
-class CentroDeCustoVinculadoSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = CentroDeCusto
-        fields = ['nome']
\ No newline at end of file
@@ -0,0 +1,105 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .autenticacao import descartar_versoes_permissoes, incrementar_versao_permissoes, invalidar_contexto_usuarios
+from .cache import invalidar_normas
+from .eventos import publicar_notificacoes_novas
+from .models import Cliente, Comentario, Norma, NormaCliente, Notificacao, PerfilUsuario, UsuarioDoToken
+from .resumos import atualizar_resumos_clientes, atualizar_resumos_favoritos, atualizar_resumos_notificacoes
+from .versoes import (
+    incrementar_versoes, incrementar_versoes_das_normas, incrementar_versoes_dos_perfis,
+    incrementar_versoes_dos_usuarios, incrementar_versoes_dos_vinculos,
+)
+
+
+# Invalidacao do cache do catalogo (gestao_normas/cache.py), das versoes dos
+# clientes e perfis usadas nos ETags (gestao_normas/versoes.py) e do contexto guardado
+# pela autenticacao (gestao_normas/autenticacao.py), contador de nao lidas e
+# aviso de notificacoes novas (gestao_normas/eventos.py). Os sinais cobrem as
+# escritas pelo ORM, inclusive as exclusoes em cascata; escritas em massa
+# (bulk_create/update, SQL direto) atualizam ambos explicitamente.
+
+@receiver([post_save, post_delete], sender=Norma)
+def norma_alterada(sender, instance, **kwargs):
+    invalidar_normas([instance.pk])
+    # Na exclusao os vinculos ja foram removidos; cada um avisa o seu cliente
+    incrementar_versoes_das_normas([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=NormaCliente)
+def vinculo_alterado(sender, instance, **kwargs):
+    # Tambem invalida o mapa de revisoes do cliente (cache.revisoes_do_cliente)
+    incrementar_versoes([instance.cliente_id])
+
+
+@receiver(post_delete, sender=NormaCliente)
+def vinculo_removido(sender, instance, origin=None, **kwargs):
+    # Toda exclusao (API, admin, cascata de uma Norma) recalcula o resumo de
+    # conformidade; na exclusao do proprio cliente o resumo sai junto com ele
+    origem = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origem is not Cliente:
+        atualizar_resumos_clientes([instance.cliente_id])
+
+
+@receiver(post_save, sender=Comentario)
+def comentario_alterado(sender, instance, **kwargs):
+    # A exclusao e feita em SQL (comentarios.excluir_com_respostas)
+    incrementar_versoes_dos_vinculos([instance.norma_cliente_id])
+
+
+@receiver([post_save, post_delete], sender=Notificacao)
+def notificacao_alterada(sender, instance, created=False, **kwargs):
+    incrementar_versoes_dos_usuarios([instance.usuario_id])
+    atualizar_resumos_notificacoes([instance.usuario_id])
+    if created:
+        publicar_notificacoes_novas([instance.usuario_id])
+
+
+@receiver(post_save, sender=Cliente)
+def cliente_alterado(sender, instance, created, **kwargs):
+    # A vigencia do contrato aparece no dashboard
+    if not created:
+        incrementar_versoes([instance.pk])
+        invalidar_contexto_usuarios(
+            PerfilUsuario.objects.filter(cliente_id=instance.pk).values_list('usuario_id', flat=True)
+        )
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=UsuarioDoToken)
+def usuario_alterado(sender, instance, created=False, update_fields=None, **kwargs):
+    so_ultimo_login = update_fields is not None and set(update_fields) == {'last_login'}
+    if kwargs['signal'] is post_save and not created and not so_ultimo_login:
+        # Senha, is_active ou is_staff podem ter mudado: revoga os tokens
+        incrementar_versao_permissoes([instance.pk])
+    else:
+        invalidar_contexto_usuarios([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=PerfilUsuario)
+def perfil_alterado(sender, instance, created=False, **kwargs):
+    # Permissoes e cliente vao nas claims do token e no contexto guardado
+    if kwargs['signal'] is post_save and not created:
+        incrementar_versao_permissoes([instance.usuario_id])
+    else:
+        descartar_versoes_permissoes([instance.usuario_id])
+        invalidar_contexto_usuarios([instance.usuario_id])
+
+
+@receiver(m2m_changed, sender=PerfilUsuario.normas_favoritas.through)
+def favoritas_alteradas(sender, instance, action, reverse, pk_set, **kwargs):
+    # Qualquer caminho (API, admin, shell) recalcula o resumo de favoritas
+    if reverse and action == 'pre_clear':
+        # Depois do clear nao ha como saber quais perfis favoritavam a norma
+        instance._perfis_que_favoritavam = set(instance.favoritado_por.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        perfil_ids = {instance.pk}
+    else:
+        perfil_ids = instance.__dict__.pop('_perfis_que_favoritavam', set()) if action == 'post_clear' else pk_set
+    incrementar_versoes_dos_perfis(perfil_ids)
+    atualizar_resumos_favoritos(perfil_ids)
@@ -1,3 +1,1719 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from typing import NamedTuple
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, get_resolver
+from django.utils.encoding import force_bytes
+from django.utils import timezone
+from django.utils.http import urlsafe_base64_encode
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .autenticacao import RefreshTokenComPerfil, usuarios_por_email, versao_permissoes
+from .cache import ALIAS_CACHE, TIMEOUT_LOCAL, invalidar_normas, obter_norma, revisoes_do_cliente
+from .comentarios import excluir_com_respostas, reconstruir_caminhos, subarvore
+from .diagnostico import ConsultaRegistrada, analisar
+from .eventos import canal as canal_de_notificacoes
+from .exportacao import COLUNAS
+from .instrumentacao import metricas as metricas_requisicoes
+from .models import (
+    Auditoria, CentroDeCusto, Certificacao, Cliente, Comentario, Norma, NormaCliente, Notificacao, PerfilUsuario,
+    ResumoConformidadeCliente, ResumoFavoritosUsuario, VersaoCliente, VersaoPerfil,
+)
+from .notificacoes import arquivar_notificacoes, expurgar_notificacoes, marcar_como_lidas, relacoes_desatualizadas
+from .resumos import atualizar_resumos_clientes, recalcular_todos_os_resumos
+from .versoes import incrementar_versoes
+
+
+# Indices usados por um plano do Postgres (EXPLAIN em texto)
+_INDICE_NO_PLANO = re.compile(r'(?:Index Scan(?: Backward)?|Index Only Scan(?: Backward)?) using (\w+)|Bitmap Index Scan on (\w+)')
+
+
+def indices_do_plano(queryset):
+    plano = queryset.explain()
+    return {usando or bitmap for usando, bitmap in _INDICE_NO_PLANO.findall(plano)}, plano
+
+
+class PlanosDeConsultaTests(TestCase):
+    """
+    Regressao dos planos das consultas quentes: sobre uma base semeada (e com
+    ANALYZE), cada consulta deve usar o indice criado para o seu formato.
+    Quebra quando uma mudanca no filtro ou na ordenacao deixa o indice de lado.
+    """
+    TOTAL_NORMAS = 3000
+    TOTAL_CLIENTES = 20
+    NORMAS_POR_CLIENTE = 600
+    TOTAL_USUARIOS = 40
+    NOTIFICACOES_POR_USUARIO = 500
+    COMENTARIOS_POR_VINCULO = 8
+
+    @classmethod
+    def setUpTestData(cls):
+        revisao = date(2020, 1, 1)
+        Norma.objects.bulk_create([
+            Norma(norma=f'N-{i:05d}', organizacao=f'ORG{i % 7}', revisao_atual=revisao + timedelta(days=i % 900))
+            for i in range(cls.TOTAL_NORMAS)
+        ])
+        normas = list(Norma.objects.order_by('pk').values_list('pk', flat=True))
+        Cliente.objects.bulk_create([
+            Cliente(empresa=f'Cliente {i}', cnpj=f'{i:014d}', dominio=f'c{i}.com', endereco='Rua', cidade='SP',
+                    estado='SP', cep='00000-000', telefone='0')
+            for i in range(cls.TOTAL_CLIENTES)
+        ])
+        clientes = list(Cliente.objects.order_by('pk'))
+        NormaCliente.objects.bulk_create([
+            NormaCliente(cliente=cliente, norma_id=normas[(c * 97 + i) % len(normas)], data_revisao_cliente=revisao)
+            for c, cliente in enumerate(clientes)
+            for i in range(cls.NORMAS_POR_CLIENTE)
+        ])
+
+        User.objects.bulk_create([User(username=f'u{i}@c.com', email=f'u{i}@c.com') for i in range(cls.TOTAL_USUARIOS)])
+        usuarios = list(User.objects.order_by('pk'))
+        PerfilUsuario.objects.bulk_create([
+            PerfilUsuario(usuario=usuario, cliente=clientes[i % len(clientes)]) for i, usuario in enumerate(usuarios)
+        ])
+        Notificacao.objects.bulk_create([
+            Notificacao(
+                usuario=usuario, norma_id=normas[(u * 31 + i) % len(normas)], mensagem='Norma atualizada.',
+                visualizada=i % 10 != 0, arquivada=i % 50 == 0,
+            )
+            for u, usuario in enumerate(usuarios)
+            for i in range(cls.NOTIFICACOES_POR_USUARIO)
+        ])
+
+        vinculos = list(NormaCliente.objects.order_by('pk')[:400])
+        Comentario.objects.bulk_create([
+            Comentario(norma_cliente=vinculo, usuario=usuarios[0], comentario='c')
+            for vinculo in vinculos
+            for _ in range(cls.COMENTARIOS_POR_VINCULO)
+        ])
+        # Metade dos comentarios vira resposta do primeiro comentario da thread
+        for vinculo in vinculos[::2]:
+            ids = list(Comentario.objects.filter(norma_cliente=vinculo).order_by('pk').values_list('pk', flat=True))
+            Comentario.objects.filter(pk__in=ids[1:]).update(comentario_pai_id=ids[0])
+        reconstruir_caminhos()
+
+        with connection.cursor() as cursor:
+            for modelo in (Norma, Cliente, NormaCliente, PerfilUsuario, Notificacao, Comentario):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(modelo._meta.db_table)}')
+
+        cls.usuario = usuarios[3]
+        cls.cliente = clientes[5]
+        cls.vinculo = vinculos[0]
+
+    def assertUsaIndice(self, queryset, indice):
+        indices, plano = indices_do_plano(queryset)
+        self.assertIn(indice, indices, f'O plano nao usa {indice}:\n{plano}')
+
+    def test_catalogo_paginado_por_revisao(self):
+        self.assertUsaIndice(Norma.objects.order_by('revisao_atual', 'id')[:50], 'norma_revisao_atual')
+
+    def test_revisoes_do_cliente(self):
+        consulta = NormaCliente.objects.filter(cliente=self.cliente).values_list('norma_id', 'data_revisao_cliente')
+        self.assertUsaIndice(consulta, 'normacliente_cliente_norma')
+
+    def test_vinculo_do_cliente_com_a_norma(self):
+        consulta = NormaCliente.objects.filter(cliente=self.cliente, norma_id=self.vinculo.norma_id)
+        self.assertUsaIndice(consulta, 'normacliente_cliente_norma')
+
+    def test_caixa_de_entrada_de_notificacoes(self):
+        consulta = (
+            Notificacao.objects.filter(usuario=self.usuario, arquivada=False)
+            .order_by('-data_criacao', '-id')[:50]
+        )
+        self.assertUsaIndice(consulta, 'notificacao_caixa_entrada')
+
+    def test_notificacoes_nao_lidas(self):
+        consulta = Notificacao.objects.filter(usuario=self.usuario, visualizada=False, arquivada=False).values('pk')
+        self.assertUsaIndice(consulta, 'notificacao_nao_lidas')
+
+    def test_notificacoes_novas_desde_um_id(self):
+        ultima = Notificacao.objects.filter(usuario=self.usuario).order_by('-pk').values_list('pk', flat=True)[5]
+        consulta = Notificacao.objects.filter(usuario=self.usuario, pk__gt=ultima).order_by('pk')[:50]
+        self.assertUsaIndice(consulta, 'notificacao_usuario_id')
+
+    def test_checagem_de_notificacao_repetida(self):
+        consulta = relacoes_desatualizadas(NormaCliente.objects.filter(cliente=self.cliente))
+        self.assertUsaIndice(consulta, 'notificacao_nao_lidas')
+
+    def test_comentarios_raiz_da_thread(self):
+        consulta = (
+            Comentario.objects.filter(norma_cliente=self.vinculo, comentario_pai__isnull=True)
+            .order_by('data_criacao', 'id')[:20]
+        )
+        self.assertUsaIndice(consulta, 'comentario_raizes')
+
+    def test_subarvore_do_comentario(self):
+        raiz = Comentario.objects.filter(norma_cliente=self.vinculo, comentario_pai__isnull=True).order_by('pk').first()
+        self.assertUsaIndice(subarvore(raiz), 'comentario_thread_caminho')
+
+
+
+@override_settings(NOTIFICACOES_PUBSUB='local')
+class NotificacoesEmLoteTests(TestCase):
+    """Expurgo, marcar como lidas e arquivar: so as linhas certas, do usuario certo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua', cidade='SP',
+                                         estado='SP', cep='0', telefone='0')
+        cls.norma = Norma.objects.create(norma='N-1', revisao_atual=date(2024, 1, 1))
+        cls.dono, cls.outro = User.objects.bulk_create([
+            User(username='dono@c.com', email='dono@c.com'), User(username='outro@c.com', email='outro@c.com'),
+        ])
+        PerfilUsuario.objects.bulk_create([PerfilUsuario(usuario=u, cliente=cliente) for u in (cls.dono, cls.outro)])
+        # (visualizada, arquivada, idade em dias) de cada notificacao, para os dois usuarios
+        cls.casos = {
+            'lida antiga': (True, False, 200),
+            'lida e arquivada antiga': (True, True, 200),
+            'lida recente': (True, False, 10),
+            'nao lida antiga': (False, False, 200),
+            'nao lida recente': (False, False, 10),
+        }
+        cls.ids = {}
+        agora = timezone.now()
+        for usuario in (cls.dono, cls.outro):
+            for nome, (visualizada, arquivada, dias) in cls.casos.items():
+                notificacao = Notificacao.objects.create(usuario=usuario, norma=cls.norma, mensagem=nome,
+                                                         visualizada=visualizada, arquivada=arquivada)
+                # data_criacao e auto_now_add: a idade e ajustada depois
+                Notificacao.objects.filter(pk=notificacao.pk).update(data_criacao=agora - timedelta(days=dias))
+                cls.ids[usuario.pk, nome] = notificacao.pk
+
+    def restantes(self):
+        return set(Notificacao.objects.values_list('pk', flat=True))
+
+    def ids_dos_casos(self, *nomes, usuarios=None):
+        usuarios = usuarios or (self.dono, self.outro)
+        return {self.ids[usuario.pk, nome] for usuario in usuarios for nome in nomes}
+
+    def test_expurgo_remove_so_lidas_antigas(self):
+        antigas = self.ids_dos_casos('lida antiga', 'lida e arquivada antiga')
+        self.assertEqual(expurgar_notificacoes(dias=180, dry_run=True), len(antigas))
+        self.assertEqual(self.restantes(), set(self.ids.values()))
+
+        # Lote de 1: o percurso pela chave primaria atravessa varios lotes
+        self.assertEqual(expurgar_notificacoes(dias=180, lote=1), len(antigas))
+        self.assertEqual(self.restantes(), set(self.ids.values()) - antigas)
+
+    def test_expurgo_arquivando(self):
+        self.assertEqual(expurgar_notificacoes(dias=180, arquivar=True, lote=1), 2)
+        arquivadas = set(Notificacao.objects.filter(arquivada=True).values_list('pk', flat=True))
+        self.assertEqual(arquivadas, self.ids_dos_casos('lida antiga', 'lida e arquivada antiga'))
+        self.assertEqual(self.restantes(), set(self.ids.values()))
+
+    def test_marcar_como_lidas_so_do_usuario(self):
+        pedidas = self.ids_dos_casos('nao lida antiga', 'nao lida recente')
+        self.assertEqual(marcar_como_lidas(self.dono, ids=pedidas), 2)
+        nao_lidas = set(Notificacao.objects.filter(visualizada=False).values_list('pk', flat=True))
+        self.assertEqual(nao_lidas, self.ids_dos_casos('nao lida antiga', 'nao lida recente', usuarios=[self.outro]))
+
+        # Sem filtros: todas as nao lidas do usuario, e so dele
+        self.assertEqual(marcar_como_lidas(self.outro), 2)
+        self.assertFalse(Notificacao.objects.filter(visualizada=False).exists())
+
+    def test_arquivar_so_do_usuario(self):
+        pedidas = self.ids_dos_casos('lida recente', 'nao lida recente', 'lida e arquivada antiga')
+        # A que ja estava arquivada nao conta
+        self.assertEqual(arquivar_notificacoes(self.dono, pedidas), 2)
+        arquivadas = set(Notificacao.objects.filter(arquivada=True).values_list('pk', flat=True))
+        self.assertEqual(
+            arquivadas,
+            self.ids_dos_casos('lida e arquivada antiga') | self.ids_dos_casos(
+                'lida recente', 'nao lida recente', usuarios=[self.dono],
+            ),
+        )
+
+
+@override_settings(NOTIFICACOES_PUBSUB='local')
+class NotificacoesEmTempoRealTests(TestCase):
+    """
+    SSE e long-poll com o canal local: uma notificacao criada depois da
+    assinatura chega a conexao que esta esperando, e o SSE retoma do
+    Last-Event-ID. As notificacoes sao criadas na thread do teste, onde as
+    views async fazem as suas queries (sync_to_async), dentro da mesma transacao.
+    """
+    ESPERA = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua', cidade='SP',
+                                         estado='SP', cep='0', telefone='0')
+        cls.norma = Norma.objects.create(norma='N-1', revisao_atual=date(2024, 1, 1))
+        cls.usuario = User.objects.create(username='u@c.com', email='u@c.com')
+        PerfilUsuario.objects.create(usuario=cls.usuario, cliente=cliente)
+        cls.existentes = [notificacao.pk for notificacao in Notificacao.objects.bulk_create([
+            Notificacao(usuario=cls.usuario, norma=cls.norma, mensagem=f'n{i}') for i in range(3)
+        ])]
+
+    def setUp(self):
+        caches['default'].clear()
+        self.token = str(RefreshTokenComPerfil.for_user(self.usuario).access_token)
+
+    def cabecalhos(self, **extras):
+        return {'Authorization': f'Bearer {self.token}', **extras}
+
+    @sync_to_async
+    def notificar(self):
+        # O aviso do canal local sai no on_commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notificacao.objects.create(usuario=self.usuario, norma=self.norma, mensagem='nova').pk
+
+    async def eventos(self, conteudo, total):
+        """Os proximos 'total' eventos SSE (sem pings), como (evento, id, dados)."""
+        eventos = []
+        while len(eventos) < total:
+            bloco = await asyncio.wait_for(conteudo.__anext__(), self.ESPERA)
+            campos = dict(linha.split(': ', 1) for linha in bloco.decode().strip().split('\n'))
+            if 'event' in campos:
+                eventos.append((campos['event'], int(campos['id']), json.loads(campos['data'])))
+        return eventos
+
+    def test_sse_entrega_notificacao_nova(self):
+        async def cenario():
+            resposta = await AsyncClient().get('/api/notificacoes/stream/', headers=self.cabecalhos())
+            self.assertEqual(resposta['Content-Type'], 'text/event-stream')
+            conteudo = resposta.streaming_content.__aiter__()
+            try:
+                self.assertEqual(await conteudo.__anext__(), b'retry: 5000\n\n')
+                # Sem Last-Event-ID: so o contador atual
+                [(evento, ultimo, dados)] = await self.eventos(conteudo, 1)
+                self.assertEqual((evento, ultimo, dados['nao_lidas']), ('contador', self.existentes[-1], 3))
+
+                nova = await self.notificar()
+                self.assertEqual(
+                    [(evento, id_evento) for evento, id_evento, _ in await self.eventos(conteudo, 2)],
+                    [('notificacao', nova), ('contador', nova)],
+                )
+            finally:
+                await conteudo.aclose()
+
+        async_to_sync(cenario)()
+
+    def test_sse_retoma_do_last_event_id(self):
+        async def cenario():
+            resposta = await AsyncClient().get(
+                '/api/notificacoes/stream/', headers=self.cabecalhos(**{'Last-Event-ID': str(self.existentes[0])}),
+            )
+            conteudo = resposta.streaming_content.__aiter__()
+            try:
+                await conteudo.__anext__()
+                eventos = await self.eventos(conteudo, 3)
+            finally:
+                await conteudo.aclose()
+            self.assertEqual([(evento, id_evento) for evento, id_evento, _ in eventos], [
+                ('notificacao', self.existentes[1]), ('notificacao', self.existentes[2]),
+                ('contador', self.existentes[2]),
+            ])
+
+        async_to_sync(cenario)()
+
+    def test_long_poll_acorda_com_notificacao_nova(self):
+        async def cenario():
+            url = f'/api/notificacoes/aguardar/?desde={self.existentes[-1]}&timeout={self.ESPERA}'
+            espera = asyncio.ensure_future(AsyncClient().get(url, headers=self.cabecalhos()))
+            # Deixa a view assinar o canal antes de criar a notificacao
+            while not canal_de_notificacoes.total_assinantes():
+                await asyncio.sleep(0.01)
+            nova = await self.notificar()
+            resposta = await asyncio.wait_for(espera, self.ESPERA)
+            dados = json.loads(resposta.content)
+            self.assertEqual([notificacao['id'] for notificacao in dados['results']], [nova])
+            self.assertEqual((dados['nao_lidas'], dados['ultima_notificacao_id']), (4, nova))
+
+            # Sem novidades e sem espera: volta na hora, com a lista vazia
+            resposta = await AsyncClient().get(f'/api/notificacoes/aguardar/?desde={nova}&timeout=0',
+                                               headers=self.cabecalhos())
+            self.assertEqual(json.loads(resposta.content)['results'], [])
+
+        async_to_sync(cenario)()
+
+    def test_token_na_url_so_no_sse(self):
+        async def cenario():
+            resposta = await AsyncClient().get(f'/api/notificacoes/aguardar/?token={self.token}')
+            self.assertEqual(resposta.status_code, 401)
+            resposta = await AsyncClient().get(f'/api/notificacoes/stream/?token={self.token}')
+            self.assertEqual(resposta.status_code, 200)
+            await resposta.streaming_content.aclose()
+
+        async_to_sync(cenario)()
+
+
+class Rota(NamedTuple):
+    nome: str  # nome da rota no urls.py
+    metodo: str
+    url: str  # com {norma}, {comentario}, {notificacao}... preenchidos pela base
+    consultas: int  # maximo de queries por requisicao (sem savepoints)
+    p95_ms: float  # latencia maxima (p95) na maquina de referencia
+    usuario: str = 'cliente'  # cliente, admin (pode gerenciar), staff ou anonimo
+    dados: object = None  # corpo (dict) ou funcao(base) -> corpo
+    formato: str = 'json'
+    status: int = 200
+
+
+# Orcamento de cada rota. As consultas sao contadas em todas as repeticoes,
+# inclusive a primeira, com o cache do catalogo vazio; baixe o numero quando
+# uma otimizacao reduzir as queries de uma rota.
+ROTAS = [
+    # Normas
+    Rota('norma-list-create', 'get', '/api/normas/?page_size=50', 5, 100),
+    Rota('norma-list-create', 'post', '/api/normas/', 6, 100, status=201,
+         dados={'norma': 'NOVA-0001', 'organizacao': 'ISO', 'revisao_atual': '2024-01-01'}),
+    Rota('norma-busca', 'get', '/api/normas/busca/?q=ORG1 N-00123', 5, 300),
+    Rota('norma-importar', 'post', '/api/normas/importar/', 9, 300, usuario='staff', formato='multipart',
+         dados=lambda base: {'arquivo': base.arquivo_importacao()}),
+    Rota('norma-detail', 'get', '/api/normas/{norma}/', 5, 50),
+    Rota('norma-detail', 'patch', '/api/normas/{norma}/', 13, 150, dados={'revisao_atual': '2030-01-01'}),
+    Rota('norma-detail', 'delete', '/api/normas/{norma_avulsa}/', 11, 100, status=204),
+    Rota('minhas-normas', 'get', '/api/minhas-normas/', 3, 1000),
+    Rota('minhas-normas', 'get', '/api/minhas-normas/?page_size=50&ordering=-revisao_atual', 3, 150),
+    Rota('minhas-normas-exportar', 'get', '/api/minhas-normas/exportar/?formato=csv', 1, 1200),
+    Rota('norma-favoritar', 'post', '/api/normas/{norma}/favoritar/', 7, 60),
+    Rota('adicionar-comentario', 'get', '/api/normas/{norma}/comentarios/', 4, 1800),
+    Rota('adicionar-comentario', 'get', '/api/normas/{norma}/comentarios/?page_size=20&profundidade=3', 4, 600),
+    Rota('adicionar-comentario', 'post', '/api/normas/{norma}/comentarios/', 9, 100, status=201,
+         dados={'comentario': 'Novo comentario.', 'comentario_pai': None}),
+    Rota('norma-vinculos', 'get', '/api/normas/{norma}/vinculos/', 3, 60),
+    Rota('norma-vinculos-lote', 'get', '/api/normas/vinculos/', 3, 60),
+    Rota('norma-vinculos-lote', 'get', '/api/normas/vinculos/?normas={normas}', 3, 60),
+
+    # Usuarios e autenticacao
+    Rota('cadastrar-usuario', 'post', '/api/cadastrar-usuario/', 4, 50, usuario='anonimo', status=201,
+         dados={'email': 'novo@cliente0.com', 'password': 'Senha-forte-123'}),
+    Rota('password-reset-request', 'post', '/api/redefinir-senha/solicitar/', 1, 50, usuario='anonimo',
+         dados=lambda base: {'email': base.usuario.email}),
+    Rota('password-reset-confirm', 'post', '/api/redefinir-senha/confirmar/', 3, 50, usuario='anonimo',
+         dados=lambda base: base.dados_redefinicao()),
+    Rota('user-profile', 'get', '/api/user/profile/', 1, 50),
+    Rota('token_obtain_pair', 'post', '/api/token/', 1, 50, usuario='anonimo',
+         dados=lambda base: {'email': base.usuario.email, 'password': base.SENHA}),
+    Rota('token_refresh', 'post', '/api/token/refresh/', 1, 50, usuario='anonimo',
+         dados=lambda base: {'refresh': str(RefreshTokenComPerfil.for_user(base.usuario))}),
+
+    # Clientes e estrutura
+    Rota('cliente-list-create', 'get', '/api/clientes/', 1, 50),
+    Rota('cliente-list-create', 'post', '/api/clientes/', 2, 50, status=201, dados={
+        'empresa': 'Nova', 'cnpj': '99999999000199', 'dominio': 'nova.com', 'endereco': 'Rua', 'cidade': 'SP',
+        'estado': 'SP', 'cep': '00000000', 'telefone': '11999999999',
+    }),
+    Rota('auditorias-list-create', 'get', '/api/auditorias/?page_size=50', 2, 80),
+    Rota('auditorias-list-create', 'post', '/api/auditorias/', 9, 80, status=201,
+         dados=lambda base: {'nome': 'Auditoria nova', 'data_auditoria': '2024-01-01', 'normas': base.normas_do_cliente[:5]}),
+    Rota('certificacoes-list-create', 'get', '/api/certificacoes/?page_size=50', 2, 80),
+    Rota('certificacoes-list-create', 'post', '/api/certificacoes/', 9, 80, status=201, dados=lambda base: {
+        'nome': 'Certificacao nova', 'data_inicio': '2024-01-01', 'data_termino': '2025-01-01',
+        'normas': base.normas_do_cliente[:5],
+    }),
+    Rota('centros-de-custo-list-create', 'get', '/api/centros-de-custo/?page_size=50', 2, 80),
+    Rota('centros-de-custo-list-create', 'post', '/api/centros-de-custo/', 9, 80, status=201,
+         dados=lambda base: {'nome': 'Centro novo', 'normas': base.normas_do_cliente[:5]}),
+
+    # Comentarios e historico
+    Rota('revisoes-secundarias', 'post', '/api/revisoes-secundarias/', 10, 150, status=201,
+         dados=lambda base: {'norma': base.norma.pk, 'tipo_revisao': 'ammendment', 'data': '2031-01-01'}),
+    Rota('comentario-detail', 'get', '/api/comentarios/{comentario}/', 3, 80),
+    Rota('comentario-detail', 'patch', '/api/comentarios/{comentario}/', 5, 100, dados={'comentario': 'Editado.'}),
+    Rota('comentario-detail', 'delete', '/api/comentarios/{comentario}/', 8, 100, status=204),
+
+    # Notificacoes
+    Rota('notificacoes-list', 'get', '/api/notificacoes/?page_size=50', 3, 60),
+    Rota('notificacoes-detail', 'get', '/api/notificacoes/{notificacao}/', 1, 50),
+    Rota('notificacoes-detail', 'patch', '/api/notificacoes/{notificacao}/', 6, 60, dados={'visualizada': True}),
+    Rota('notificacoes-nao-lidas', 'get', '/api/notificacoes/nao-lidas/', 1, 50),
+    Rota('notificacoes-marcar-lidas', 'post', '/api/notificacoes/marcar-lidas/', 6, 60, dados={}),
+    Rota('notificacoes-arquivar', 'post', '/api/notificacoes/arquivar/', 6, 60,
+         dados=lambda base: {'ids': base.notificacoes[:20]}),
+    Rota('notificacoes-aguardar', 'get', '/api/notificacoes/aguardar/', 1, 50),
+    Rota('notificacoes-stream', 'stream', '/api/notificacoes/stream/', 1, 50),
+
+    # Dashboard e administracao
+    Rota('dashboard-metrics', 'get', '/api/dashboard/metrics/', 3, 50),
+    Rota('cache-metricas', 'get', '/api/cache/metricas/', 1, 50, usuario='staff'),
+    Rota('metricas-requisicoes', 'get', '/api/metricas/', 1, 50, usuario='staff'),
+    Rota('gerenciar-funcionarios', 'get', '/api/gerenciar-funcionarios/', 1, 50, usuario='admin'),
+    Rota('admin-permissoes-list', 'get', '/api/admin-permissoes/', 1, 50, usuario='admin'),
+    Rota('admin-permissoes-bulk-update', 'put', '/api/admin-permissoes/bulk-update/', 3, 100, usuario='admin',
+         dados=lambda base: [{'user_id': pk, 'pode_gerenciar_auditorias': True} for pk in base.colegas]),
+]
+
+# Repeticoes por rota; a primeira (cache frio) conta para as queries, nao para a latencia
+REPETICOES = int(os.environ.get('ORCAMENTO_REPETICOES', 6))
+# Multiplica os limites de latencia (maquinas de CI mais lentas). Sem ele as
+# latencias so sao medidas e relatadas: dependem da maquina, e so valem onde a
+# referencia foi calibrada. Os orcamentos de queries sao sempre verificados.
+FATOR_LATENCIA = os.environ.get('ORCAMENTO_FATOR_LATENCIA')
+FATOR_LATENCIA = float(FATOR_LATENCIA) if FATOR_LATENCIA else None
+# Relatorio JSON de uma execucao anterior: falha se o p95 piorar alem da tolerancia
+REFERENCIA = os.environ.get('ORCAMENTO_REFERENCIA')
+TOLERANCIA_REFERENCIA = float(os.environ.get('ORCAMENTO_TOLERANCIA', 0.5))
+# Caminho para gravar o relatorio (consultas, p50 e p95 por rota)
+RELATORIO = os.environ.get('ORCAMENTO_RELATORIO')
+
+_SAVEPOINT = re.compile(r'^(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b')
+
+
+def percentil(amostras, p):
+    ordenadas = sorted(amostras)
+    return ordenadas[min(len(ordenadas) - 1, round(p / 100 * (len(ordenadas) - 1)))]
+
+
+# Hash de senha dos benchmarks: MD5, para medir a aplicacao e nao o PBKDF2, ou
+# o hasher do projeto com ORCAMENTO_ITERACOES_PBKDF2 iteracoes
+ITERACOES_PBKDF2 = int(os.environ.get('ORCAMENTO_ITERACOES_PBKDF2', 0))
+HASH_DE_SENHA = (
+    {'PASSWORD_HASHERS': ['gestao_normas.senhas.PBKDF2Configuravel'], 'SENHA_ITERACOES_PBKDF2': ITERACOES_PBKDF2}
+    if ITERACOES_PBKDF2 else {'PASSWORD_HASHERS': ['django.contrib.auth.hashers.MD5PasswordHasher']}
+)
+
+
+# Pub/sub local: o ouvinte do Postgres manteria uma conexao aberta com o banco
+# de teste. A instrumentacao segue ativa (entra na latencia medida), mas sem
+# log nem o diagnostico de queries, que so roda em desenvolvimento.
+@override_settings(
+    **HASH_DE_SENHA,
+    NOTIFICACOES_PUBSUB='local',
+    INSTRUMENTACAO={'ATIVA': True, 'AMOSTRAGEM': 1.0, 'SERVER_TIMING': True, 'LOG': False},
+    DIAGNOSTICO_CONSULTAS={'ATIVO': False},
+)
+class OrcamentoDasRotasTests(TestCase):
+    """
+    Benchmark e regressao de todas as rotas da API sobre uma base realista:
+    cada rota e chamada REPETICOES vezes (escritas desfeitas a cada chamada)
+    e falha se passar do seu orcamento de queries ou, com ORCAMENTO_FATOR_LATENCIA
+    ou ORCAMENTO_REFERENCIA, de latencia p95. Pega N+1 no NormaSerializer e
+    afins antes do deploy.
+    """
+    SENHA = 'Senha-de-teste-123'
+    TOTAL_NORMAS = 12000
+    TOTAL_CLIENTES = 12
+    NORMAS_POR_CLIENTE = 1200
+    USUARIOS_POR_CLIENTE = 10
+    NOTIFICACOES_POR_USUARIO = 300
+    COMENTARIOS_RAIZ = 100
+    RESPOSTAS_POR_RAIZ = 9
+    VINCULOS_POR_TIPO = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        revisao = date(2020, 1, 1)
+        Norma.objects.bulk_create([
+            Norma(norma=f'N-{i:05d}', organizacao=f'ORG{i % 9}', titulo=f'Norma tecnica {i}',
+                  revisao_atual=revisao + timedelta(days=i % 1500))
+            for i in range(cls.TOTAL_NORMAS)
+        ])
+        normas = list(Norma.objects.order_by('pk').values_list('pk', flat=True))
+
+        Cliente.objects.bulk_create([
+            Cliente(empresa=f'Cliente {i}', cnpj=f'{i:014d}', dominio=f'cliente{i}.com', endereco='Rua', cidade='SP',
+                    estado='SP', cep='00000000', telefone='0', vigencia_contratual_fim=date(2030, 1, 1))
+            for i in range(cls.TOTAL_CLIENTES)
+        ])
+        clientes = list(Cliente.objects.order_by('pk'))
+        NormaCliente.objects.bulk_create([
+            NormaCliente(cliente=cliente, norma_id=normas[(c * 997 + i) % len(normas)],
+                         data_revisao_cliente=revisao + timedelta(days=i % 1000))
+            for c, cliente in enumerate(clientes)
+            for i in range(cls.NORMAS_POR_CLIENTE)
+        ])
+
+        senha = make_password(cls.SENHA)
+        User.objects.bulk_create([
+            User(username=f'u{u}@cliente{c}.com', email=f'u{u}@cliente{c}.com', password=senha)
+            for c in range(cls.TOTAL_CLIENTES)
+            for u in range(cls.USUARIOS_POR_CLIENTE)
+        ])
+        usuarios = list(User.objects.order_by('pk'))
+        PerfilUsuario.objects.bulk_create([
+            PerfilUsuario(usuario=usuario, cliente=clientes[i // cls.USUARIOS_POR_CLIENTE],
+                          pode_gerenciar_auditorias=i % cls.USUARIOS_POR_CLIENTE == 0)
+            for i, usuario in enumerate(usuarios)
+        ])
+        cls.staff = User.objects.create(username='staff@olivian.com', email='staff@olivian.com',
+                                        password=senha, is_staff=True)
+
+        cliente = clientes[0]
+        cls.admin, cls.usuario = usuarios[0], usuarios[1]
+        cls.colegas = [usuario.pk for usuario in usuarios[2:cls.USUARIOS_POR_CLIENTE]]
+        cls.normas_do_cliente = list(
+            NormaCliente.objects.filter(cliente=cliente).order_by('norma_id').values_list('norma_id', flat=True)
+        )
+        cls.norma = Norma.objects.get(pk=cls.normas_do_cliente[0])
+        # Norma sem vinculos, para o DELETE
+        cls.norma_avulsa = Norma.objects.create(norma='AVULSA-1', revisao_atual=revisao)
+        perfil = PerfilUsuario.objects.get(usuario=cls.usuario)
+        perfil.normas_favoritas.add(*cls.normas_do_cliente[:50])
+
+        Notificacao.objects.bulk_create([
+            Notificacao(usuario=usuario, norma_id=normas[(u * 31 + i) % len(normas)], mensagem='Norma atualizada.',
+                        visualizada=i % 4 != 0)
+            for u, usuario in enumerate(usuarios)
+            for i in range(cls.NOTIFICACOES_POR_USUARIO)
+        ])
+        cls.notificacoes = list(
+            Notificacao.objects.filter(usuario=cls.usuario).order_by('-pk').values_list('pk', flat=True)
+        )
+
+        # Thread grande na norma principal: raizes com respostas encadeadas
+        vinculo = NormaCliente.objects.get(cliente=cliente, norma=cls.norma)
+        Comentario.objects.bulk_create([
+            Comentario(norma_cliente=vinculo, usuario=usuarios[i % cls.USUARIOS_POR_CLIENTE], comentario=f'c{i}')
+            for i in range(cls.COMENTARIOS_RAIZ * (1 + cls.RESPOSTAS_POR_RAIZ))
+        ])
+        ids = list(Comentario.objects.filter(norma_cliente=vinculo).order_by('pk').values_list('pk', flat=True))
+        bloco = 1 + cls.RESPOSTAS_POR_RAIZ
+        pais = {}
+        for inicio in range(0, len(ids), bloco):
+            raiz, respostas = ids[inicio], ids[inicio + 1:inicio + bloco]
+            for n, resposta in enumerate(respostas):
+                # Metade responde a raiz, metade a resposta anterior
+                pais[resposta] = raiz if n % 2 == 0 else respostas[n - 1]
+        Comentario.objects.bulk_update(
+            [Comentario(pk=pk, comentario_pai_id=pai) for pk, pai in pais.items()], ['comentario_pai'], batch_size=500,
+        )
+        reconstruir_caminhos()
+        # Comentario do proprio usuario (IsOwnerOrReadOnly), com respostas
+        cls.comentario = Comentario.objects.get(pk=ids[0])
+        Comentario.objects.filter(pk=ids[0]).update(usuario=cls.usuario)
+
+        for modelo, extra in (
+            (Auditoria, {'data_auditoria': revisao}),
+            (Certificacao, {'data_inicio': revisao, 'data_termino': date(2030, 1, 1)}),
+            (CentroDeCusto, {}),
+        ):
+            itens = modelo.objects.bulk_create([
+                modelo(cliente=cliente, nome=f'{modelo.__name__} {i}', **extra) for i in range(cls.VINCULOS_POR_TIPO)
+            ])
+            modelo.normas.through.objects.bulk_create([
+                modelo.normas.through(**{f'{modelo._meta.model_name}_id': item.pk, 'norma_id': norma_id})
+                for item in itens
+                for norma_id in cls.normas_do_cliente[:10]
+            ])
+
+        recalcular_todos_os_resumos()
+        # Em producao as versoes de cada cliente e perfil ja existem (criadas na primeira leitura)
+        VersaoCliente.objects.bulk_create([VersaoCliente(cliente=cliente) for cliente in clientes])
+        VersaoPerfil.objects.bulk_create([VersaoPerfil(perfil=perfil) for perfil in PerfilUsuario.objects.all()])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    # --- Dados usados pelas rotas ---
+
+    def arquivo_importacao(self):
+        linhas = ['norma;organizacao;revisao_atual;cnpj;data_revisao_cliente']
+        linhas += [f'IMP-{i:04d};ISO;2024-01-{1 + i % 28:02d};{0:014d};2023-01-01' for i in range(200)]
+        return SimpleUploadedFile('catalogo.csv', '\n'.join(linhas).encode(), content_type='text/csv')
+
+    def dados_redefinicao(self):
+        return {
+            'uid': urlsafe_base64_encode(force_bytes(self.usuario.pk)),
+            'token': default_token_generator.make_token(self.usuario),
+            'new_password': 'Outra-senha-forte-456',
+        }
+
+    def _url(self, rota):
+        return rota.url.format(
+            norma=self.norma.pk, norma_avulsa=self.norma_avulsa.pk,
+            comentario=self.comentario.pk, notificacao=self.notificacoes[0],
+            normas=','.join(map(str, self.normas_do_cliente[:200])),
+        )
+
+    def _cliente_http(self, rota):
+        usuario = {'cliente': self.usuario, 'admin': self.admin, 'staff': self.staff}.get(rota.usuario)
+        api = APIClient()
+        if usuario is not None:
+            # Token como o do login, com as claims do perfil; a versao das
+            # permissoes ja no cache, como numa sessao em andamento
+            token = RefreshTokenComPerfil.for_user(usuario).access_token
+            api.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            versao_permissoes(usuario.pk)
+        return api, usuario
+
+    def _chamar(self, rota, api, usuario):
+        url = self._url(rota)
+        if rota.metodo == 'stream':
+            return self._ler_stream(url, usuario)
+        dados = rota.dados(self) if callable(rota.dados) else rota.dados
+        if rota.metodo == 'get':
+            resposta = api.get(url)
+        else:
+            resposta = getattr(api, rota.metodo)(url, dados, format=rota.formato)
+        if resposta.streaming:
+            b''.join(resposta.streaming_content)
+        return resposta.status_code
+
+    def _ler_stream(self, url, usuario):
+        token = RefreshTokenComPerfil.for_user(usuario).access_token
+
+        async def ler():
+            resposta = await AsyncClient().get(url, headers={'Authorization': f'Bearer {token}'})
+            conteudo = resposta.streaming_content.__aiter__()
+            try:
+                # retry e o primeiro evento 'contador'
+                for _ in range(2):
+                    await conteudo.__anext__()
+            finally:
+                await conteudo.aclose()
+            return resposta.status_code
+
+        return async_to_sync(ler)()
+
+    def medir(self, rota):
+        """Executa a rota REPETICOES vezes, desfazendo as escritas; devolve as medidas."""
+        caches[ALIAS_CACHE].clear()
+        caches['default'].clear()
+        api, usuario = self._cliente_http(rota)
+        consultas, tempos = [], []
+        for repeticao in range(REPETICOES):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as capturadas:
+                    inicio = time.perf_counter()
+                    codigo = self._chamar(rota, api, usuario)
+                    duracao = (time.perf_counter() - inicio) * 1000
+                transaction.set_rollback(True)
+            self.assertEqual(codigo, rota.status, f'{rota.metodo.upper()} {rota.url} respondeu {codigo}')
+            consultas.append(sum(1 for q in capturadas.captured_queries if not _SAVEPOINT.match(q['sql'])))
+            if repeticao:
+                tempos.append(duracao)
+        tempos = tempos or [duracao]
+        return {
+            'consultas': max(consultas),
+            'p50_ms': round(statistics.median(tempos), 2),
+            'p95_ms': round(percentil(tempos, 95), 2),
+        }
+
+    def test_orcamento_das_rotas(self):
+        referencia = {}
+        if REFERENCIA:
+            with open(REFERENCIA) as arquivo:
+                referencia = json.load(arquivo)
+
+        relatorio = {}
+        for rota in ROTAS:
+            chave = f'{rota.metodo.upper()} {rota.url}'
+            with self.subTest(chave):
+                medidas = relatorio[chave] = self.medir(rota)
+                self.assertLessEqual(
+                    medidas['consultas'], rota.consultas,
+                    f'{chave}: {medidas["consultas"]} queries (orcamento: {rota.consultas})',
+                )
+                if FATOR_LATENCIA is not None:
+                    limite = rota.p95_ms * FATOR_LATENCIA
+                    self.assertLessEqual(
+                        medidas['p95_ms'], limite, f'{chave}: p95 de {medidas["p95_ms"]}ms (limite: {limite}ms)',
+                    )
+                anterior = referencia.get(chave)
+                if anterior:
+                    limite = anterior['p95_ms'] * (1 + TOLERANCIA_REFERENCIA)
+                    self.assertLessEqual(
+                        medidas['p95_ms'], limite,
+                        f'{chave}: p95 de {medidas["p95_ms"]}ms piorou em relacao a referencia ({anterior["p95_ms"]}ms)',
+                    )
+        if RELATORIO:
+            with open(RELATORIO, 'w') as arquivo:
+                json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+
+    def test_todas_as_rotas_tem_orcamento(self):
+        nomes = set()
+        for padrao in get_resolver().url_patterns:
+            for rota in getattr(padrao, 'url_patterns', [padrao]):
+                if isinstance(rota, URLPattern) and rota.name and not str(padrao.pattern).startswith('admin'):
+                    nomes.add(rota.name)
+        self.assertEqual(nomes - {rota.nome for rota in ROTAS}, set())
+
+
+class PaginacaoTests(TestCase):
+    """Paginacao por cursor: percorrer as paginas traz cada linha uma vez, na ordem pedida."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua', cidade='SP',
+                                         estado='SP', cep='0', telefone='0')
+        cls.usuario = User.objects.create(username='u@c.com', email='u@c.com')
+        PerfilUsuario.objects.create(usuario=cls.usuario, cliente=cliente)
+        titulos = ['Bravo', None, 'Alfa', None, 'Charlie']
+        normas = Norma.objects.bulk_create([
+            Norma(norma=f'N-{i}', titulo=titulo, revisao_atual=date(2024, 1, 1 + i % 2))
+            for i, titulo in enumerate(titulos)
+        ])
+        NormaCliente.objects.bulk_create([
+            NormaCliente(cliente=cliente, norma=norma, data_revisao_cliente=date(2024, 1, 1)) for norma in normas
+        ])
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def percorrer(self, url):
+        linhas = []
+        while url:
+            resposta = self.api.get(url)
+            self.assertEqual(resposta.status_code, 200)
+            linhas += resposta.json()['results']
+            url = resposta.json()['next']
+        return linhas
+
+    def ordem_esperada(self, campo, decrescente):
+        # NULL depois na ordem crescente e antes na decrescente; desempate pelo id
+        normas = sorted(Norma.objects.values('id', campo), key=lambda n: (n[campo] is None, n[campo] or '', n['id']),
+                        reverse=decrescente)
+        return [n['id'] for n in normas]
+
+    def test_ordenacao_por_campo_anulavel(self):
+        for ordenacao in ('titulo', '-titulo'):
+            with self.subTest(ordenacao):
+                linhas = self.percorrer(f'/api/minhas-normas/?ordering={ordenacao}&page_size=2')
+                self.assertEqual([linha['id'] for linha in linhas],
+                                 self.ordem_esperada('titulo', ordenacao.startswith('-')))
+
+    def test_ordenacao_com_empates(self):
+        linhas = self.percorrer('/api/minhas-normas/?ordering=-revisao_atual&page_size=2')
+        self.assertEqual(len(linhas), 5)
+        self.assertEqual(len({linha['id'] for linha in linhas}), 5)
+        self.assertEqual([linha['revisao_atual'] for linha in linhas],
+                         sorted((linha['revisao_atual'] for linha in linhas), reverse=True))
+
+    def test_cursor_invalido(self):
+        self.assertEqual(self.api.get('/api/minhas-normas/?cursor=invalido').status_code, 404)
+
+
+class FiltrosMinhasNormasTests(TestCase):
+    """?status e ?favorita de /api/minhas-normas/, com a favorita de cada perfil."""
+
+    @classmethod
+    def setUpTestData(cls):
+        clientes = Cliente.objects.bulk_create([
+            Cliente(empresa=f'Cliente {i}', cnpj=str(i), dominio=f'c{i}.com', endereco='Rua', cidade='SP',
+                    estado='SP', cep='0', telefone='0')
+            for i in range(2)
+        ])
+        cls.normas = Norma.objects.bulk_create([
+            Norma(norma=f'N-{i}', revisao_atual=date(2024, 1, 1)) for i in range(4)
+        ])
+        # Cliente 0: N-0 e N-2 desatualizadas, N-1 atualizada; N-3 so no cliente 1
+        NormaCliente.objects.bulk_create([
+            NormaCliente(cliente=clientes[0], norma=cls.normas[i], data_revisao_cliente=date(2023 + i % 2, 1, 1))
+            for i in range(3)
+        ] + [NormaCliente(cliente=clientes[1], norma=cls.normas[i], data_revisao_cliente=date(2024, 1, 1))
+             for i in (1, 3)])
+        cls.usuario, colega, outro = User.objects.bulk_create([
+            User(username=f'{nome}@c.com') for nome in ('usuario', 'colega', 'outro')
+        ])
+        perfil, perfil_colega, perfil_outro = PerfilUsuario.objects.bulk_create([
+            PerfilUsuario(usuario=cls.usuario, cliente=clientes[0]),
+            PerfilUsuario(usuario=colega, cliente=clientes[0]),
+            PerfilUsuario(usuario=outro, cliente=clientes[1]),
+        ])
+        # So a N-0 e favorita do usuario; a do colega e a do outro cliente nao contam
+        perfil.normas_favoritas.add(cls.normas[0])
+        perfil_colega.normas_favoritas.add(cls.normas[1])
+        perfil_outro.normas_favoritas.add(cls.normas[1], cls.normas[3])
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def listar(self, consulta):
+        resposta = self.api.get(f'/api/minhas-normas/?{consulta}')
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        dados = resposta.json()
+        linhas = dados['results'] if isinstance(dados, dict) else dados
+        return {linha['norma']: (linha['status_atualizado'], linha['is_favorita']) for linha in linhas}
+
+    def test_cada_valor_dos_filtros(self):
+        n0 = ('DESATUALIZADO', True)
+        n1 = ('ATUALIZADO', False)
+        n2 = ('DESATUALIZADO', False)
+        casos = {
+            '': {'N-0': n0, 'N-1': n1, 'N-2': n2},
+            'status=DESATUALIZADO': {'N-0': n0, 'N-2': n2},
+            'status=atualizado': {'N-1': n1},
+            'favorita=true': {'N-0': n0},
+            'favorita=1': {'N-0': n0},
+            'favorita=sim': {'N-0': n0},
+            'favorita=false': {'N-1': n1, 'N-2': n2},
+            'favorita=nao': {'N-1': n1, 'N-2': n2},
+            'status=DESATUALIZADO&favorita=false': {'N-2': n2},
+            'status=ATUALIZADO&favorita=true': {},
+        }
+        for consulta, esperado in casos.items():
+            with self.subTest(consulta):
+                self.assertEqual(self.listar(consulta), esperado)
+
+    def test_status_invalido(self):
+        resposta = self.api.get('/api/minhas-normas/?status=VENCIDA')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('ATUALIZADO, DESATUALIZADO', resposta.json()['detail'])
+
+
+class ExportacaoTests(TestCase):
+    """Exportacao do acervo: cabecalho, linhas so do cliente do usuario e resposta em streaming."""
+    CABECALHO = [titulo for _, titulo in COLUNAS]
+
+    @classmethod
+    def setUpTestData(cls):
+        clientes = Cliente.objects.bulk_create([
+            Cliente(empresa=f'Cliente {i}', cnpj=str(i), dominio=f'c{i}.com', endereco='Rua', cidade='SP',
+                    estado='SP', cep='0', telefone='0')
+            for i in range(2)
+        ])
+        normas = Norma.objects.bulk_create([
+            Norma(norma=f'N-{i}', organizacao='ISO', titulo=f'Norma {i}', revisao_atual=date(2024, 1, 1))
+            for i in range(3)
+        ])
+        # Cliente 0: N-0 (desatualizada) e N-1; cliente 1: N-1 e N-2
+        vinculos = NormaCliente.objects.bulk_create([
+            NormaCliente(cliente=clientes[0], norma=normas[0], data_revisao_cliente=date(2023, 1, 1)),
+            NormaCliente(cliente=clientes[0], norma=normas[1], data_revisao_cliente=date(2024, 1, 1)),
+            NormaCliente(cliente=clientes[1], norma=normas[1], data_revisao_cliente=date(2024, 1, 1)),
+            NormaCliente(cliente=clientes[1], norma=normas[2], data_revisao_cliente=date(2023, 1, 1)),
+        ])
+        cls.usuarios = User.objects.bulk_create([User(username=f'u{i}@c{i}.com') for i in range(2)])
+        perfis = PerfilUsuario.objects.bulk_create([
+            PerfilUsuario(usuario=usuario, cliente=cliente) for usuario, cliente in zip(cls.usuarios, clientes)
+        ])
+        perfis[0].normas_favoritas.add(normas[1])
+        Comentario.objects.create(norma_cliente=vinculos[0], usuario=cls.usuarios[0], comentario='c')
+        # Auditorias dos dois clientes na mesma norma: cada um ve so a sua
+        for cliente in clientes:
+            Auditoria.objects.create(cliente=cliente, nome=f'Auditoria {cliente.empresa}',
+                                     data_auditoria=date(2024, 1, 1)).normas.add(normas[1])
+
+    def exportar(self, usuario, formato):
+        api = APIClient()
+        api.force_authenticate(usuario)
+        resposta = api.get(f'/api/minhas-normas/exportar/?formato={formato}')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIsInstance(resposta, StreamingHttpResponse)
+        self.assertIn(f'.{formato}"', resposta['Content-Disposition'])
+        return resposta, b''.join(resposta.streaming_content)
+
+    def test_csv(self):
+        resposta, conteudo = self.exportar(self.usuarios[0], 'csv')
+        self.assertEqual(resposta['Content-Type'], 'text/csv; charset=utf-8')
+        texto = conteudo.decode('utf-8')
+        self.assertTrue(texto.startswith('\ufeff'))
+        cabecalho, *linhas = csv.reader(StringIO(texto[1:]), delimiter=';')
+        self.assertEqual(cabecalho, self.CABECALHO)
+        self.assertEqual([dict(zip(cabecalho, linha)) for linha in linhas], [
+            {'Organizacao': 'ISO', 'Norma': 'N-0', 'Titulo': 'Norma 0', 'Idioma': 'portugues', 'Formato': 'digital',
+             'Revisao atual': '2024-01-01', 'Sua revisao': '2023-01-01', 'Status': 'DESATUALIZADO',
+             'Favorita': 'Nao', 'Comentarios': '1', 'Auditorias': '', 'Certificacoes': '', 'Centros de custo': '',
+             'Observacoes': ''},
+            {'Organizacao': 'ISO', 'Norma': 'N-1', 'Titulo': 'Norma 1', 'Idioma': 'portugues', 'Formato': 'digital',
+             'Revisao atual': '2024-01-01', 'Sua revisao': '2024-01-01', 'Status': 'ATUALIZADO',
+             'Favorita': 'Sim', 'Comentarios': '0', 'Auditorias': 'Auditoria Cliente 0', 'Certificacoes': '',
+             'Centros de custo': '', 'Observacoes': ''},
+        ])
+
+        _, conteudo = self.exportar(self.usuarios[1], 'csv')
+        linhas = list(csv.reader(StringIO(conteudo.decode('utf-8-sig')), delimiter=';'))[1:]
+        self.assertEqual([(linha[1], linha[7], linha[8], linha[10]) for linha in linhas], [
+            ('N-1', 'ATUALIZADO', 'Nao', 'Auditoria Cliente 1'),
+            ('N-2', 'DESATUALIZADO', 'Nao', ''),
+        ])
+
+    def test_xlsx(self):
+        resposta, conteudo = self.exportar(self.usuarios[1], 'xlsx')
+        self.assertEqual(resposta['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        aba = openpyxl.load_workbook(BytesIO(conteudo), read_only=True).active
+        cabecalho, *linhas = aba.iter_rows(values_only=True)
+        self.assertEqual(list(cabecalho), self.CABECALHO)
+        self.assertEqual([(linha[1], linha[5].date(), linha[7], linha[9]) for linha in linhas], [
+            ('N-1', date(2024, 1, 1), 'ATUALIZADO', 0),
+            ('N-2', date(2024, 1, 1), 'DESATUALIZADO', 0),
+        ])
+
+    def test_formato_invalido(self):
+        api = APIClient()
+        api.force_authenticate(self.usuarios[0])
+        self.assertEqual(api.get('/api/minhas-normas/exportar/?formato=pdf').status_code, 400)
+
+
+class ImportacaoTests(TestCase):
+    """Erros de linha no relatorio, nunca um 500; CSV do Excel em cp1252."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create(username='staff@olivian.com', email='staff@olivian.com', is_staff=True)
+
+    def importar(self, conteudo):
+        api = APIClient()
+        api.force_authenticate(self.staff)
+        arquivo = SimpleUploadedFile('catalogo.csv', conteudo, content_type='text/csv')
+        resposta = api.post('/api/normas/importar/', {'arquivo': arquivo}, format='multipart')
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def test_colunas_acima_do_tamanho(self):
+        relatorio = self.importar(
+            'norma;organizacao;titulo;revisao_atual\n'
+            f'N-1;{"O" * 250};Titulo;2024-01-01\n'
+            f'N-2;ISO;{"T" * 201};2024-01-01\n'
+            'N-3;ISO;Titulo;2024-01-01\n'.encode()
+        )
+        self.assertEqual(relatorio['normas_gravadas'], 1)
+        self.assertEqual(relatorio['erros'], [
+            {'linha': 2, 'erros': ['organizacao: mais de 200 caracteres']},
+            {'linha': 3, 'erros': ['titulo: mais de 200 caracteres']},
+        ])
+
+    def test_csv_em_cp1252(self):
+        conteudo = 'norma;organizacao;titulo;revisao_atual\nN-1;ABNT;Inspeção;01/02/2024\n'
+        relatorio = self.importar(conteudo.encode('cp1252'))
+        self.assertEqual(relatorio['total_erros'], 0)
+        self.assertEqual(Norma.objects.get(norma='N-1').titulo, 'Inspeção')
+
+    def test_um_erro_por_campo(self):
+        relatorio = self.importar(b'norma;revisao_atual\nN-1;31/02/2024\n')
+        self.assertEqual(len(relatorio['erros'][0]['erros']), 1)
+        self.assertTrue(relatorio['erros'][0]['erros'][0].startswith('revisao_atual: data invalida'))
+
+
+class CaminhosDeComentariosTests(TestCase):
+    """
+    Caminho materializado das threads: a -> b -> c e d, raiz a parte.
+    Cada teste confere caminho e profundidade de todos os comentarios.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua', cidade='SP',
+                                         estado='SP', cep='0', telefone='0')
+        norma = Norma.objects.create(norma='N-1', revisao_atual=date(2024, 1, 1))
+        cls.vinculo = NormaCliente.objects.create(cliente=cliente, norma=norma, data_revisao_cliente=date(2024, 1, 1))
+        cls.usuario = User.objects.create(username='u@c.com', email='u@c.com')
+
+    def setUp(self):
+        self.a = self.comentar('a')
+        self.b = self.comentar('b', self.a)
+        self.c = self.comentar('c', self.b)
+        self.d = self.comentar('d')
+
+    def comentar(self, texto, pai=None):
+        return Comentario.objects.create(norma_cliente=self.vinculo, usuario=self.usuario, comentario=texto,
+                                         comentario_pai=pai)
+
+    def arvore(self):
+        """{texto: (caminho, profundidade)} como esta no banco."""
+        return {
+            texto: (caminho, profundidade)
+            for texto, caminho, profundidade in Comentario.objects.values_list('comentario', 'caminho', 'profundidade')
+        }
+
+    def esperado(self, *ramos):
+        # Cada ramo e a sequencia de comentarios da raiz ate a folha
+        arvore = {}
+        for ramo in ramos:
+            for nivel in range(len(ramo)):
+                caminho = '.'.join(f'{comentario.pk:010d}' for comentario in ramo[:nivel + 1])
+                arvore[ramo[nivel].comentario] = (caminho, nivel)
+        return arvore
+
+    def test_caminhos_na_criacao(self):
+        self.assertEqual(self.arvore(), self.esperado((self.a, self.b, self.c), (self.d,)))
+
+    def test_mover_subarvore(self):
+        self.b.comentario_pai = self.d
+        self.b.save()
+        self.assertEqual(self.arvore(), self.esperado((self.a,), (self.d, self.b, self.c)))
+
+        # De volta a raiz: as respostas sobem um nivel
+        self.b.comentario_pai = None
+        self.b.save()
+        self.assertEqual(self.arvore(), self.esperado((self.a,), (self.b, self.c), (self.d,)))
+
+    def test_mover_para_a_propria_subarvore(self):
+        for pai in (self.c, self.a):
+            with self.subTest(pai=pai.comentario):
+                self.a.comentario_pai = pai
+                with self.assertRaises(ValidationError):
+                    self.a.save()
+                # O save inteiro e desfeito, inclusive o novo comentario_pai
+                self.assertIsNone(Comentario.objects.get(pk=self.a.pk).comentario_pai_id)
+        self.assertEqual(self.arvore(), self.esperado((self.a, self.b, self.c), (self.d,)))
+
+    def test_limite_de_profundidade(self):
+        with mock.patch('gestao_normas.models.PROFUNDIDADE_LIMITE', 2):
+            with self.assertRaisesMessage(ValidationError, 'Limite de 2 niveis de resposta atingido.'):
+                self.comentar('e', self.c)
+            # Mover para baixo do limite tambem e recusado
+            self.d.comentario_pai = self.c
+            with self.assertRaises(ValidationError):
+                self.d.save()
+        self.assertEqual(self.arvore(), self.esperado((self.a, self.b, self.c), (self.d,)))
+
+    def test_exclusao_com_respostas(self):
+        self.assertEqual(excluir_com_respostas([self.b.pk]), 2)
+        self.assertEqual(self.arvore(), self.esperado((self.a,), (self.d,)))
+        self.assertEqual(self.a.delete()[0], 1)
+        self.assertEqual(self.arvore(), self.esperado((self.d,)))
+
+    def test_reconstruir_caminhos(self):
+        Comentario.objects.update(caminho='', profundidade=0)
+        saida = StringIO()
+        call_command('reconstruir_caminhos_comentarios', stdout=saida)
+        self.assertIn('4 comentários atualizados', saida.getvalue())
+        self.assertEqual(self.arvore(), self.esperado((self.a, self.b, self.c), (self.d,)))
+        # Sem nada a corrigir, nenhuma linha e reescrita
+        self.assertEqual(reconstruir_caminhos(), 0)
+
+
+class CacheEntreProcessosTests(TestCase):
+    """
+    Escritas feitas por outro worker: a invalidacao dele nao alcanca o cache
+    por processo deste, simulado aqui com escritas que nao disparam sinais.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua',
+                                             cidade='SP', estado='SP', cep='0', telefone='0')
+        cls.norma = Norma.objects.create(norma='N-1', titulo='Antigo', revisao_atual=date(2024, 1, 1))
+        NormaCliente.objects.create(cliente=cls.cliente, norma=cls.norma, data_revisao_cliente=date(2024, 1, 1))
+
+    def setUp(self):
+        caches[ALIAS_CACHE].clear()
+
+    def test_revisoes_seguem_a_versao_do_cliente(self):
+        self.assertEqual(revisoes_do_cliente(self.cliente.pk), {self.norma.pk: date(2024, 1, 1)})
+        NormaCliente.objects.filter(cliente=self.cliente).update(data_revisao_cliente=date(2024, 6, 1))
+        incrementar_versoes([self.cliente.pk])
+        self.assertEqual(revisoes_do_cliente(self.cliente.pk), {self.norma.pk: date(2024, 6, 1)})
+
+    def test_normas_expiram_logo_no_cache_local(self):
+        self.assertEqual(obter_norma(self.norma.pk).titulo, 'Antigo')
+        Norma.objects.filter(pk=self.norma.pk).update(titulo='Novo')
+        self.assertEqual(obter_norma(self.norma.pk).titulo, 'Antigo')
+        with mock.patch('time.time', return_value=time.time() + TIMEOUT_LOCAL + 1):
+            self.assertEqual(obter_norma(self.norma.pk).titulo, 'Novo')
+
+    def test_gravacao_atrasada_nao_volta_ao_cache(self):
+        cache = caches[ALIAS_CACHE]
+        set_many = cache.set_many
+
+        def concorrente(valores, *args, **kwargs):
+            # Outra requisicao altera a norma e invalida o cache depois que esta leu
+            # o banco, mas antes de gravar a linha antiga
+            if any(isinstance(valor, tuple) for valor in valores.values()):
+                with self.captureOnCommitCallbacks(execute=True):
+                    Norma.objects.filter(pk=self.norma.pk).update(titulo='Novo')
+                    invalidar_normas([self.norma.pk])
+            return set_many(valores, *args, **kwargs)
+
+        with mock.patch.object(cache, 'set_many', side_effect=concorrente):
+            self.assertEqual(obter_norma(self.norma.pk).titulo, 'Antigo')
+        self.assertEqual(obter_norma(self.norma.pk).titulo, 'Novo')
+
+
+@override_settings(NOTIFICACOES_PUBSUB='local')
+class RespostaCondicionalTests(TestCase):
+    """ETags das leituras do cliente: 304 enquanto as versoes do cliente e do perfil nao mudam."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua',
+                                             cidade='SP', estado='SP', cep='0', telefone='0')
+        cls.usuario = User.objects.create(username='u@c.com', email='u@c.com')
+        cls.perfil = PerfilUsuario.objects.create(usuario=cls.usuario, cliente=cls.cliente)
+        cls.norma = Norma.objects.create(norma='N-1', revisao_atual=date(2024, 1, 1))
+        cls.vinculo = NormaCliente.objects.create(cliente=cls.cliente, norma=cls.norma,
+                                                  data_revisao_cliente=date(2023, 1, 1))
+        Notificacao.objects.bulk_create([
+            Notificacao(usuario=cls.usuario, norma=cls.norma, mensagem='Norma atualizada.') for _ in range(3)
+        ])
+        cls.comentario = Comentario.objects.create(norma_cliente=cls.vinculo, usuario=cls.usuario, comentario='raiz')
+        Comentario.objects.create(norma_cliente=cls.vinculo, usuario=cls.usuario, comentario='resposta',
+                                  comentario_pai=cls.comentario)
+
+    def setUp(self):
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def versoes(self):
+        return (VersaoCliente.objects.get(cliente=self.cliente).versao,
+                VersaoPerfil.objects.get(perfil=self.perfil).versao)
+
+    def assertIncrementa(self, escrita, do_perfil):
+        # A primeira leitura cria as linhas das versoes; escritas antes dela sao ignoradas
+        self.api.get('/api/minhas-normas/')
+        cliente, perfil = self.versoes()
+        escrita()
+        depois_cliente, depois_perfil = self.versoes()
+        self.assertGreater(depois_perfil if do_perfil else depois_cliente, perfil if do_perfil else cliente)
+        if do_perfil:
+            # Escritas do proprio usuario nao invalidam as leituras dos demais
+            self.assertEqual(depois_cliente, cliente)
+
+    def test_resposta_304_com_a_mesma_versao(self):
+        for url in ('/api/minhas-normas/', '/api/notificacoes/', '/api/dashboard/metrics/'):
+            with self.subTest(url):
+                resposta = self.api.get(url)
+                self.assertEqual(resposta.status_code, 200)
+                etag = resposta['ETag']
+                self.assertIn('no-cache', resposta['Cache-Control'])
+
+                resposta = self.api.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(resposta.status_code, 304)
+                self.assertEqual(resposta['ETag'], etag)
+                self.assertFalse(resposta.content)
+
+                # Outra URL (filtros, pagina) tem outro ETag
+                self.assertEqual(self.api.get(f'{url}?page_size=1', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_escrita_invalida_o_etag(self):
+        etag = self.api.get('/api/minhas-normas/')['ETag']
+        self.api.post(f'/api/normas/{self.norma.pk}/favoritar/')
+        resposta = self.api.get('/api/minhas-normas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+
+    def test_escritas_incrementam_a_versao(self):
+        def excluir_comentario():
+            # Exclusao da subarvore em SQL, sem post_delete
+            self.assertEqual(self.api.delete(f'/api/comentarios/{self.comentario.pk}/').status_code, 204)
+            self.assertFalse(Comentario.objects.filter(norma_cliente=self.vinculo).exists())
+
+        escritas_do_cliente = {
+            'vinculo': lambda: NormaCliente.objects.filter(pk=self.vinculo.pk).get().save(),
+            'norma': lambda: self.norma.save(),
+            'comentario excluido': excluir_comentario,
+        }
+        escritas_do_perfil = {
+            'favorita pelo perfil': lambda: self.perfil.normas_favoritas.add(self.norma),
+            'favorita pela norma': lambda: self.norma.favoritado_por.remove(self.perfil),
+            'notificacoes lidas': lambda: self.api.post('/api/notificacoes/marcar-lidas/', {}, format='json'),
+            'notificacoes arquivadas': lambda: self.api.post(
+                '/api/notificacoes/arquivar/',
+                {'ids': list(Notificacao.objects.filter(usuario=self.usuario).values_list('pk', flat=True))},
+                format='json',
+            ),
+        }
+        for do_perfil, escritas in ((False, escritas_do_cliente), (True, escritas_do_perfil)):
+            for nome, escrita in escritas.items():
+                with self.subTest(nome):
+                    self.assertIncrementa(escrita, do_perfil)
+
+    def test_favorita_nao_invalida_o_etag_dos_colegas(self):
+        colega = User.objects.create(username='colega@c.com', email='colega@c.com')
+        PerfilUsuario.objects.create(usuario=colega, cliente=self.cliente)
+        api_colega = APIClient()
+        api_colega.force_authenticate(colega)
+        etag_colega = api_colega.get('/api/minhas-normas/')['ETag']
+        etag = self.api.get('/api/minhas-normas/')['ETag']
+
+        self.api.post(f'/api/normas/{self.norma.pk}/favoritar/')
+        self.assertEqual(self.api.get('/api/minhas-normas/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(api_colega.get('/api/minhas-normas/', HTTP_IF_NONE_MATCH=etag_colega).status_code, 304)
+
+
+class ResumosTests(TestCase):
+    """Resumos do dashboard recalculados em todos os caminhos de escrita, inclusive admin e cascatas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua',
+                                             cidade='SP', estado='SP', cep='0', telefone='0')
+        cls.normas = Norma.objects.bulk_create([
+            Norma(norma=f'N-{i}', revisao_atual=date(2024, 1, 1)) for i in range(3)
+        ])
+        # A primeira fica desatualizada para o cliente
+        NormaCliente.objects.bulk_create([
+            NormaCliente(cliente=cls.cliente, norma=norma, data_revisao_cliente=date(2023 + min(i, 1), 1, 1))
+            for i, norma in enumerate(cls.normas)
+        ])
+        recalcular_todos_os_resumos()
+
+    def conformidade(self):
+        resumo = ResumoConformidadeCliente.objects.get(pk=self.cliente.pk)
+        return resumo.total_normas, resumo.normas_desatualizadas
+
+    def test_exclusao_de_vinculos(self):
+        self.assertEqual(self.conformidade(), (3, 1))
+        # Cascata da exclusao da norma, sem passar pela view
+        self.normas[0].delete()
+        self.assertEqual(self.conformidade(), (2, 0))
+        NormaCliente.objects.filter(norma=self.normas[1]).delete()
+        self.assertEqual(self.conformidade(), (1, 0))
+
+    def test_favoritas_fora_da_api(self):
+        # Como no admin do PerfilUsuario ou pelo lado da norma
+        perfis = PerfilUsuario.objects.bulk_create([
+            PerfilUsuario(usuario=User.objects.create(username=f'u{i}@c.com'), cliente=self.cliente) for i in range(2)
+        ])
+
+        def favoritas():
+            return dict(ResumoFavoritosUsuario.objects.values_list('perfil_id', 'normas_favoritas'))
+
+        perfis[0].normas_favoritas.set(self.normas)
+        perfis[1].normas_favoritas.add(self.normas[0])
+        self.assertEqual(favoritas(), {perfis[0].pk: 3, perfis[1].pk: 1})
+        self.normas[1].favoritado_por.remove(perfis[0])
+        self.assertEqual(favoritas(), {perfis[0].pk: 2, perfis[1].pk: 1})
+        self.normas[0].favoritado_por.clear()
+        self.assertEqual(favoritas(), {perfis[0].pk: 1, perfis[1].pk: 0})
+        perfis[0].normas_favoritas.clear()
+        self.assertEqual(favoritas(), {perfis[0].pk: 0, perfis[1].pk: 0})
+
+    def test_exclusao_do_cliente(self):
+        # O resumo sai junto com o cliente, sem ser recriado pelos vinculos
+        self.cliente.delete()
+        self.assertFalse(ResumoConformidadeCliente.objects.exists())
+
+
+@override_settings(NOTIFICACOES_PUBSUB='local')
+class ResumosConcorrentesTests(TransactionTestCase):
+    """Recontagens simultaneas do mesmo resumo: a ultima ve as escritas da outra."""
+
+    def test_comentarios_simultaneos_no_mesmo_cliente(self):
+        cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c.com', endereco='Rua', cidade='SP',
+                                         estado='SP', cep='0', telefone='0')
+        norma = Norma.objects.create(norma='N-1', revisao_atual=date(2024, 1, 1))
+        vinculo = NormaCliente.objects.create(cliente=cliente, norma=norma, data_revisao_cliente=date(2024, 1, 1))
+        usuario = User.objects.create(username='u@c.com', email='u@c.com')
+        atualizar_resumos_clientes([cliente.pk])
+        primeira_recontou = threading.Event()
+
+        def comentar(esperar=None, avisar=None):
+            try:
+                with transaction.atomic():
+                    if esperar:
+                        esperar.wait(5)
+                    # Sem sinais: o lock da versao do cliente serializaria as duas por acaso
+                    Comentario.objects.bulk_create([Comentario(norma_cliente=vinculo, usuario=usuario, comentario='c')])
+                    atualizar_resumos_clientes([cliente.pk])
+                    if avisar:
+                        # Segura o lock enquanto a segunda recontagem comeca
+                        avisar.set()
+                        time.sleep(0.5)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=comentar, kwargs={'avisar': primeira_recontou}),
+            threading.Thread(target=comentar, kwargs={'esperar': primeira_recontou}),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cliente.resumo_conformidade.refresh_from_db()
+        self.assertEqual(cliente.resumo_conformidade.normas_comentadas, 2)
+
+
+class BuscaTests(TestCase):
+    """Busca de normas por texto e codigo."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create(username='u@olivian.com', email='u@olivian.com')
+        Norma.objects.create(norma='GMW 3059', organizacao='GM', revisao_atual=date(2024, 1, 1))
+
+    def test_escopo_cliente_sem_perfil(self):
+        api = APIClient()
+        api.force_authenticate(self.usuario)
+        resposta = api.get('/api/normas/busca/?q=GMW&escopo=cliente')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()['results'], [])
+
+
+class VinculosEmLoteTests(TestCase):
+    """Vinculos de varias normas em uma requisicao: tres queries, so os do cliente."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente, outro = Cliente.objects.bulk_create([
+            Cliente(empresa=f'Cliente {i}', cnpj=str(i), dominio=f'c{i}.com', endereco='Rua', cidade='SP',
+                    estado='SP', cep='0', telefone='0')
+            for i in range(2)
+        ])
+        cls.usuario = User.objects.create(username='u@c0.com', email='u@c0.com')
+        PerfilUsuario.objects.create(usuario=cls.usuario, cliente=cls.cliente)
+        cls.a, cls.b, cls.c, cls.sem_vinculos = Norma.objects.bulk_create([
+            Norma(norma=f'N-{i}', revisao_atual=date(2024, 1, 1)) for i in range(4)
+        ])
+        Auditoria.objects.create(cliente=cls.cliente, nome='Auditoria', data_auditoria=date(2024, 5, 1)).normas.add(
+            cls.a, cls.b)
+        Certificacao.objects.create(cliente=cls.cliente, nome='ISO', data_inicio=date(2024, 1, 1),
+                                    data_termino=date(2027, 1, 1)).normas.add(cls.a)
+        CentroDeCusto.objects.create(cliente=cls.cliente, nome='Fabrica').normas.add(cls.c)
+        Auditoria.objects.create(cliente=outro, nome='De outro cliente', data_auditoria=date(2024, 1, 1)).normas.add(
+            cls.a)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshTokenComPerfil.for_user(self.usuario).access_token}')
+        versao_permissoes(self.usuario.pk)
+
+    def test_normas_informadas(self):
+        with self.assertNumQueries(3):
+            resposta = self.api.get(f'/api/normas/vinculos/?normas={self.a.pk},{self.sem_vinculos.pk}')
+        self.assertEqual(resposta.json(), {
+            str(self.a.pk): {
+                'auditorias': [{'nome': 'Auditoria', 'data_auditoria': '2024-05-01'}],
+                'certificacoes': [{'nome': 'ISO', 'data_termino': '2027-01-01'}],
+                'centros_de_custo': [],
+            },
+            str(self.sem_vinculos.pk): {'auditorias': [], 'certificacoes': [], 'centros_de_custo': []},
+        })
+        # A rota de uma norma devolve o mesmo formato
+        self.assertEqual(self.api.get(f'/api/normas/{self.a.pk}/vinculos/').json(), resposta.json()[str(self.a.pk)])
+
+    def test_acervo_inteiro(self):
+        with self.assertNumQueries(3):
+            resposta = self.api.get('/api/normas/vinculos/')
+        vinculos = resposta.json()
+        self.assertEqual(set(vinculos), {str(self.a.pk), str(self.b.pk), str(self.c.pk)})
+        self.assertEqual(vinculos[str(self.c.pk)]['centros_de_custo'], [{'nome': 'Fabrica'}])
+
+    def test_ids_invalidos(self):
+        self.assertEqual(self.api.get('/api/normas/vinculos/?normas=1,x').status_code, 400)
+
+
+class PermissoesEmMassaTests(TestCase):
+    """Atualizacao em massa: queries fixas qualquer que seja o payload, resultado por usuario."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente, outro = Cliente.objects.bulk_create([
+            Cliente(empresa=f'Cliente {i}', cnpj=str(i), dominio=f'c{i}.com', endereco='Rua', cidade='SP',
+                    estado='SP', cep='0', telefone='0')
+            for i in range(2)
+        ])
+        User.objects.bulk_create([User(username=f'u{i}@c.com', email=f'u{i}@c.com') for i in range(61)])
+        usuarios = list(User.objects.order_by('pk'))
+        cls.admin, cls.colegas, cls.de_fora = usuarios[0], usuarios[1:60], usuarios[60]
+        PerfilUsuario.objects.bulk_create(
+            [PerfilUsuario(usuario=cls.admin, cliente=cls.cliente, pode_gerenciar_auditorias=True,
+                           pode_gerenciar_favoritos=True)]
+            + [PerfilUsuario(usuario=usuario, cliente=cls.cliente, pode_gerenciar_auditorias=i % 2 == 0)
+               for i, usuario in enumerate(cls.colegas)]
+            + [PerfilUsuario(usuario=cls.de_fora, cliente=outro)]
+        )
+
+    def setUp(self):
+        caches['default'].clear()
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshTokenComPerfil.for_user(self.admin).access_token}')
+        versao_permissoes(self.admin.pk)
+
+    def enviar(self, payload):
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.api.put('/api/admin-permissoes/bulk-update/', payload, format='json')
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json(), sum(1 for q in capturadas.captured_queries if not _SAVEPOINT.match(q['sql']))
+
+    def test_queries_nao_crescem_com_o_payload(self):
+        def payload(usuarios):
+            return [{'user_id': u.pk, 'pode_gerenciar_auditorias': False, 'pode_gerenciar_favoritos': True}
+                    for u in usuarios]
+
+        _, poucos = self.enviar(payload(self.colegas[:4]))
+        corpo, muitos = self.enviar(payload(self.colegas[4:]))
+        # Leitura, um UPDATE por (permissao, valor) e a versao das permissoes
+        self.assertEqual(poucos, 4)
+        self.assertEqual(muitos, poucos)
+        self.assertEqual(corpo['detail'], '55 perfis de usuários atualizados com sucesso.')
+        self.assertFalse(PerfilUsuario.objects.filter(usuario__in=self.colegas, pode_gerenciar_auditorias=True).exists())
+        self.assertEqual(PerfilUsuario.objects.filter(usuario__in=self.colegas, pode_gerenciar_favoritos=True).count(), 59)
+
+    def test_resultado_por_usuario(self):
+        primeiro, segundo = self.colegas[0], self.colegas[1]
+        corpo, _ = self.enviar([
+            {'user_id': primeiro.pk, 'pode_gerenciar_auditorias': False, 'pode_gerenciar_precos': True},
+            {'user_id': segundo.pk, 'pode_gerenciar_auditorias': False},
+            {'user_id': self.admin.pk, 'pode_gerenciar_favoritos': False},
+            {'user_id': self.de_fora.pk, 'pode_gerenciar_favoritos': True},
+            {'user_id': 'x'},
+        ])
+        self.assertEqual(corpo['resultados'], [
+            # pode_gerenciar_precos: o admin nao tem, entao nao concede
+            {'user_id': primeiro.pk, 'resultado': 'atualizado', 'alterados': {'pode_gerenciar_auditorias': False}},
+            {'user_id': segundo.pk, 'resultado': 'sem_alteracoes', 'alterados': {}},
+            {'user_id': self.admin.pk, 'resultado': 'proprio_usuario'},
+            {'user_id': self.de_fora.pk, 'resultado': 'nao_encontrado'},
+            {'user_id': 'x', 'resultado': 'invalido'},
+        ])
+        self.assertFalse(PerfilUsuario.objects.get(usuario=primeiro).pode_gerenciar_precos)
+
+
+@override_settings(**HASH_DE_SENHA, INSTRUMENTACAO={'ATIVA': True, 'LOG': False},
+                   DIAGNOSTICO_CONSULTAS={'ATIVO': False})
+class LoginEmEscalaTests(TestCase):
+    """
+    Benchmark do login: vazao com uma base pequena e depois de multiplicar os
+    usuarios. Com o indice de lower(email), a latencia nao cresce com a base
+    (comparada so com ORCAMENTO_FATOR_LATENCIA, como nas rotas).
+    """
+    SENHA = 'Senha-de-teste-123'
+    USUARIOS_INICIAIS = 1000
+    USUARIOS = int(os.environ.get('ORCAMENTO_LOGIN_USUARIOS', 50000))
+    LOGINS = 200
+    # Mediana com a base grande / com a pequena
+    CRESCIMENTO_MAXIMO = 2.0
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.senha = make_password(cls.SENHA)
+        cls.cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='c1.com', endereco='Rua',
+                                             cidade='SP', estado='SP', cep='0', telefone='0')
+        cls.criar_usuarios(0, cls.USUARIOS_INICIAIS)
+        cls.alvos = list(User.objects.order_by('pk')[::cls.USUARIOS_INICIAIS // 20])
+        PerfilUsuario.objects.bulk_create([PerfilUsuario(usuario=usuario, cliente=cls.cliente) for usuario in cls.alvos])
+
+    @classmethod
+    def criar_usuarios(cls, inicio, fim):
+        # E-mails com maiusculas: o login os encontra digitados em minusculas
+        User.objects.bulk_create([
+            User(username=f'u{i}@c{i % 50}.com', email=f'U{i}@C{i % 50}.com', password=cls.senha)
+            for i in range(inicio, fim)
+        ], batch_size=5000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE auth_user')
+
+    def medir(self):
+        """Mediana (segundos) e queries por login."""
+        api = APIClient()
+        tempos = []
+        with CaptureQueriesContext(connection) as capturadas:
+            for i in range(self.LOGINS):
+                email = self.alvos[i % len(self.alvos)].email.lower()
+                inicio = time.perf_counter()
+                resposta = api.post('/api/token/', {'email': email, 'password': self.SENHA}, format='json')
+                tempos.append(time.perf_counter() - inicio)
+                self.assertEqual(resposta.status_code, 200)
+        return statistics.median(tempos), len(capturadas) / self.LOGINS
+
+    def test_login_nao_cresce_com_a_base(self):
+        pequena, consultas = self.medir()
+        self.assertEqual(consultas, 1)
+
+        self.criar_usuarios(self.USUARIOS_INICIAIS, self.USUARIOS)
+        indices, plano = indices_do_plano(usuarios_por_email(self.alvos[0].email))
+        self.assertIn('auth_user_email_lower', indices, plano)
+        grande, _ = self.medir()
+        if FATOR_LATENCIA is None:
+            return
+        self.assertLessEqual(
+            grande, pequena * self.CRESCIMENTO_MAXIMO,
+            f'{1 / pequena:.0f} logins/s com {self.USUARIOS_INICIAIS} usuarios, {1 / grande:.0f} com {self.USUARIOS}',
+        )
+
+    def test_email_sem_diferenciar_maiusculas(self):
+        resposta = APIClient().post('/api/cadastrar-usuario/', {'email': 'u1@C1.com', 'password': 'Senha-forte-123'},
+                                    format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('email', resposta.json())
+
+        resposta = APIClient().post('/api/cadastrar-usuario/', {'email': ' Nova@C1.com', 'password': 'Senha-forte-123'},
+                                    format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertTrue(User.objects.filter(email='nova@c1.com').exists())
+        resposta = APIClient().post('/api/token/', {'email': 'NOVA@c1.com', 'password': 'Senha-forte-123'},
+                                    format='json')
+        self.assertEqual(resposta.status_code, 200)
+
+
+@override_settings(INSTRUMENTACAO={'ATIVA': True, 'AMOSTRAGEM': 1.0, 'SERVER_TIMING': True, 'LOG': False,
+                                   'TOKEN_METRICAS': 'segredo'},
+                   DIAGNOSTICO_CONSULTAS={'ATIVO': False})
+class InstrumentacaoTests(TestCase):
+    """Server-Timing, histogramas por rota e acesso ao endpoint de metricas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usuario = User.objects.create(username='u@olivian.com', email='u@olivian.com')
+        Norma.objects.bulk_create([Norma(norma=f'N-{i}', revisao_atual=date(2024, 1, 1)) for i in range(5)])
+
+    def setUp(self):
+        metricas_requisicoes.zerar()
+        self.api = APIClient()
+        self.api.force_authenticate(self.usuario)
+
+    def test_server_timing_e_histogramas(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.api.get('/api/normas/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertRegex(resposta['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries", ser;dur=[\d.]+, total;dur=[\d.]+')
+        consultas = int(re.search(r'desc="(\d+) queries"', resposta['Server-Timing']).group(1))
+        self.assertEqual(consultas, len(capturadas.captured_queries))
+
+        texto = APIClient().get('/api/metricas/', HTTP_AUTHORIZATION='Metricas segredo').content.decode()
+        rotulos = 'rota="norma-list-create",metodo="GET"'
+        self.assertIn(f'olivian_http_requisicoes_total{{{rotulos},status="200"}} 1', texto)
+        self.assertIn(f'olivian_http_duracao_segundos_count{{{rotulos}}} 1', texto)
+        self.assertIn(f'olivian_http_consultas_bucket{{{rotulos},le="+Inf"}} 1', texto)
+        self.assertIn(f'olivian_http_resposta_bytes_sum{{{rotulos}}} {len(resposta.content)}', texto)
+
+    def test_metricas_exigem_staff_ou_token(self):
+        self.assertEqual(self.api.get('/api/metricas/').status_code, 403)
+        self.assertEqual(APIClient().get('/api/metricas/', HTTP_AUTHORIZATION='Metricas errado').status_code, 401)
+
+
+@override_settings(INSTRUMENTACAO={'ATIVA': True, 'LOG': False},
+                   DIAGNOSTICO_CONSULTAS={'ATIVO': True, 'LIMITE_LENTA_MS': 0, 'LIMITE_REPETICOES': 3})
+class DiagnosticoConsultasTests(TestCase):
+    """Deteccao de N+1, duplicadas e lentas, com o ponto de chamada."""
+
+    def test_analisar_agrupa_por_sql_e_por_parametros(self):
+        sql = 'SELECT * FROM gestao_normas_perfilusuario WHERE usuario_id = %s'
+        consultas = [ConsultaRegistrada(sql, (pk,), 0.001, 'gestao_normas/serializers.py:10 get_x()')
+                     for pk in (1, 2, 3, 3)]
+        consultas.append(ConsultaRegistrada('SELECT 1', (), 0.2, 'gestao_normas/views.py:5 get()'))
+        problemas = analisar(consultas, limite_lenta_ms=100, limite_repeticoes=3)
+
+        self.assertEqual([(item['vezes'], item['locais']) for item in problemas['n_mais_1']],
+                         [(4, ['gestao_normas/serializers.py:10 get_x() (4x)'])])
+        self.assertEqual([item['vezes'] for item in problemas['duplicadas']], [2])
+        self.assertEqual([item['sql'] for item in problemas['lentas']], ['SELECT 1'])
+
+    def test_relatorio_da_requisicao_aponta_o_codigo_do_projeto(self):
+        usuario = User.objects.create(username='u@olivian.com', email='u@olivian.com')
+        api = APIClient()
+        api.force_authenticate(usuario)
+        with self.assertLogs('gestao_normas.diagnostico', 'WARNING') as logs:
+            self.assertEqual(api.get('/api/notificacoes/nao-lidas/?token=segredo').status_code, 200)
+        relatorio = logs.output[0]
+        self.assertIn('GET /api/notificacoes/nao-lidas/ (notificacoes-nao-lidas) 200', relatorio)
+        self.assertNotIn('segredo', relatorio)
+        self.assertRegex(relatorio, r'lenta: [\d.]+ ms\n    em gestao_normas/\w+\.py:\d+ \w+\(\)')
+
+
+@override_settings(CONTEXTO_JWT_CACHE=True, CONTEXTO_JWT_ALIAS_CACHE='default', INSTRUMENTACAO={'LOG': False})
+class ContextoJWTTests(TestCase):
+    """Usuario, perfil e cliente guardados pela validade do token, invalidados nas escritas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='cliente.com', endereco='Rua',
+                                             cidade='SP', estado='SP', cep='0', telefone='0')
+        cls.usuario = User.objects.create(username='u@cliente.com', email='u@cliente.com')
+        cls.perfil = PerfilUsuario.objects.create(usuario=cls.usuario, cliente=cls.cliente)
+
+    def setUp(self):
+        caches['default'].clear()
+        self.api = APIClient()
+        # Token sem as claims do perfil: autenticacao pelo banco
+        self.api.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.usuario).access_token}')
+
+    def test_perfil_carregado_uma_vez_por_token(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api.get('/api/user/profile/').status_code, 200)
+        with self.assertNumQueries(0):
+            resposta = self.api.get('/api/user/profile/')
+        self.assertEqual(resposta.json()['cliente']['id'], self.cliente.pk)
+
+    def test_alteracao_do_perfil_invalida_o_contexto(self):
+        self.assertFalse(self.api.get('/api/user/profile/').json()['permissoes']['pode_gerenciar_auditorias'])
+        perfil = PerfilUsuario.objects.get(pk=self.perfil.pk)
+        perfil.pode_gerenciar_auditorias = True
+        with self.captureOnCommitCallbacks(execute=True):
+            perfil.save()
+        with self.assertNumQueries(1):
+            resposta = self.api.get('/api/user/profile/')
+        self.assertTrue(resposta.json()['permissoes']['pode_gerenciar_auditorias'])
+
+
+@override_settings(INSTRUMENTACAO={'LOG': False})
+class ClaimsDoTokenTests(TestCase):
+    """Cliente e permissoes nas claims: leitura sem query de autenticacao, revogacao pela versao."""
+    SENHA = 'Senha-de-teste-123'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = Cliente.objects.create(empresa='Cliente', cnpj='1', dominio='cliente.com', endereco='Rua',
+                                             cidade='SP', estado='SP', cep='0', telefone='0')
+        cls.admin = User.objects.create_user('admin@cliente.com', 'admin@cliente.com', cls.SENHA)
+        cls.usuario = User.objects.create_user('u@cliente.com', 'u@cliente.com', cls.SENHA)
+        PerfilUsuario.objects.create(usuario=cls.admin, cliente=cls.cliente, pode_gerenciar_auditorias=True,
+                                     pode_gerenciar_favoritos=True)
+        PerfilUsuario.objects.create(usuario=cls.usuario, cliente=cls.cliente)
+        recalcular_todos_os_resumos()
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def login(self, usuario):
+        resposta = APIClient().post('/api/token/', {'email': usuario.email, 'password': self.SENHA}, format='json')
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    def cliente_http(self, access):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return api
+
+    def test_leitura_sem_query_de_autenticacao(self):
+        api = self.cliente_http(self.login(self.usuario)['access'])
+        # Versao das permissoes (cache frio) + contador de nao lidas
+        with self.assertNumQueries(2):
+            self.assertEqual(api.get('/api/notificacoes/nao-lidas/').status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(api.get('/api/notificacoes/nao-lidas/').status_code, 200)
+        # So a listagem: o cliente do filtro vem do token
+        with self.assertNumQueries(1):
+            resposta = api.get('/api/auditorias/')
+        self.assertEqual(resposta.status_code, 200)
+
+    def test_alteracao_de_permissoes_revoga_o_token(self):
+        tokens = self.login(self.usuario)
+        api = self.cliente_http(tokens['access'])
+        self.assertEqual(api.get('/api/auditorias/').status_code, 200)
+
+        admin = self.cliente_http(self.login(self.admin)['access'])
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = admin.put('/api/admin-permissoes/bulk-update/',
+                                 [{'user_id': self.usuario.pk, 'pode_gerenciar_favoritos': True}], format='json')
+        self.assertEqual(resposta.status_code, 200)
+
+        resposta = api.get('/api/auditorias/')
+        self.assertEqual(resposta.status_code, 401)
+        self.assertEqual(resposta.json()['code'], 'token_desatualizado')
+
+        renovado = APIClient().post('/api/token/refresh/', {'refresh': tokens['refresh']}, format='json').json()
+        self.assertEqual(self.cliente_http(renovado['access']).get('/api/auditorias/').status_code, 200)
+        perfil = self.cliente_http(renovado['access']).get('/api/user/profile/').json()
+        self.assertTrue(perfil['permissoes']['pode_gerenciar_favoritos'])
+
+
+class ComandosTests(TestCase):
+    """Validacao das opcoes dos comandos de manutencao."""
+
+    def test_batch_size_invalido(self):
+        comandos = (
+            ('checar_normas_desatualizadas',),
+            ('processar_fila_revisoes',),
+            ('importar_normas', 'catalogo.csv'),
+            ('expurgar_notificacoes',),
+        )
+        for comando in comandos:
+            for valor in (0, -1):
+                with self.subTest(comando=comando[0], batch_size=valor):
+                    with self.assertRaisesMessage(CommandError, '--batch-size deve ser maior que zero.'):
+                        call_command(*comando, batch_size=valor)
+
+    def test_dias_negativo(self):
+        with self.assertRaisesMessage(CommandError, '--dias nao pode ser negativo.'):
+            call_command('expurgar_notificacoes', dias=-1)
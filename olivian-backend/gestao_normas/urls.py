@@ -5,7 +5,9 @@ from .views import (
     NotificacaoListAPIView, NotificacaoDetailAPIView, PasswordResetAPIView, PasswordResetConfirmAPIView, 
     DashboardMetricsAPIView, UserProfileAPIView, FavoritarNormaAPIView, ComentarioListCreateAPIView, 
     AuditoriaListCreateView, CertificacaoListCreateView, CentroDeCustoListCreateView, ComentarioDetailAPIView, 
-    NormaVinculosView,
+    NormaVinculosView, NormasVinculosLoteView, NormaBuscaAPIView, ImportacaoCatalogoAPIView, ExportacaoAcervoAPIView,
+    MetricasCacheAPIView, MetricasRequisicoesAPIView, NotificacaoNaoLidasAPIView, NotificacaoMarcarLidasAPIView,
+    NotificacaoArquivarAPIView, stream_notificacoes, aguardar_notificacoes,
     # NOVAS VIEWS IMPORTADAS
     AdminPermissoesListUpdateView, AdminPermissoesBulkUpdateView 
 )
@@ -13,11 +15,15 @@ from .views import (
 urlpatterns = [
     # Rotas de Normas
     path('normas/', NormaListCreateView.as_view(), name='norma-list-create'),
+    path('normas/busca/', NormaBuscaAPIView.as_view(), name='norma-busca'),
+    path('normas/importar/', ImportacaoCatalogoAPIView.as_view(), name='norma-importar'),
     path('normas/<int:pk>/', NormaDetailView.as_view(), name='norma-detail'),
     path('minhas-normas/', MinhasNormasListAPIView.as_view(), name='minhas-normas'),
+    path('minhas-normas/exportar/', ExportacaoAcervoAPIView.as_view(), name='minhas-normas-exportar'),
     path('normas/<int:pk>/favoritar/', FavoritarNormaAPIView.as_view(), name='norma-favoritar'),
     path('normas/<int:norma_pk>/comentarios/', ComentarioListCreateAPIView.as_view(), name='adicionar-comentario'),
     path('normas/<int:norma_id>/vinculos/', NormaVinculosView.as_view(), name='norma-vinculos'),
+    path('normas/vinculos/', NormasVinculosLoteView.as_view(), name='norma-vinculos-lote'),
 
     # Rotas de Usuário e Autenticação
     path('cadastrar-usuario/', UserRegistrationView.as_view(), name='cadastrar-usuario'),
@@ -38,9 +44,16 @@ urlpatterns = [
     # Rotas de Notificações
     path('notificacoes/', NotificacaoListAPIView.as_view(), name='notificacoes-list'),
     path('notificacoes/<int:pk>/', NotificacaoDetailAPIView.as_view(), name='notificacoes-detail'),
+    path('notificacoes/nao-lidas/', NotificacaoNaoLidasAPIView.as_view(), name='notificacoes-nao-lidas'),
+    path('notificacoes/marcar-lidas/', NotificacaoMarcarLidasAPIView.as_view(), name='notificacoes-marcar-lidas'),
+    path('notificacoes/arquivar/', NotificacaoArquivarAPIView.as_view(), name='notificacoes-arquivar'),
+    path('notificacoes/stream/', stream_notificacoes, name='notificacoes-stream'),
+    path('notificacoes/aguardar/', aguardar_notificacoes, name='notificacoes-aguardar'),
     
     # Rotas de Dashboard
     path('dashboard/metrics/', DashboardMetricsAPIView.as_view(), name='dashboard-metrics'),
+    path('cache/metricas/', MetricasCacheAPIView.as_view(), name='cache-metricas'),
+    path('metricas/', MetricasRequisicoesAPIView.as_view(), name='metricas-requisicoes'),
 
     # Rotas de Administração de Usuários (Antiga e Novas)
     path('gerenciar-funcionarios/', GerenciarFuncionariosView.as_view(), name='gerenciar-funcionarios'),
@@ -0,0 +1,79 @@
+from django.db.models import F, Subquery
+from django.db.models.functions import Now
+
+from .models import VersaoCliente, VersaoPerfil
+
+
+# Cada funcao e um unico UPDATE. Clientes e perfis ainda sem linha sao
+# ignorados: a linha e criada na primeira leitura, antes de qualquer ETag ser
+# emitido. Escritas que so mudam o que o proprio usuario ve (favoritas,
+# notificacoes) incrementam a versao do perfil, e nao a do cliente inteiro.
+
+def _incrementar(versoes):
+    return versoes.update(versao=F('versao') + 1, data_atualizacao=Now())
+
+
+def incrementar_versoes(cliente_ids):
+    cliente_ids = set(cliente_ids)
+    if cliente_ids:
+        _incrementar(VersaoCliente.objects.filter(cliente_id__in=cliente_ids))
+
+
+def incrementar_versoes_das_normas(norma_ids):
+    """Clientes que tem as normas no acervo."""
+    norma_ids = set(norma_ids)
+    if norma_ids:
+        _incrementar(VersaoCliente.objects.filter(cliente__normacliente__norma_id__in=norma_ids))
+
+
+def incrementar_versoes_dos_vinculos(norma_cliente_ids):
+    norma_cliente_ids = set(norma_cliente_ids)
+    if norma_cliente_ids:
+        _incrementar(VersaoCliente.objects.filter(cliente__normacliente__id__in=norma_cliente_ids))
+
+
+def incrementar_versoes_dos_usuarios(usuario_ids):
+    usuario_ids = set(usuario_ids)
+    if usuario_ids:
+        _incrementar(VersaoPerfil.objects.filter(perfil__usuario_id__in=usuario_ids))
+
+
+def incrementar_versoes_dos_perfis(perfil_ids):
+    perfil_ids = set(perfil_ids)
+    if perfil_ids:
+        _incrementar(VersaoPerfil.objects.filter(perfil_id__in=perfil_ids))
+
+
+def incrementar_todas_as_versoes():
+    """Escritas em massa no catalogo (importacao)."""
+    _incrementar(VersaoCliente.objects.all())
+
+
+def versao_do_cliente(cliente_id):
+    versao, _ = VersaoCliente.objects.get_or_create(cliente_id=cliente_id)
+    return versao
+
+
+def versoes_do_perfil(perfil):
+    """
+    (VersaoCliente, VersaoPerfil) do perfil em uma unica query; as linhas
+    ausentes sao criadas, como em versao_do_cliente.
+    """
+    do_perfil = VersaoPerfil.objects.filter(perfil_id=perfil.pk)
+    versao = (
+        VersaoCliente.objects.filter(cliente_id=perfil.cliente_id)
+        .annotate(
+            versao_perfil=Subquery(do_perfil.values('versao')),
+            data_perfil=Subquery(do_perfil.values('data_atualizacao')),
+        )
+        .first()
+    )
+    if versao is None:
+        versao = versao_do_cliente(perfil.cliente_id)
+        versao.versao_perfil = None
+    if versao.versao_perfil is None:
+        versao_perfil, _ = VersaoPerfil.objects.get_or_create(perfil_id=perfil.pk)
+    else:
+        versao_perfil = VersaoPerfil(perfil_id=perfil.pk, versao=versao.versao_perfil,
+                                     data_atualizacao=versao.data_perfil)
+    return versao, versao_perfil
@@ -1,6 +1,8 @@
 from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework.parsers import MultiPartParser
+from rest_framework.exceptions import ParseError, PermissionDenied
+from rest_framework.filters import OrderingFilter
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
@@ -10,17 +12,51 @@ from django.utils.encoding import force_bytes, force_str
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+import asyncio
+import json
+import time
 from django.db.models import Prefetch
 import os
 from django.core.exceptions import ValidationError
 from django.contrib.auth.password_validation import validate_password
 from datetime import date
-from .permissions import IsOwnerOrReadOnly
+from .permissions import IsOwnerOrReadOnly, PodeLerMetricas
+from .busca import buscar_normas
+from .condicional import RespostaCondicionalMixin
+from .cache import metricas as metricas_cache, obter_norma
+from .comentarios import PROFUNDIDADE_MAXIMA, carregar_respostas, contar_respostas_por_raiz
+from .autenticacao import JWTAuthenticationSemEstado, incrementar_versao_permissoes, usuarios_por_email
+from .contexto import anotar_normas_do_cliente, get_contexto_cliente
+from .eventos import canal as canal_de_notificacoes, iniciar_ouvinte
+from .exportacao import gerar_csv, gerar_xlsx, linhas_do_acervo
+from .importacao import ErroImportacao, ImportadorCatalogo
+from .instrumentacao import metricas as metricas_requisicoes
+from .notificacoes import arquivar_notificacoes, enfileirar_revisao, marcar_como_lidas
+from .resumos import (
+    atualizar_resumos_clientes,
+    atualizar_resumos_da_norma,
+    atualizar_resumos_notificacoes,
+    obter_resumo_cliente,
+    obter_resumo_favoritos,
+    obter_resumo_notificacoes,
+)
+from .pagination import (
+    BuscaPagination,
+    ComentarioPagination,
+    NormaPagination,
+    NotificacaoPagination,
+    VinculoPagination,
+)
 from rest_framework import generics
 from rest_framework import viewsets, mixins
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
-from .models import Comentario, NormaCliente, PerfilUsuario, Norma # Certifique-se de importar esses modelos
+from .models import CAMPOS_PERMISSAO, Comentario, NormaCliente, PerfilUsuario, Norma # Certifique-se de importar esses modelos
 from .serializers import ComentarioSerializer # Certifique-se de importar o Serializer
 from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
@@ -37,22 +73,21 @@ from .models import (
     Comentario,
     Auditoria,
     Certificacao,
-    CentroDeCusto
+    CentroDeCusto,
+    ResumoNotificacoesUsuario,
 )
 
 # --- IMPORTS DE SERIALIZERS (REMOVIDO PermissoesUsuarioSerializer) ---
 from .serializers import (
     AuditoriaSerializer,
-    AuditoriaVinculadaSerializer,
     CentroDeCustoSerializer,
-    CentroDeCustoVinculadoSerializer,
     CertificacaoSerializer,
-    CertificacaoVinculadaSerializer,
     ClienteSerializer,
     ComentarioSerializer,
     CustomEmailLoginSerializer,
     NormaSerializer,
     NotificacaoSerializer,
+    NotificacoesEmLoteSerializer,
     PasswordResetConfirmSerializer,
     PerfilUsuarioAdminSerializer,
     PerfilUsuarioSerializer, # AGORA ESTE SERIALIZER FAZ O TRABALHO
@@ -61,16 +96,127 @@ from .serializers import (
 )
 
 
+def _perfil_do_usuario(request):
+    """
+    PerfilUsuario (com o cliente) do usuario logado, carregado uma vez por
+    requisicao pela autenticacao/ContextoCliente; PermissionDenied se nao houver.
+    """
+    perfil = get_contexto_cliente(request).perfil
+    if perfil is None:
+        raise PermissionDenied("Seu perfil de usuario nao esta configurado. Acesso negado.")
+    return perfil
+
+
 class NormaListCreateView(generics.ListCreateAPIView):
     queryset = Norma.objects.all()
     serializer_class = NormaSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NormaPagination
+
+
+class NormaBuscaAPIView(generics.ListAPIView):
+    """
+    Busca textual e aproximada no catalogo de normas, ordenada por relevancia.
+    ?q=<termo> (obrigatorio), ?escopo=catalogo (padrao) ou cliente para
+    restringir as normas do cliente do usuario logado. Sempre paginada.
+    """
+    serializer_class = NormaSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = BuscaPagination
+
+    ESCOPOS_VALIDOS = ('catalogo', 'cliente')
+
+    def get_queryset(self):
+        termo = self.request.query_params.get('q', '').strip()
+        if not termo:
+            raise ParseError("Informe o termo de busca em ?q=.")
+
+        escopo = self.request.query_params.get('escopo', 'catalogo')
+        if escopo not in self.ESCOPOS_VALIDOS:
+            raise ParseError(f"Escopo invalido. Use um de: {', '.join(self.ESCOPOS_VALIDOS)}.")
+
+        cliente_id = None
+        if escopo == 'cliente':
+            cliente_id = get_contexto_cliente(self.request).cliente_id
+            if cliente_id is None:
+                # Vazio, mas com a anotacao 'relevancia' que a paginacao ordena
+                return buscar_normas(termo).none()
+        return buscar_normas(termo, cliente_id)
+
+
+class ImportacaoCatalogoAPIView(APIView):
+    """
+    Importa normas e vinculos norma-cliente de um arquivo CSV/XLSX enviado em
+    'arquivo' (multipart). O arquivo e processado em lotes, sem ser carregado
+    inteiro na memoria. ?dry_run=true apenas valida. Restrita a administradores
+    do sistema, pois o catalogo de normas e compartilhado entre clientes.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        arquivo = request.FILES.get('arquivo')
+        if arquivo is None:
+            return Response({"detail": "Envie o arquivo no campo 'arquivo'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        formato = request.query_params.get('formato') or os.path.splitext(arquivo.name)[1].lstrip('.').lower()
+        dry_run = request.query_params.get('dry_run', '').lower() in ('1', 'true', 'sim')
+        importador = ImportadorCatalogo(dry_run=dry_run)
+        try:
+            relatorio = importador.importar(arquivo, formato)
+        except ErroImportacao as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(relatorio, status=status.HTTP_200_OK)
 
 
 class NormaDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Norma.objects.all()
     serializer_class = NormaSerializer
 
+    def get_object(self):
+        # Leitura servida pelo cache do catalogo; escritas usam o banco
+        if self.request.method != 'GET':
+            return super().get_object()
+        try:
+            norma = obter_norma(self.kwargs['pk'])
+        except Norma.DoesNotExist:
+            raise Http404
+        self.check_object_permissions(self.request, norma)
+        return norma
+
+    def perform_update(self, serializer):
+        revisao_anterior = serializer.instance.revisao_atual
+        with transaction.atomic():
+            norma = serializer.save()
+            # Nova revisao: enfileira os clientes afetados para notificacao
+            if norma.revisao_atual != revisao_anterior:
+                enfileirar_revisao(norma)
+                atualizar_resumos_da_norma(norma)
+
+    def perform_destroy(self, instance):
+        # Os resumos dos clientes sao recalculados pelos sinais dos vinculos
+        with transaction.atomic():
+            instance.delete()
+
+
+class MetricasCacheAPIView(APIView):
+    """Acertos e falhas do cache do catalogo neste processo (?zerar=true reinicia)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        resumo = metricas_cache.resumo()
+        if request.query_params.get('zerar', '').lower() in ('1', 'true', 'sim'):
+            metricas_cache.zerar()
+        return Response(resumo, status=status.HTTP_200_OK)
+
+
+class MetricasRequisicoesAPIView(APIView):
+    """Histogramas por rota deste processo, no formato texto do Prometheus."""
+    permission_classes = [PodeLerMetricas]
+
+    def get(self, request):
+        return HttpResponse(metricas_requisicoes.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 
 class ClienteListCreateView(generics.ListCreateAPIView):
     queryset = Cliente.objects.all()
@@ -83,26 +229,74 @@ class UserRegistrationView(generics.CreateAPIView):
     permission_classes = [AllowAny]
 
 
-class MinhasNormasListAPIView(generics.ListAPIView):
+class MinhasNormasListAPIView(RespostaCondicionalMixin, generics.ListAPIView):
+    """
+    Normas do cliente do usuario logado. Status, favorita, revisao do cliente e
+    contagem de comentarios sao calculados pelo banco, o que permite filtrar
+    (?status=DESATUALIZADO, ?favorita=true) e ordenar (?ordering=-revisao_atual)
+    no servidor.
+    """
     serializer_class = NormaSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NormaPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = [
+        'organizacao', 'norma', 'titulo', 'revisao_atual',
+        'sua_revisao', 'status_atualizado', 'comentarios_count',
+    ]
+    ordering = ['organizacao', 'norma']
+
+    STATUS_VALIDOS = ('ATUALIZADO', 'DESATUALIZADO')
 
     def get_queryset(self):
-        usuario_logado = self.request.user
-        try:
-            # Pre-busca os dados necessarios para evitar N+1 queries
-            perfil_do_usuario = PerfilUsuario.objects.select_related('cliente').get(usuario=usuario_logado)
-            
-            # Aqui, voce ja tem o cliente do usuario.
-            # Agora, busque as normas do cliente e pre-carregue a relacao com NormaCliente.
-            return Norma.objects.filter(
-                normacliente__cliente=perfil_do_usuario.cliente
-            ).prefetch_related(
-                'normacliente_set'
-            )
-        except PerfilUsuario.DoesNotExist:
+        # Perfil ja carregado para o ETag (RespostaCondicionalMixin)
+        perfil_do_usuario = get_contexto_cliente(self.request).perfil
+        if perfil_do_usuario is None:
             return Norma.objects.none()
 
+        normas = anotar_normas_do_cliente(perfil_do_usuario)
+
+        status_filtro = self.request.query_params.get('status')
+        if status_filtro:
+            status_filtro = status_filtro.upper()
+            if status_filtro not in self.STATUS_VALIDOS:
+                raise ParseError(f"Status invalido. Use um de: {', '.join(self.STATUS_VALIDOS)}.")
+            normas = normas.filter(status_atualizado=status_filtro)
+
+        favorita = self.request.query_params.get('favorita')
+        if favorita is not None:
+            normas = normas.filter(is_favorita=favorita.lower() in ('1', 'true', 'sim'))
+
+        return normas
+
+
+class ExportacaoAcervoAPIView(APIView):
+    """
+    Exporta o acervo do cliente (status de revisao, comentarios e vinculos com
+    Auditorias, Certificacoes e Centros de Custo) em ?formato=csv (padrao) ou
+    xlsx. A resposta e gerada em streaming a partir de um cursor no servidor.
+    """
+    permission_classes = [IsAuthenticated]
+
+    TIPOS_CONTEUDO = {
+        'csv': 'text/csv; charset=utf-8',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    }
+
+    def get(self, request):
+        formato = request.query_params.get('formato', 'csv').lower()
+        if formato not in self.TIPOS_CONTEUDO:
+            return Response({"detail": "Formato invalido. Use csv ou xlsx."}, status=status.HTTP_400_BAD_REQUEST)
+        perfil_usuario = get_contexto_cliente(request).perfil
+        if perfil_usuario is None:
+            return Response({"detail": "Perfil de usuario nao encontrado."}, status=status.HTTP_404_NOT_FOUND)
+
+        linhas = linhas_do_acervo(perfil_usuario)
+        conteudo = gerar_csv(linhas) if formato == 'csv' else gerar_xlsx(linhas)
+        response = StreamingHttpResponse(conteudo, content_type=self.TIPOS_CONTEUDO[formato])
+        response['Content-Disposition'] = f'attachment; filename="acervo_{date.today().isoformat()}.{formato}"'
+        return response
+
 
 # CORREÇÃO: Atualizada para usar a nova permissão como checagem de administrador
 class GerenciarFuncionariosView(generics.ListAPIView):
@@ -110,18 +304,13 @@ class GerenciarFuncionariosView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        usuario_logado = self.request.user
-        try:
-            perfil_do_usuario = PerfilUsuario.objects.get(usuario=usuario_logado)
-        except PerfilUsuario.DoesNotExist:
-            raise PermissionDenied("Seu perfil de usuario nao esta configurado. Acesso negado.")
+        perfil_do_usuario = _perfil_do_usuario(self.request)
 
         # ATUALIZAÇÃO DA PERMISSÃO
         if not perfil_do_usuario.pode_gerenciar_auditorias:
             raise PermissionDenied("Voce nao tem permissao para gerenciar funcionarios.")
 
-        cliente_do_usuario = perfil_do_usuario.cliente
-        return PerfilUsuario.objects.filter(cliente=cliente_do_usuario)
+        return PerfilUsuario.objects.filter(cliente_id=perfil_do_usuario.cliente_id).select_related('usuario')
 
 
 # ----------------------------------------------------
@@ -134,10 +323,8 @@ class AdminPermissoesListUpdateView(generics.ListAPIView):
 
     def get_queryset(self):
         usuario_logado = self.request.user
-        
-        try:
-            perfil_do_usuario = PerfilUsuario.objects.get(usuario=usuario_logado)
-        except PerfilUsuario.DoesNotExist:
+        perfil_do_usuario = get_contexto_cliente(self.request).perfil
+        if perfil_do_usuario is None:
             raise PermissionDenied("Seu perfil de usuário não está configurado. Acesso negado.")
 
         # REGRA DE NEGÓCIO CRÍTICA: Somente um Super-Admin pode ver/editar
@@ -145,23 +332,23 @@ class AdminPermissoesListUpdateView(generics.ListAPIView):
         if not perfil_do_usuario.pode_gerenciar_auditorias:
             raise PermissionDenied("Você não tem permissão para administrar usuários.")
 
-        cliente_do_usuario = perfil_do_usuario.cliente
         # Retorna todos os perfis do cliente, exceto o do usuário logado (para evitar que ele tire as próprias permissões)
-        return PerfilUsuario.objects.filter(cliente=cliente_do_usuario).select_related('usuario').exclude(usuario=usuario_logado)
+        return PerfilUsuario.objects.filter(cliente_id=perfil_do_usuario.cliente_id).select_related('usuario').exclude(usuario=usuario_logado)
 
 
 class AdminPermissoesBulkUpdateView(APIView):
     """
     View para receber a lista completa de perfis e atualizar as permissões em massa.
+    Numero fixo de queries qualquer que seja o tamanho da lista: uma leitura dos
+    perfis, no maximo um UPDATE por (permissao, valor) e o da versao das
+    permissoes. Responde com o resultado de cada usuario.
     """
     permission_classes = [IsAuthenticated]
 
     def put(self, request, *args, **kwargs):
         usuario_logado = self.request.user
-        
-        try:
-            perfil_do_admin = PerfilUsuario.objects.get(usuario=usuario_logado)
-        except PerfilUsuario.DoesNotExist:
+        perfil_do_admin = get_contexto_cliente(request).perfil
+        if perfil_do_admin is None:
             return Response({"detail": "Perfil de administrador não encontrado."}, status=status.HTTP_404_NOT_FOUND)
 
         # Verificação de Permissão: Somente quem pode administrar acessa este endpoint
@@ -173,57 +360,67 @@ class AdminPermissoesBulkUpdateView(APIView):
         if not isinstance(data, list):
             return Response({"detail": "Payload deve ser uma lista de usuários."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Mapeia as permissões que o ADMIN logado PODE conceder (só pode conceder o que ele tem)
-        permissoes_admin = {
-            'pode_gerenciar_auditorias': perfil_do_admin.pode_gerenciar_auditorias,
-            'pode_gerenciar_certificacoes': perfil_do_admin.pode_gerenciar_certificacoes,
-            'pode_gerenciar_centros_de_custo': perfil_do_admin.pode_gerenciar_centros_de_custo,
-            'pode_gerenciar_comentarios': perfil_do_admin.pode_gerenciar_comentarios,
-            'pode_gerenciar_precos': perfil_do_admin.pode_gerenciar_precos,
-            'pode_gerenciar_favoritos': perfil_do_admin.pode_gerenciar_favoritos,
-        }
-        
-        # Itera sobre os dados recebidos para aplicar as alterações
-        updates = []
+        # Só pode conceder (ou retirar) as permissões que o ADMIN logado tem
+        campos_permitidos = [campo for campo in CAMPOS_PERMISSAO if getattr(perfil_do_admin, campo)]
+
+        # Valores pedidos por usuario (itens repetidos: o ultimo vale); os
+        # resultados saem na ordem do payload
+        resultados = {}
+        pedidos = {}
         for item in data:
-            user_id = item.get('user_id')
+            user_id = item.get('user_id') if isinstance(item, dict) else None
             if not user_id:
                 continue
-
             try:
-                perfil = PerfilUsuario.objects.select_related('usuario').get(usuario__id=user_id, cliente=perfil_do_admin.cliente)
-                
-                # Impede que o admin logado altere o próprio perfil neste endpoint
-                if perfil.usuario == usuario_logado:
-                    continue 
-
-                campos_alterados = {}
-                permissao_atualizada = False
-                
-                # Verifica e aplica apenas as permissões que o ADMIN logado PODE modificar
-                for campo, pode_modificar in permissoes_admin.items():
-                    if campo in item and pode_modificar:
-                        valor_novo = item[campo]
-                        valor_atual = getattr(perfil, campo)
-                        
-                        if valor_novo != valor_atual:
-                            campos_alterados[campo] = valor_novo
-                            permissao_atualizada = True
-                
-                if permissao_atualizada:
-                    for campo, valor in campos_alterados.items():
-                        setattr(perfil, campo, valor)
-                    updates.append(perfil)
-                    
-            except PerfilUsuario.DoesNotExist:
-                # Ignora usuários que não existem ou não pertencem ao cliente
+                user_id = int(user_id)
+                valores = {
+                    campo: PerfilUsuario._meta.get_field(campo).to_python(item[campo])
+                    for campo in campos_permitidos if campo in item
+                }
+            except (TypeError, ValueError, ValidationError):
+                resultados[str(user_id)] = {"user_id": user_id, "resultado": "invalido"}
                 continue
+            pedidos.setdefault(user_id, {}).update(valores)
+            resultados[str(user_id)] = None
+
+        # Uma leitura para todos os perfis do cliente; o diff e feito em memoria
+        atuais = {
+            perfil['usuario_id']: perfil
+            for perfil in PerfilUsuario.objects.filter(
+                usuario_id__in=pedidos, cliente_id=perfil_do_admin.cliente_id,
+            ).values('id', 'usuario_id', *campos_permitidos)
+        }
 
-        # Salva as alterações no banco de dados
-        # O bulk_update é mais eficiente para atualizar múltiplos objetos
-        PerfilUsuario.objects.bulk_update(updates, list(permissoes_admin.keys()))
+        # (campo, valor) -> ids dos perfis que passam a ter esse valor
+        grupos = {}
+        atualizados = []
+        for user_id, valores in pedidos.items():
+            perfil = atuais.get(user_id)
+            if perfil is None:
+                # Usuários que não existem ou não pertencem ao cliente
+                resultado = {"resultado": "nao_encontrado"}
+            elif user_id == usuario_logado.pk:
+                # Impede que o admin logado altere o próprio perfil neste endpoint
+                resultado = {"resultado": "proprio_usuario"}
+            else:
+                alterados = {campo: valor for campo, valor in valores.items() if perfil[campo] != valor}
+                for campo, valor in alterados.items():
+                    grupos.setdefault((campo, valor), []).append(perfil['id'])
+                if alterados:
+                    atualizados.append(user_id)
+                resultado = {"resultado": "atualizado" if alterados else "sem_alteracoes", "alterados": alterados}
+            resultados[str(user_id)] = {"user_id": user_id, **resultado}
+
+        with transaction.atomic():
+            for (campo, valor), perfil_ids in grupos.items():
+                PerfilUsuario.objects.filter(pk__in=perfil_ids).update(**{campo: valor})
+            # update() nao dispara post_save: invalida os tokens com as permissoes antigas
+            incrementar_versao_permissoes(atualizados)
 
-        return Response({"detail": f"{len(updates)} perfis de usuários atualizados com sucesso."}, status=status.HTTP_200_OK)
+        return Response({
+            "detail": f"{len(atualizados)} perfis de usuários atualizados com sucesso.",
+            "resultados": list(resultados.values()),
+        }, status=status.HTTP_200_OK)
 
 
 # ----------------------------------------------------
@@ -237,12 +434,15 @@ class RevisaoSecundariaHistoricoCreateAPIView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
 
 
-class NotificacaoListAPIView(generics.ListAPIView):
+class NotificacaoListAPIView(RespostaCondicionalMixin, generics.ListAPIView):
     serializer_class = NotificacaoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = NotificacaoPagination
     
     def get_queryset(self):
-        return Notificacao.objects.filter(usuario=self.request.user).order_by('-data_criacao')
+        # ?arquivadas=true lista as arquivadas; por padrao, so as da caixa de entrada
+        arquivadas = self.request.query_params.get('arquivadas', '').lower() in ('1', 'true')
+        return Notificacao.objects.filter(usuario=self.request.user, arquivada=arquivadas).order_by('-data_criacao')
 
 
 class NotificacaoDetailAPIView(generics.RetrieveUpdateAPIView):
@@ -254,6 +454,221 @@ class NotificacaoDetailAPIView(generics.RetrieveUpdateAPIView):
         return Notificacao.objects.filter(usuario=self.request.user)
 
 
+class NotificacaoNaoLidasAPIView(APIView):
+    """Contador de notificacoes nao lidas, lido do resumo mantido (uma busca pela PK)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        resumo = obter_resumo_notificacoes(request.user)
+        return Response({
+            'nao_lidas': resumo.nao_lidas,
+            'ultima_notificacao_id': resumo.ultima_notificacao_id,
+        })
+
+
+class NotificacaoMarcarLidasAPIView(APIView):
+    """
+    POST /api/notificacoes/marcar-lidas/: marca como lidas, em um unico UPDATE,
+    todas as notificacoes nao lidas do usuario ou so as filtradas por 'ids',
+    'ate_id' e 'norma'.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = NotificacoesEmLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        dados = serializer.validated_data
+        alteradas = marcar_como_lidas(
+            request.user, ids=dados.get('ids'), ate_id=dados.get('ate_id'), norma_id=dados.get('norma')
+        )
+        return Response({
+            'atualizadas': alteradas,
+            'nao_lidas': obter_resumo_notificacoes(request.user).nao_lidas,
+        })
+
+
+class NotificacaoArquivarAPIView(APIView):
+    """POST /api/notificacoes/arquivar/ com {"ids": [...]}: arquiva as notificacoes em um UPDATE."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = NotificacoesEmLoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data.get('ids')
+        if not ids:
+            return Response({"detail": "Informe a lista 'ids' das notificações a arquivar."}, status=status.HTTP_400_BAD_REQUEST)
+        alteradas = arquivar_notificacoes(request.user, ids)
+        return Response({
+            'arquivadas': alteradas,
+            'nao_lidas': obter_resumo_notificacoes(request.user).nao_lidas,
+        })
+
+
+# Stream de notificacoes (SSE) e long-poll. Sao views async do Django, sem DRF:
+# servidas pelo ASGI (normas_backend/asgi.py), cada conexao ociosa e so uma
+# corrotina esperando o aviso do canal (gestao_normas/eventos.py), sem thread
+# nem conexao com o banco presas e sem consultar a lista de notificacoes.
+
+# Intervalo dos comentarios ': ping' que mantem a conexao SSE aberta em proxies
+INTERVALO_PING = 25
+# Espera padrao e maxima do long-poll, em segundos
+ESPERA_LONG_POLL = 25
+ESPERA_MAXIMA_LONG_POLL = 55
+# Notificacoes enviadas por vez; as demais vao na leva seguinte
+LIMITE_NOTIFICACOES_POR_ENVIO = 50
+
+
+async def _autenticar_stream(request, token_na_url=False):
+    """
+    (usuario, token) do JWT no cabecalho Authorization; (None, None) se
+    invalido. Com token_na_url, tambem em ?token= (so no SSE: o EventSource do
+    navegador nao envia cabecalhos). A URL vai para os logs de acesso de
+    proxies e servidores: a implantacao deve remover o parametro token deles
+    (ver normas_backend/asgi.py).
+    """
+    autenticador = JWTAuthenticationSemEstado()
+    cabecalho = autenticador.get_header(request)
+    bruto = autenticador.get_raw_token(cabecalho) if cabecalho is not None else None
+    if not bruto and token_na_url:
+        bruto = request.GET.get('token')
+    if not bruto:
+        return None, None
+    try:
+        token = autenticador.get_validated_token(bruto)
+        usuario = await sync_to_async(autenticador.get_user)(token)
+    except (InvalidToken, AuthenticationFailed):
+        return None, None
+    if not usuario.is_active:
+        return None, None
+    return usuario, token
+
+
+def _nao_autenticado():
+    return JsonResponse({'detail': 'As credenciais de autenticação não foram fornecidas ou são inválidas.'}, status=401)
+
+
+def _inteiro_opcional(valor, nome):
+    if valor in (None, ''):
+        return None
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ParseError(f"'{nome}' deve ser um numero inteiro.")
+
+
+def _novidades_do_usuario(usuario_id, desde):
+    """
+    (nao_lidas, ultima_notificacao_id, notificacoes com id > desde). O resumo
+    mantido diz se ha algo novo; a lista so e consultada quando ha.
+    """
+    resumo = ResumoNotificacoesUsuario.objects.filter(pk=usuario_id).first()
+    if resumo is None:
+        atualizar_resumos_notificacoes([usuario_id])
+        resumo = ResumoNotificacoesUsuario.objects.get(pk=usuario_id)
+    novas = []
+    if desde is not None and (resumo.ultima_notificacao_id or 0) > desde:
+        notificacoes = Notificacao.objects.filter(usuario_id=usuario_id, pk__gt=desde).order_by('pk')
+        novas = NotificacaoSerializer(notificacoes[:LIMITE_NOTIFICACOES_POR_ENVIO], many=True).data
+    return resumo.nao_lidas, resumo.ultima_notificacao_id, novas
+
+
+def _evento_sse(evento, dados, id_evento=None):
+    linhas = [f'id: {id_evento}'] if id_evento is not None else []
+    linhas += [f'event: {evento}', f'data: {json.dumps(dados, cls=DjangoJSONEncoder)}']
+    return '\n'.join(linhas) + '\n\n'
+
+
+async def _eventos_de_notificacao(usuario_id, desde, expira_em):
+    # Assina antes da primeira leitura: nada criado entre as duas se perde
+    iniciar_ouvinte()
+    fila = canal_de_notificacoes.assinar(usuario_id)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            nao_lidas, ultima, novas = await sync_to_async(_novidades_do_usuario)(usuario_id, desde)
+            if desde is None:
+                desde = ultima or 0
+            for notificacao in novas:
+                desde = notificacao['id']
+                yield _evento_sse('notificacao', notificacao, id_evento=desde)
+            yield _evento_sse('contador', {'nao_lidas': nao_lidas, 'ultima_notificacao_id': ultima}, id_evento=desde)
+            if len(novas) == LIMITE_NOTIFICACOES_POR_ENVIO:
+                continue
+            # Espera o proximo aviso; encerra quando o token expira (o cliente
+            # reconecta com um token novo e o Last-Event-ID)
+            while True:
+                restante = expira_em - time.time()
+                if restante <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(fila.get(), timeout=min(INTERVALO_PING, restante))
+                    break
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+    finally:
+        canal_de_notificacoes.cancelar(usuario_id, fila)
+
+
+async def stream_notificacoes(request):
+    """
+    GET /api/notificacoes/stream/: server-sent events com as notificacoes
+    novas do usuario ('notificacao') e o contador de nao lidas ('contador').
+    Retoma a partir do cabecalho Last-Event-ID ou de ?desde=<id>. Aceita o JWT
+    em ?token=, para o EventSource.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Método "{request.method}" não permitido.'}, status=405)
+    usuario, token = await _autenticar_stream(request, token_na_url=True)
+    if usuario is None:
+        return _nao_autenticado()
+    try:
+        desde = _inteiro_opcional(request.headers.get('Last-Event-ID') or request.GET.get('desde'), 'desde')
+    except ParseError as e:
+        return JsonResponse({'detail': e.detail}, status=400)
+    resposta = StreamingHttpResponse(
+        _eventos_de_notificacao(usuario.pk, desde, token['exp']),
+        content_type='text/event-stream',
+    )
+    resposta['Cache-Control'] = 'no-cache'
+    # Desliga o buffer do nginx para os eventos sairem na hora
+    resposta['X-Accel-Buffering'] = 'no'
+    return resposta
+
+
+async def aguardar_notificacoes(request):
+    """
+    GET /api/notificacoes/aguardar/?desde=<id>&timeout=<s>: long-poll. Responde
+    assim que houver notificacoes com id maior que 'desde' (ou no timeout, com
+    lista vazia). Sem 'desde', devolve na hora o estado atual do contador.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Método "{request.method}" não permitido.'}, status=405)
+    usuario, token = await _autenticar_stream(request)
+    if usuario is None:
+        return _nao_autenticado()
+    try:
+        desde = _inteiro_opcional(request.GET.get('desde'), 'desde')
+        espera = _inteiro_opcional(request.GET.get('timeout'), 'timeout')
+    except ParseError as e:
+        return JsonResponse({'detail': e.detail}, status=400)
+    espera = ESPERA_LONG_POLL if espera is None else max(0, min(espera, ESPERA_MAXIMA_LONG_POLL))
+
+    iniciar_ouvinte()
+    fila = canal_de_notificacoes.assinar(usuario.pk)
+    try:
+        nao_lidas, ultima, novas = await sync_to_async(_novidades_do_usuario)(usuario.pk, desde)
+        if desde is not None and not novas and espera:
+            try:
+                await asyncio.wait_for(fila.get(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                nao_lidas, ultima, novas = await sync_to_async(_novidades_do_usuario)(usuario.pk, desde)
+    finally:
+        canal_de_notificacoes.cancelar(usuario.pk, fila)
+    return JsonResponse({'nao_lidas': nao_lidas, 'ultima_notificacao_id': ultima, 'results': novas})
+
+
 class CustomLoginAPIView(APIView):
     permission_classes = [AllowAny]
     
@@ -267,9 +682,8 @@ class PasswordResetAPIView(APIView):
     
     def post(self, request):
         email = request.data.get('email')
-        try:
-            user = User.objects.get(email=email)
-        except User.DoesNotExist:
+        user = usuarios_por_email(email).first() if email else None
+        if user is None:
             return Response({"detail": "Nao ha uma conta com este e-mail."}, status=status.HTTP_400_BAD_REQUEST)
         
         # Gerar token e link de redefinicao
@@ -337,31 +751,24 @@ class PasswordResetConfirmAPIView(APIView):
             print(f"Erro inesperado no servidor: {e}")
             return Response({"detail": "Erro interno no servidor."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-class DashboardMetricsAPIView(APIView):
+class DashboardMetricsAPIView(RespostaCondicionalMixin, APIView):
+    """
+    Metricas do dashboard lidas dos resumos mantidos em gestao_normas/resumos.py:
+    perfil, cliente e resumos vem juntos em uma unica query.
+    """
     permission_classes = [IsAuthenticated]
+    # dias_renovacao muda a cada dia mesmo sem escritas
+    depende_do_dia = True
 
     def get(self, request):
         user = request.user
         try:
-            perfil_usuario = PerfilUsuario.objects.select_related('cliente').get(usuario=user)
+            perfil_usuario = PerfilUsuario.objects.select_related(
+                'cliente', 'cliente__resumo_conformidade', 'resumo_favoritos'
+            ).get(usuario=user)
             cliente = perfil_usuario.cliente
-
-            normas = cliente.norma_set.all().prefetch_related(
-                Prefetch(
-                    'normacliente_set',
-                    queryset=NormaCliente.objects.filter(cliente=cliente),
-                    to_attr='norma_do_cliente'
-                )
-            )
-
-            # --- Logica de Risco (ja existente) ---
-            risco_nao_conformidade_count = 0
-            for norma in normas:
-                if norma.norma_do_cliente:
-                    norma_cliente_obj = norma.norma_do_cliente[0]
-                    if norma.revisao_atual and norma_cliente_obj.data_revisao_cliente:
-                        if norma.revisao_atual > norma_cliente_obj.data_revisao_cliente:
-                            risco_nao_conformidade_count += 1
+            resumo = obter_resumo_cliente(cliente)
+            resumo_favoritos = obter_resumo_favoritos(perfil_usuario)
 
             # --- Logica de Renovacao (ja existente) ---
             dias_para_renovacao = 0
@@ -372,21 +779,12 @@ class DashboardMetricsAPIView(APIView):
                 if dias_para_renovacao < 0:
                     dias_para_renovacao = 0
 
-            # --- Logica de Favoritos (ja existente) ---
-            normas_favoritas_count = perfil_usuario.normas_favoritas.count()
-
-            # =================================================================
-            # NOVA LoGICA PARA CONTAR TODAS AS NORMAS COMENTADAS DO CLIENTE
-            # =================================================================
-            # A correção é feita na sua lógica original, garantindo a contagem correta
-            normas_comentadas_count = Comentario.objects.filter(norma_cliente__cliente=cliente).count()
-
             metrics = {
-                "total_normas": normas.count(),
-                "normas_comentadas": normas_comentadas_count,
-                "normas_favoritas": normas_favoritas_count,
+                "total_normas": resumo.total_normas,
+                "normas_comentadas": resumo.normas_comentadas,
+                "normas_favoritas": resumo_favoritos.normas_favoritas,
                 "dias_renovacao": dias_para_renovacao,
-                "risco_nao_conformidade": risco_nao_conformidade_count,
+                "risco_nao_conformidade": resumo.normas_desatualizadas,
             }
             return Response(metrics, status=status.HTTP_200_OK)
 
@@ -402,7 +800,14 @@ class UserProfileAPIView(APIView):
     def get(self, request):
         user = request.user
         try:
-            perfil_usuario = PerfilUsuario.objects.get(usuario=user)
+            if user.get_deferred_fields():
+                # Usuario montado das claims do token: nome, e-mail e cliente em uma query
+                user = get_user_model().objects.select_related('perfilusuario__cliente').get(pk=user.pk)
+                perfil_usuario = user.perfilusuario
+            else:
+                perfil_usuario = get_contexto_cliente(request).perfil
+            if perfil_usuario is None:
+                raise PerfilUsuario.DoesNotExist
             cliente = perfil_usuario.cliente
             
             # 1. Utiliza o PerfilUsuarioSerializer, que já inclui o objeto 'permissoes'
@@ -438,15 +843,19 @@ class FavoritarNormaAPIView(APIView):
 
     def post(self, request, pk):
         try:
-            norma = Norma.objects.get(pk=pk)
-            perfil_usuario = PerfilUsuario.objects.get(usuario=request.user)
-
-            if norma in perfil_usuario.normas_favoritas.all():
-                perfil_usuario.normas_favoritas.remove(norma)
-                return Response({"status": "removida dos favoritos"}, status=status.HTTP_200_OK)
-            else:
-                perfil_usuario.normas_favoritas.add(norma)
-                return Response({"status": "adicionada aos favoritos"}, status=status.HTTP_200_OK)
+            norma = obter_norma(pk)
+            perfil_usuario = get_contexto_cliente(request).perfil
+            if perfil_usuario is None:
+                raise PerfilUsuario.DoesNotExist
+
+            with transaction.atomic():
+                if perfil_usuario.normas_favoritas.filter(pk=norma.pk).exists():
+                    perfil_usuario.normas_favoritas.remove(norma)
+                    resposta = {"status": "removida dos favoritos"}
+                else:
+                    perfil_usuario.normas_favoritas.add(norma)
+                    resposta = {"status": "adicionada aos favoritos"}
+            return Response(resposta, status=status.HTTP_200_OK)
 
         except (Norma.DoesNotExist, PerfilUsuario.DoesNotExist):
             return Response({"error": "Norma ou Perfil nao encontrado"}, status=status.HTTP_404_NOT_FOUND)
@@ -456,34 +865,75 @@ class FavoritarNormaAPIView(APIView):
 class ComentarioListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = ComentarioSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ComentarioPagination
+
+    # ?profundidade=N limita os niveis de respostas (ate PROFUNDIDADE_MAXIMA)
+    profundidade_query_param = 'profundidade'
+
+    def get_norma_cliente(self):
+        if not hasattr(self, '_norma_cliente'):
+            cliente_id = get_contexto_cliente(self.request).cliente_id
+            try:
+                self._norma_cliente = NormaCliente.objects.get(norma__pk=self.kwargs['norma_pk'], cliente_id=cliente_id)
+            except NormaCliente.DoesNotExist:
+                self._norma_cliente = None
+        return self._norma_cliente
 
     def get_queryset(self):
+        # A listagem (e a paginacao) e feita sobre os comentarios raiz; as
+        # respostas vem aninhadas em 'respostas'.
+        norma_cliente = self.get_norma_cliente()
+        if norma_cliente is None:
+            return Comentario.objects.none()
+        return (
+            Comentario.objects.filter(norma_cliente=norma_cliente, comentario_pai__isnull=True)
+            .select_related('usuario')
+            .order_by('data_criacao', 'id')
+        )
+
+    def get_profundidade_maxima(self):
         try:
-            norma_pk = self.kwargs['norma_pk']
-            cliente_do_usuario = self.request.user.perfilusuario.cliente
-            norma_cliente = NormaCliente.objects.get(norma__pk=norma_pk, cliente=cliente_do_usuario)
-            
-            # 🎯 CORREÇÃO FINAL DE ORDENAÇÃO: 🎯
-            # Ordena por:
-            # 1. Comentário Pai (null vem primeiro, garantindo a ordem raiz-filho)
-            # 2. Data de Criação (para garantir a ordem cronológica dentro de cada nível)
-            
-            return Comentario.objects.filter(norma_cliente=norma_cliente).order_by(
-                'comentario_pai__id', 'data_criacao'
+            profundidade = int(self.request.query_params.get(self.profundidade_query_param, PROFUNDIDADE_MAXIMA))
+        except (TypeError, ValueError):
+            raise ParseError("O parâmetro 'profundidade' deve ser um número inteiro.")
+        return max(0, min(profundidade, PROFUNDIDADE_MAXIMA))
+
+    def list(self, request, *args, **kwargs):
+        # Numero fixo de queries para qualquer tamanho de thread: os comentarios
+        # raiz (da pagina, se paginado), as respostas dessas raizes (faixas do
+        # indice por caminho) e o total de respostas por raiz.
+        profundidade_maxima = self.get_profundidade_maxima()
+        raizes = self.filter_queryset(self.get_queryset())
+        pagina = self.paginate_queryset(raizes)
+        if pagina is not None:
+            raizes = pagina
+        raizes = list(raizes)
+        norma_cliente = self.get_norma_cliente()
+        contexto = {**self.get_serializer_context(), 'profundidade_maxima': profundidade_maxima}
+        if norma_cliente is not None:
+            contexto['arvore_respostas'] = carregar_respostas(
+                norma_cliente.pk, raizes=raizes if pagina is not None else None,
+                profundidade_maxima=profundidade_maxima,
             )
-            
-        except (PerfilUsuario.DoesNotExist, NormaCliente.DoesNotExist, AttributeError):
-            return Comentario.objects.none()
+            contexto['respostas_por_raiz'] = contar_respostas_por_raiz(norma_cliente.pk)
+        else:
+            contexto['arvore_respostas'] = {}
+        dados = ComentarioSerializer(raizes, many=True, context=contexto).data
+        if pagina is not None:
+            return self.get_paginated_response(dados)
+        return Response(dados)
 
     # ... (o método 'create' permanece o mesmo que você corrigiu na etapa anterior)
 
     def create(self, request, *args, **kwargs):
         try:
             norma_pk = self.kwargs.get('norma_pk')
-            cliente_do_usuario = request.user.perfilusuario.cliente
+            perfil_usuario = get_contexto_cliente(request).perfil
+            if perfil_usuario is None:
+                raise PerfilUsuario.DoesNotExist
             
             # 1. Encontra a instância NormaCliente
-            norma_cliente = get_object_or_404(NormaCliente, norma__pk=norma_pk, cliente=cliente_do_usuario)
+            norma_cliente = get_object_or_404(NormaCliente, norma__pk=norma_pk, cliente_id=perfil_usuario.cliente_id)
 
             # 2. Captura e Valida os dados
             # Usamos uma cópia mutável do data
@@ -496,7 +946,7 @@ class ComentarioListCreateAPIView(generics.ListCreateAPIView):
             
             if comentario_pai_id:
                 # Converte o ID recebido (do front-end) para o objeto Comentario
-                comentario_pai_obj = get_object_or_404(Comentario, pk=comentario_pai_id) 
+                comentario_pai_obj = get_object_or_404(Comentario, pk=comentario_pai_id, norma_cliente=norma_cliente) 
                 
             # 4. Remove a chave 'norma' bruta que o front-end envia (não precisamos dela)
             data.pop('norma', None) 
@@ -506,11 +956,13 @@ class ComentarioListCreateAPIView(generics.ListCreateAPIView):
             serializer.is_valid(raise_exception=True)
             
             # 6. Salva o comentário, injetando as instâncias como objetos
-            serializer.save(
-                usuario=request.user, 
-                norma_cliente=norma_cliente, # <--- OBJETO NormaCliente
-                comentario_pai=comentario_pai_obj # <--- OBJETO Comentario (Pai)
-            )
+            with transaction.atomic():
+                serializer.save(
+                    usuario=request.user, 
+                    norma_cliente=norma_cliente, # <--- OBJETO NormaCliente
+                    comentario_pai=comentario_pai_obj # <--- OBJETO Comentario (Pai)
+                )
+                atualizar_resumos_clientes([norma_cliente.cliente_id])
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -518,6 +970,8 @@ class ComentarioListCreateAPIView(generics.ListCreateAPIView):
             return Response({"detail": "Perfil de usuário não encontrado."}, status=status.HTTP_400_BAD_REQUEST)
         except NormaCliente.DoesNotExist:
             return Response({"detail": "A norma não está associada ao seu cliente."}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({"detail": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             print(f"Erro inesperado ao criar comentário: {e}")
             return Response({"detail": f"Ocorreu um erro interno ao tentar salvar o comentário. Detalhe: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -526,38 +980,83 @@ class ComentarioListCreateAPIView(generics.ListCreateAPIView):
 class AuditoriaListCreateView(generics.ListCreateAPIView):
     serializer_class = AuditoriaSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = VinculoPagination
 
     def get_queryset(self):
-        return Auditoria.objects.filter(cliente=self.request.user.perfilusuario.cliente)
+        return Auditoria.objects.filter(cliente_id=_perfil_do_usuario(self.request).cliente_id).prefetch_related(
+            Prefetch('normas', queryset=Norma.objects.only('pk'))
+        )
 
     def perform_create(self, serializer):
-        serializer.save(cliente=self.request.user.perfilusuario.cliente)
+        serializer.save(cliente_id=_perfil_do_usuario(self.request).cliente_id)
 
 class CertificacaoListCreateView(generics.ListCreateAPIView):
     serializer_class = CertificacaoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = VinculoPagination
 
     def get_queryset(self):
-        return Certificacao.objects.filter(cliente=self.request.user.perfilusuario.cliente)
+        return Certificacao.objects.filter(cliente_id=_perfil_do_usuario(self.request).cliente_id).prefetch_related(
+            Prefetch('normas', queryset=Norma.objects.only('pk'))
+        )
 
     def perform_create(self, serializer):
-        serializer.save(cliente=self.request.user.perfilusuario.cliente)
+        serializer.save(cliente_id=_perfil_do_usuario(self.request).cliente_id)
 
 class CentroDeCustoListCreateView(generics.ListCreateAPIView):
     serializer_class = CentroDeCustoSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = VinculoPagination
 
     def get_queryset(self):
-        return CentroDeCusto.objects.filter(cliente=self.request.user.perfilusuario.cliente)
+        return CentroDeCusto.objects.filter(cliente_id=_perfil_do_usuario(self.request).cliente_id).prefetch_related(
+            Prefetch('normas', queryset=Norma.objects.only('pk'))
+        )
 
     def perform_create(self, serializer):
-        serializer.save(cliente=self.request.user.perfilusuario.cliente)
+        serializer.save(cliente_id=_perfil_do_usuario(self.request).cliente_id)
 
 class ComentarioDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Comentario.objects.all()
     serializer_class = ComentarioSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            cliente_id = instance.norma_cliente.cliente_id
+            instance.delete()
+            atualizar_resumos_clientes([cliente_id])
+
+# Vinculos de cada norma na resposta: tipo, modelo e campos
+TIPOS_DE_VINCULO = (
+    ('auditorias', Auditoria, ('nome', 'data_auditoria')),
+    ('certificacoes', Certificacao, ('nome', 'data_termino')),
+    ('centros_de_custo', CentroDeCusto, ('nome',)),
+)
+MAXIMO_NORMAS_VINCULOS = 1000
+
+
+def vinculos_por_norma(cliente_id, norma_ids=None):
+    """
+    {norma_id: {'auditorias': [...], 'certificacoes': [...], 'centros_de_custo': [...]}}
+    em dicts simples, com uma query por tipo (tabela M2M unida ao item). Sem
+    norma_ids, todas as normas com algum vinculo do cliente.
+    """
+    def vazios():
+        return {tipo: [] for tipo, _, _ in TIPOS_DE_VINCULO}
+
+    resultado = {norma_id: vazios() for norma_id in norma_ids or ()}
+    for tipo, modelo, campos in TIPOS_DE_VINCULO:
+        item = modelo._meta.model_name
+        linhas = modelo.normas.through.objects.filter(**{f'{item}__cliente_id': cliente_id})
+        if norma_ids is not None:
+            linhas = linhas.filter(norma_id__in=norma_ids)
+        linhas = linhas.order_by('norma_id', f'{item}_id').values_list('norma_id', *(f'{item}__{c}' for c in campos))
+        for norma_id, *valores in linhas:
+            resultado.setdefault(norma_id, vazios())[tipo].append(dict(zip(campos, valores)))
+    return resultado
+
+
 # Adicionado para a tela de Acervo Técnico (Vínculos)
 class NormaVinculosView(APIView):
     """
@@ -567,22 +1066,35 @@ class NormaVinculosView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, norma_id, format=None):
-        if not hasattr(request.user, 'perfilusuario') or not request.user.perfilusuario.cliente:
+        cliente_id = get_contexto_cliente(request).cliente_id
+        if cliente_id is None:
             return Response({"error": "Usuário não tem um cliente associado."}, status=400)
-            
-        cliente = request.user.perfilusuario.cliente
         
-        # Filtra os itens pelo cliente E pelo ID da norma
-        auditorias = Auditoria.objects.filter(cliente=cliente, normas__id=norma_id)
-        certificacoes = Certificacao.objects.filter(cliente=cliente, normas__id=norma_id)
-        centros_de_custo = CentroDeCusto.objects.filter(cliente=cliente, normas__id=norma_id)
+        return Response(vinculos_por_norma(cliente_id, [norma_id])[norma_id])
 
-        auditorias_data = AuditoriaVinculadaSerializer(auditorias, many=True).data
-        certificacoes_data = CertificacaoVinculadaSerializer(certificacoes, many=True).data
-        centros_de_custo_data = CentroDeCustoVinculadoSerializer(centros_de_custo, many=True).data
 
-        return Response({
-            'auditorias': auditorias_data,
-            'certificacoes': certificacoes_data,
-            'centros_de_custo': centros_de_custo_data,
-        })
\ No newline at end of file
+class NormasVinculosLoteView(APIView):
+    """
+    Vinculos de varias normas em uma requisicao, agrupados por norma:
+    ?normas=1,2,3 ou, sem o parametro, todas as normas do cliente com algum
+    vinculo. Tres queries, qualquer que seja o numero de normas.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, format=None):
+        cliente_id = get_contexto_cliente(request).cliente_id
+        if cliente_id is None:
+            return Response({"error": "Usuário não tem um cliente associado."}, status=400)
+
+        norma_ids = None
+        parametro = request.query_params.get('normas')
+        if parametro is not None:
+            try:
+                norma_ids = sorted({int(valor) for valor in parametro.split(',') if valor.strip()})
+            except ValueError:
+                raise ParseError("'normas' deve ser uma lista de ids separados por virgula.")
+            if len(norma_ids) > MAXIMO_NORMAS_VINCULOS:
+                raise ParseError(
+                    f"Informe no maximo {MAXIMO_NORMAS_VINCULOS} normas, ou omita 'normas' para o acervo inteiro."
+                )
+        return Response(vinculos_por_norma(cliente_id, norma_ids))
\ No newline at end of file
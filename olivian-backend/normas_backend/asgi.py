@@ -3,6 +3,16 @@ ASGI config for normas_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+O stream de notificacoes (/api/notificacoes/stream/ e /api/notificacoes/aguardar/)
+usa views async: sirva esta aplicacao com um servidor ASGI (uvicorn, daphne,
+gunicorn com worker uvicorn) para que as conexoes ociosas nao ocupem threads.
+
+O stream aceita o JWT em ?token= (o EventSource do navegador nao envia
+cabecalhos). Remova esse parametro dos logs de acesso do proxy e do servidor
+ASGI; no nginx, por exemplo, registre $uri em vez de $request_uri na rota
+/api/notificacoes/stream/, e no uvicorn use --no-access-log. O long-poll so
+aceita o token no cabecalho Authorization.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
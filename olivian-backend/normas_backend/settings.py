@@ -2,6 +2,8 @@
 Django settings for normas_backend project.
 """
 
+import os
+import sys
 from pathlib import Path
 from datetime import timedelta # Importe o timedelta para a configuracao do JWT
 
@@ -27,6 +29,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres', # Busca textual (SearchVector) e indices de trigramas
     'rest_framework',
     'gestao_normas',
     'rest_framework_simplejwt',
@@ -35,7 +38,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     # O CorsMiddleware DEVE ser o PRIMEIRO para aplicar os cabeçalhos.
     'corsheaders.middleware.CorsMiddleware', 
-    
+    # Logo em seguida, para que o tempo total cubra os demais middlewares
+    'gestao_normas.instrumentacao.InstrumentacaoMiddleware',
+
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +81,26 @@ DATABASES = {
     }
 }
 
+# Cache
+# 'normas' guarda o catalogo de normas e as normas de cada cliente
+# (gestao_normas/cache.py). LocMemCache e um LRU em memoria por processo, com
+# expiracao: nele as normas expiram em cache.TIMEOUT_LOCAL segundos, ja que a
+# invalidacao nao alcanca os outros workers (as normas de cada cliente seguem a
+# versao do cliente no banco). Para compartilhar entre processos, troque por:
+#   'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#   'LOCATION': 'redis://127.0.0.1:6379/1',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'normas': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'normas',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -92,6 +117,17 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Custo do hash de senha: o padrao do Django em producao; ambientes de teste e
+# benchmark podem baixar com a variavel de ambiente
+PASSWORD_HASHERS = [
+    'gestao_normas.senhas.PBKDF2Configuravel',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+SENHA_ITERACOES_PBKDF2 = int(os.environ.get('SENHA_ITERACOES_PBKDF2', 0)) or None
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 
@@ -133,6 +169,57 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
 ]
 
+# Aviso de notificacoes novas ao stream/long-poll (gestao_normas/eventos.py):
+# 'postgres' (LISTEN/NOTIFY, entre processos) ou 'local' (so no processo atual)
+NOTIFICACOES_PUBSUB = 'postgres'
+
+# Cabecalhos do GET condicional legiveis pelo frontend
+CORS_EXPOSE_HEADERS = ['ETag', 'Last-Modified']
+
+# Instrumentacao por requisicao (gestao_normas/instrumentacao.py): cabecalho
+# Server-Timing, log em JSON e histogramas por rota em /api/metricas/.
+# ATIVA = False remove o middleware e os ganchos no banco e nos serializers.
+# O log sai desligado em `manage.py test`: uma linha por requisicao de teste
+# so polui a saida (os testes da instrumentacao ligam o que precisam).
+TESTANDO = sys.argv[1:2] == ['test']
+
+INSTRUMENTACAO = {
+    'ATIVA': True,
+    'AMOSTRAGEM': 1.0,  # fracao das requisicoes medidas
+    'SERVER_TIMING': DEBUG,
+    'LOG': not TESTANDO,
+    'TOKEN_METRICAS': os.environ.get('METRICAS_TOKEN', ''),
+}
+
+# Relatorio de N+1, queries repetidas e lentas por requisicao, com o ponto do
+# codigo que disparou cada uma (gestao_normas/diagnostico.py). Guarda todas as
+# queries da requisicao: so para desenvolvimento/homologacao.
+DIAGNOSTICO_CONSULTAS = {
+    'ATIVO': None,  # None: segue o DEBUG
+    'LIMITE_LENTA_MS': 100,
+    'LIMITE_REPETICOES': 5,  # mesmo SQL N vezes na requisicao = N+1 suspeito
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+        'diagnostico_consultas': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': BASE_DIR / 'diagnostico_consultas.log',
+            'maxBytes': 5 * 1024 * 1024,
+            'backupCount': 5,
+            'encoding': 'utf-8',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'gestao_normas.instrumentacao': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'gestao_normas.diagnostico': {'handlers': ['diagnostico_consultas'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
 # Informa ao Django que o CSRF deve confiar nessas origens para não bloquear POST/PUT
 CSRF_TRUSTED_ORIGINS = [
     "http://localhost:5500", 
@@ -144,10 +231,23 @@ CSRF_TRUSTED_ORIGINS = [
 # Configuracao do Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # Tokens com claims de perfil: sem query de autenticacao; os demais
+        # carregam usuario, perfil e cliente em uma query
+        'gestao_normas.autenticacao.JWTAuthenticationSemEstado',
     )
 }
 
+# Guarda usuario + perfil + cliente ate o token expirar (invalidado pelos
+# sinais ao alterar usuario, perfil ou cliente). So ligue com um cache
+# compartilhado entre os processos (ex.: Redis em CONTEXTO_JWT_ALIAS_CACHE).
+CONTEXTO_JWT_CACHE = False
+CONTEXTO_JWT_ALIAS_CACHE = 'default'
+
+# Por quanto tempo a versao das permissoes (claim 'versao_permissoes') fica no
+# cache de cada processo: com cache local, e o atraso maximo para um token
+# invalidado em outro processo ser recusado
+VERSAO_PERMISSOES_TTL = 60
+
 # Configuracao do django-rest-framework-simplejwt
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
@@ -157,6 +257,8 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
+    # Renova com as claims de cliente/permissoes atuais
+    'TOKEN_REFRESH_SERIALIZER': 'gestao_normas.autenticacao.TokenRefreshComPerfilSerializer',
 }
 
 # Configuracoes de e-mail para desenvolvimento
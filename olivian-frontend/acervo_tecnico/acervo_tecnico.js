@@ -304,7 +304,12 @@ document.addEventListener('DOMContentLoaded', () => {
         const comentariosResponse = await fetchData(`${API_BASE_URL}/normas/${normaAtualId}/comentarios/`);
         listaComentariosContainer.innerHTML = '';
 
-        const comentarios = comentariosResponse && Array.isArray(comentariosResponse) ? comentariosResponse : (comentariosResponse && comentariosResponse.results ? comentariosResponse.results : null);
+        const raizes = comentariosResponse && Array.isArray(comentariosResponse) ? comentariosResponse : (comentariosResponse && comentariosResponse.results ? comentariosResponse.results : null);
+
+        // A API devolve só os comentários raiz, com as respostas aninhadas em 'respostas';
+        // a renderização trabalha sobre a lista plana e faz o threading por comentario_pai.
+        const achatarComentarios = (lista) => lista.flatMap(c => [c, ...achatarComentarios(c.respostas || [])]);
+        const comentarios = raizes ? achatarComentarios(raizes) : null;
 
         if (!comentarios || comentarios.length === 0) {
             listaComentariosContainer.innerHTML = '<p style="text-align:center;color:#888;margin-top:20px;">Nenhum comentário para esta norma ainda.</p>';